@@ -64,10 +64,18 @@ def create_app(config_name):
     login_manager.init_app(app)
     babel.init_app(app)
     api = Api(app)
+    from app import metrics
+    from app.api_v1.representations import output_json
+    api.representation('application/json')(metrics.timed('serialize')(output_json))
+    metrics.init_app(app)
     admin.init_app(app)
-    flask_redis.init_app(app)
+    flask_redis.init_app(app, **app.config['REDIS_OPTIONS'])
     mongo.init_app(app)
     flask_celery.init(app)
+    from .es import es
+    es.init_app(app)
+    from .snapshot import snapshot
+    snapshot.init_app(app)
     #event.listen(Reminder, 'after_insert', on_reminder_save)
 
     if not app.debug and not app.testing and not app.config['SSL_DISABLE']:
@@ -80,10 +88,40 @@ def create_app(config_name):
     from .auth import auth as auth_blueprint
     app.register_blueprint(auth_blueprint, url_prefix='/auth')
 
-    from app.api_v1 import TokenApi, SearchApi, SuggestApi, GdszxSearch
+    from app.api_v1 import TokenApi, SearchApi, SuggestApi, GdszxSearch, ExportApi
     api.add_resource(TokenApi, '/api/v1/token')
     api.add_resource(SearchApi, '/api/v1/search')
     api.add_resource(SuggestApi, '/api/v1/suggest')
     api.add_resource(GdszxSearch, '/api/v1/gdszxsearch')
+    api.add_resource(ExportApi, '/api/v1/export')
+
+    from app import snapshot
+    app.before_first_request(lambda: snapshot.init_snapshot(app))
+
+    from app.api_v1 import cache
+    cache.register_events()
+
+    from app.api_v1 import resolver
+    resolver.register_events()
+    app.before_first_request(lambda: resolver.init_resolver(app))
+
+    from app.api_v1 import tokens
+    app.before_first_request(lambda: tokens.init_tokens(app))
+
+    from app import sensitive
+    sensitive.register_events()
+    app.before_first_request(lambda: sensitive.init_sensitive(app))
+
+    from app import suggest
+    app.before_first_request(lambda: suggest.init_suggest(app))
+
+    app.before_first_request(lambda: metrics.init_metrics(app))
+
+    from app import profiler
+    profiler.init_app(app)
+    app.before_first_request(lambda: profiler.init_profiler(app))
+
+    from app.history import history
+    app.before_first_request(lambda: history.start(app))
 
     return app
\ No newline at end of file
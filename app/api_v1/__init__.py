@@ -1,5 +1,5 @@
 # coding=utf-8
 
-from .views import TokenApi, SearchApi, SuggestApi, GdszxSearch
+from .views import TokenApi, SearchApi, SuggestApi, GdszxSearch, ExportApi
 
-__all__ = ['TokenApi', 'SearchApi', 'SuggestApi', 'GdszxSearch']
\ No newline at end of file
+__all__ = ['TokenApi', 'SearchApi', 'SuggestApi', 'GdszxSearch', 'ExportApi']
\ No newline at end of file
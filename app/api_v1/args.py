@@ -0,0 +1,145 @@
+# coding=utf-8
+
+import re
+from flask import request
+from flask_restful import abort
+from ..metrics import timed
+
+DATE_RE = re.compile(r'^(?:(?!0000)[0-9]{4}-(?:(?:0[1-9]|1[0-2])-(?:0[1-9]|1[0-9]|2[0-8])|(?:0[13-9]|1[0-2])-(?:29|30)|(?:0[13578]|1[02])-31)|(?:[0-9]{2}(?:0[48]|[2468][048]|[13579][26])|(?:0[48]|[2468][048]|[13579][26])00)-02-29)$')
+
+SORT_FIELDS = frozenset(['pdate', 'channel', 'category', 'has_pic', 'has_video', 'author', 'origin'])
+SORT_2_FIELDS = frozenset(['category', 'years', 'channel', 'location', 'times'])
+FILTER_FIELDS = frozenset(['url', 'title'])
+FIELD_RE = re.compile(r'^[A-Za-z_][\w.]*$')
+
+# 数值限制
+def num_limit(value, name):
+	if value.isdigit() is False:
+		raise ValueError("{0} 必须是整数".format(name))
+	number = int(value)
+	if number < 1:
+		raise ValueError("{0} 不能小于1".format(name))
+	elif number > 50:
+		raise ValueError("{0} 不能大于50".format(name))
+	else:
+		return value
+
+# 日期限制
+def date_limit(value, name):
+	if DATE_RE.match(value):
+		return value
+	else:
+		raise ValueError("{0} 必须是有效的日期格式yyyy-mm-dd".format(name))
+
+# 排序字段限制
+def sort_limit(value):
+	return value if value in SORT_FIELDS else '_score'
+
+def sort_2_limit(value):
+	return value if value in SORT_2_FIELDS else '_score'
+
+# 排序顺序限制
+def order_limt(value):
+	if value == 'desc':
+		return '-'
+	else:
+		return ''
+
+# 过滤字段限制
+def filter_limit(value, name):
+	if value in FILTER_FIELDS:
+		return value
+	else:
+		raise ValueError("{0} 只能是url或title".format(name))
+
+# 导出格式限制
+def format_limit(value):
+	return 'csv' if value == 'csv' else 'ndjson'
+
+# 导出字段列表, 逗号分隔
+def fields_limit(value, name):
+	fields = [field.strip() for field in value.split(',') if field.strip()]
+	for field in fields:
+		if not FIELD_RE.match(field):
+			raise ValueError("{0} 包含无效字段 {1}".format(name, field))
+	return fields
+
+class Argument(object):
+	"""
+	与reqparse.Argument相同的参数定义, 在导入时构造一次
+	"""
+	__slots__ = ('name', 'dest', 'type', 'required', 'default', 'help', 'with_name')
+
+	def __init__(self, name, type=str, required=False, default=None, help=None, dest=None):
+		self.name = name
+		self.dest = dest or name
+		self.type = type
+		self.required = required
+		self.default = default
+		self.help = help
+		# 校验函数是否需要参数名, 预先确定调用方式
+		code = getattr(type, '__code__', None)
+		self.with_name = code is not None and code.co_argcount > 1
+
+	def error(self, message):
+		message = self.help.format(error_msg=message) if self.help else message
+		abort(400, message={self.name: message})
+
+	def convert(self, value):
+		try:
+			if self.with_name:
+				return self.type(value, self.name)
+			return self.type(value)
+		except Exception as e:
+			# 与reqparse一致, json中类型不对等任何转换错误都返回400
+			self.error(str(e))
+
+class Args(object):
+	__slots__ = ()
+	_dests = {}
+
+	def __getitem__(self, name):
+		return getattr(self, self._dests.get(name, name))
+
+	def get(self, name, default=None):
+		try:
+			return self[name]
+		except AttributeError:
+			return default
+
+	def to_dict(self):
+		return dict((name, getattr(self, dest)) for name, dest in self._dests.items())
+
+class Schema(object):
+	"""
+	一次遍历解析json和表单/查询参数, 结果保存在带__slots__的对象中
+	"""
+	def __init__(self, name, *arguments):
+		self.arguments = arguments
+		dests = dict((argument.name, argument.dest) for argument in arguments)
+		self.args_class = type(name, (Args,), {'__slots__': tuple(dests.values()), '_dests': dests})
+
+	def defaults(self):
+		return dict((argument.name, argument.default) for argument in self.arguments)
+
+	@timed('parse')
+	def parse(self):
+		data = request.get_json(silent=True)
+		if not isinstance(data, dict):
+			data = None
+		values = request.values
+		args = self.args_class()
+		for argument in self.arguments:
+			name = argument.name
+			if data is not None and name in data:
+				value = data[name]
+			else:
+				value = values.get(name)
+			if value is None:
+				if argument.required:
+					argument.error('Missing required parameter in the JSON body or the post body or the query string')
+				value = argument.default
+			else:
+				value = argument.convert(value)
+			setattr(args, argument.dest, value)
+		return args
@@ -0,0 +1,178 @@
+# coding=utf-8
+
+import json
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+from time import time
+from flask import current_app
+from redis.exceptions import RedisError
+from .. import flask_redis, notify, metrics
+from ..metrics import timed
+
+TOPIC = 'cache'
+
+def canonical_key(*parts):
+    text = json.dumps(parts, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return sha256(text.encode('utf-8')).hexdigest()
+
+class LocalLRU(object):
+    """
+    进程内LRU缓存, 按条目数淘汰, 每个条目带过期时间和所属域名
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, allow_stale=False):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, domain, value = item
+            if expires < time() and not allow_stale:
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl, domain=''):
+        with self._lock:
+            self._data[key] = (time() + ttl, domain, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate(self, domain):
+        with self._lock:
+            keys = [k for k, item in self._data.items() if item[1] == domain]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class ResultCache(object):
+    """
+    两级结果缓存: 进程内LRU + redis共享缓存
+    """
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.local = LocalLRU()
+        self.counters = {'local_hits': 0, 'redis_hits': 0, 'misses': 0, 'sets': 0, 'errors': 0}
+
+    def _redis_key(self, key):
+        return 'search:cache:{0}:{1}'.format(self.namespace, key)
+
+    def _domain_key(self, domain):
+        return 'search:cache:{0}:domain:{1}'.format(self.namespace, domain)
+
+    def key(self, domain, params):
+        return canonical_key(self.namespace, domain, params)
+
+    @timed('cache')
+    def get(self, domain, params, allow_stale=False):
+        config = current_app.config
+        if not config['SEARCH_CACHE_ENABLED']:
+            return None
+        self.local.maxsize = config['SEARCH_CACHE_LOCAL_SIZE']
+        key = self.key(domain, params)
+        value = self.local.get(key)
+        if value is not None:
+            self.counters['local_hits'] += 1
+            return value
+        try:
+            data = flask_redis.get(self._redis_key(key))
+        except RedisError:
+            self.counters['errors'] += 1
+            data = None
+        if data is not None:
+            value = json.loads(data.decode('utf-8') if type(data) == type(b'') else data)
+            self.local.set(key, value, config['SEARCH_CACHE_LOCAL_TTL'], domain)
+            self.counters['redis_hits'] += 1
+            return value
+        if allow_stale:
+            value = self.local.get(key, allow_stale=True)
+            if value is not None:
+                self.counters['local_hits'] += 1
+                return value
+        self.counters['misses'] += 1
+        return None
+
+    @timed('cache')
+    def set(self, domain, params, value, ttl=None):
+        config = current_app.config
+        if not config['SEARCH_CACHE_ENABLED']:
+            return
+        key = self.key(domain, params)
+        ttl = ttl or config['SEARCH_CACHE_TTL']
+        self.local.set(key, value, config['SEARCH_CACHE_LOCAL_TTL'], domain)
+        self.counters['sets'] += 1
+        try:
+            pipe = flask_redis.pipeline(transaction=False)
+            pipe.setex(self._redis_key(key), ttl, json.dumps(value, separators=(',', ':'), ensure_ascii=False))
+            pipe.sadd(self._domain_key(domain), key)
+            # 预热结果的有效期更长, 域名索引保留到最长的那一个过期
+            pipe.expire(self._domain_key(domain), max(ttl, config['PREWARM_TTL']))
+            pipe.execute()
+        except RedisError:
+            self.counters['errors'] += 1
+
+    def invalidate(self, domain):
+        """
+        删除redis中的缓存, 并通知所有worker清理进程内LRU
+        """
+        self.local.invalidate(domain)
+        notify.publish(TOPIC, {'namespace': self.namespace, 'domain': domain})
+        domain_key = self._domain_key(domain)
+        keys = flask_redis.smembers(domain_key)
+        pipe = flask_redis.pipeline(transaction=False)
+        for key in keys:
+            key = key.decode('utf-8') if type(key) == type(b'') else key
+            pipe.delete(self._redis_key(key))
+        pipe.delete(domain_key)
+        pipe.execute()
+        return len(keys)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['local_size'] = len(self.local)
+        return stats
+
+# 搜索结果缓存
+search_cache = ResultCache('search')
+gdszx_cache = ResultCache('gdszx')
+# 政协文史聚合结果缓存, 翻页和排序共用; 与网站无关, 统一记在FACET_SCOPE下
+facet_cache = ResultCache('facets')
+FACET_SCOPE = 'gdszx'
+
+CACHES = dict((cache.namespace, cache) for cache in (search_cache, gdszx_cache, facet_cache))
+
+def on_notify(payload):
+    cache = CACHES.get(payload['namespace'])
+    if cache is not None:
+        cache.local.invalidate(payload['domain'])
+
+def cache_events():
+    values = []
+    for cache in CACHES.values():
+        values.extend(({'cache': cache.namespace, 'event': event}, count) for event, count in cache.counters.items())
+    return values
+
+def cache_sizes():
+    return [({'cache': cache.namespace}, len(cache.local)) for cache in CACHES.values()]
+
+metrics.register('search_cache_events_total', 'counter', 'result cache lookups and writes by outcome', cache_events)
+metrics.register('search_cache_local_entries', 'gauge', 'entries in the in-process result cache', cache_sizes)
+
+def register_events():
+    notify.subscribe(TOPIC, on_notify)
@@ -1,10 +1,15 @@
 # coding=utf-8
 
+import hmac
 from functools import wraps
-from flask import request, jsonify
-from re import search
-from time import time, localtime, strftime
+from flask import request, jsonify, g, current_app
+from re import search, match
+from time import time
 from .. import flask_redis
+from .limiter import get_limiter, token_key, ALLOWED, APPKEY_LIMITED
+from .resolver import resolver
+from .tokens import verify
+from ..metrics import timed
 
 def http_headers(user_agent, referer):
     if search(r'(Windows NT|Mac OS X|Linux|iPhone|Android)', user_agent) != None and search(r'(.com|.cn)', referer) != None:
@@ -37,28 +42,76 @@ def check_timestamp(func):
         return func(*args, **kwargs)
     return decorated
 
-def request_frequency(ip, limit):
-    if flask_redis.exists(ip):
+def request_arg(name):
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and name in data:
+        return data[name]
+    return request.values.get(name)
+
+# appkey只能是字母数字和_.-, 不能拼出其他redis key
+APPKEY_PATTERN = r'^[0-9A-Za-z_.\-]{1,32}$'
+
+def valid_appkey(appkey):
+    return isinstance(appkey, str) and match(APPKEY_PATTERN, appkey) is not None
+
+def signed_token_valid(appkey, token):
+    """
+    signed模式在进程内校验, 同一请求只校验一次
+    """
+    if g.get('verified_token') == (appkey, token):
+        return True
+    site = resolver.lookup(appkey)
+    if site is None or not verify(token, appkey, site.website_id):
         return False
-    ts = strftime('%Y%m%d%H%M', localtime())
-    key = '{0}:{1}'.format(ip, ts)
-    d = flask_redis.get(key)
-    if d is not None and int(d) > limit:
-        flask_redis.setex(ip, 300, 'blocked')
+    g.verified_token = (appkey, token)
+    return True
+
+@timed('ratelimit')
+def request_frequency(ip, appkey=None, token=None):
+    site = resolver.lookup(appkey) if appkey else None
+    token = token if isinstance(token, str) else None
+    verified = bool(appkey and token) and current_app.config['API_TOKEN_FORMAT'] == 'signed' and signed_token_valid(appkey, token)
+    status, stored = get_limiter().hit(ip, appkey, site.frequent if site is not None else 0, token, verified)
+    if status != ALLOWED:
+        return status
+    g.token_appkey = appkey
+    g.token = stored
+    return status
+
+def request_token(appkey):
+    if g.get('token_appkey') == appkey:
+        return g.token
+    token = flask_redis.get(token_key(appkey))
+    return token.decode('utf-8') if type(token) == type(b'') else token
+
+@timed('auth')
+def check_token(appkey, token):
+    """
+    signed模式在进程内校验签名, opaque模式与redis中保存的token比较
+    """
+    if not valid_appkey(appkey) or not isinstance(token, str):
         return False
+    if current_app.config['API_TOKEN_FORMAT'] == 'signed':
+        valid = signed_token_valid(appkey, token)
     else:
-        pipe = flask_redis.pipeline(transaction=True)
-        flask_redis.incr(key, 1)
-        flask_redis.expire(key, 60)
-        pipe.execute()
-    return True
+        expected = request_token(appkey)
+        valid = expected is not None and hmac.compare_digest(expected.encode('utf-8'), token.encode('utf-8'))
+    if valid:
+        g.auth_appkey = appkey
+    return valid
 
 def check_request_frequency(func):
     @wraps(func)
     def decorated(*args, **kwargs):
         headers = request.headers
         ip = headers['X-Real-Ip'] if 'X-Real-Ip' in headers else request.remote_addr
-        if request_frequency(ip, 40) == False:
+        appkey = request_arg('appkey')
+        if appkey is not None and not valid_appkey(appkey):
+            return jsonify({'success': 0, 'message': 'appkey 无效'})
+        status = request_frequency(ip, appkey, request_arg('token'))
+        if status == APPKEY_LIMITED:
+            return jsonify({'success': 0, 'message': '请求太频繁, 请稍后尝试'})
+        elif status != ALLOWED:
             return jsonify({'success': 0, 'message': '请求太频繁, 请5分钟后尝试'})
         return func(*args, **kwargs)
     return decorated
\ No newline at end of file
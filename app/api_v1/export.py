@@ -0,0 +1,78 @@
+# coding=utf-8
+
+import io
+import csv
+import json
+import logging
+from flask import current_app
+from elasticsearch.helpers import scan
+from ..es import es
+
+logger = logging.getLogger(__name__)
+
+def error_message(e):
+    """
+    响应头已经发出, 中途出错只能在末尾写一条错误记录, 客户端据此判断导出不完整
+    """
+    logger.exception('export interrupted')
+    return '导出中断: {0}'.format(e.__class__.__name__)
+
+def export_hits(index, doc_type, body, slice_id=None, slices=None):
+    """
+    scroll遍历全部结果, 每次只在内存中保留一批; 指定slices时只导出其中一片, 可由调用方并行拉取
+    """
+    config = current_app.config
+    if slices and slices > 1:
+        body = dict(body, slice={'id': slice_id, 'max': slices})
+    hits = scan(es.client, query=body, index=index, doc_type=doc_type,
+        scroll=config['EXPORT_SCROLL_KEEPALIVE'], size=config['EXPORT_BATCH_SIZE'],
+        request_timeout=config['ES_TIMEOUT'])
+    for count, hit in enumerate(hits):
+        if count >= config['EXPORT_MAX_DOCS']:
+            break
+        yield hit
+
+def ndjson_lines(hits, fields):
+    try:
+        for hit in hits:
+            source = hit.get('_source', {})
+            row = {'_id': hit['_id']}
+            for field in fields:
+                row[field] = source.get(field)
+            yield json.dumps(row, ensure_ascii=False, separators=(',', ':')) + '\n'
+    except Exception as e:
+        yield json.dumps({'_error': error_message(e)}, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+def csv_lines(hits, fields):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(['_id'] + fields)
+    try:
+        for hit in hits:
+            source = hit.get('_source', {})
+            writer.writerow([hit['_id']] + [source.get(field, '') for field in fields])
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    except Exception as e:
+        # 错误标记行: 第一列为#error
+        writer.writerow(['#error', error_message(e)])
+        yield buf.getvalue()
+
+def chunked(lines, size=100):
+    """
+    合并成块输出, wsgi服务器写完一块才会继续拉取下一块, 客户端读得慢时scroll也随之放慢
+    """
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield ''.join(chunk).encode('utf-8')
+            chunk = []
+    if chunk:
+        yield ''.join(chunk).encode('utf-8')
+
+def export_stream(hits, fmt, fields):
+    if fmt == 'csv':
+        return chunked(csv_lines(hits, fields))
+    return chunked(ndjson_lines(hits, fields))
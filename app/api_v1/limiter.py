@@ -0,0 +1,171 @@
+# coding=utf-8
+
+from threading import Lock
+from time import time
+from flask import current_app
+from .. import flask_redis
+
+# 状态码
+ALLOWED = 0
+BLOCKED = 1
+IP_LIMITED = 2
+APPKEY_LIMITED = 3
+
+# KEYS: 封禁key, ip计数key, appkey计数key, token key
+# ARGV: 当前毫秒, 周期毫秒, ip限额, appkey限额, 封禁秒数, 客户端token, token已在进程内校验(1/0)
+# appkey限额只在token校验通过后计入, 知道别人appkey的人不能耗尽其限额
+# 返回 {状态, token或剩余毫秒}
+LIMIT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return {1, redis.call('PTTL', KEYS[1])}
+end
+local now = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local retry = allow(KEYS[2], tonumber(ARGV[3]), now, period)
+if retry > 0 then
+    redis.call('SETEX', KEYS[1], ARGV[5], 'blocked')
+    return {2, tonumber(ARGV[5]) * 1000}
+end
+local token = false
+if KEYS[4] then
+    token = redis.call('GET', KEYS[4])
+end
+local verified = ARGV[7] == '1' or (token and ARGV[6] ~= '' and token == ARGV[6])
+if KEYS[3] and tonumber(ARGV[4]) > 0 and verified then
+    retry = allow(KEYS[3], tonumber(ARGV[4]), now, period)
+    if retry > 0 then
+        return {3, retry}
+    end
+end
+return {0, token}
+"""
+
+def token_key(appkey):
+    """
+    opaque token在redis中的key
+    """
+    return 'search:token:' + appkey
+
+class Limiter(object):
+    """
+    限流器基类, 子类提供lua函数 allow(key, limit, now, period), 允许时返回0, 否则返回需等待的毫秒数
+    """
+    algorithm = None
+
+    def __init__(self):
+        self._script = None
+        self._local = {}
+        self._lock = Lock()
+
+    def script(self):
+        if self._script is None:
+            self._script = flask_redis.register_script(self.algorithm + LIMIT_SCRIPT)
+        return self._script
+
+    def _local_denied(self, key, now):
+        until = self._local.get(key)
+        if until is None:
+            return False
+        if until > now:
+            return True
+        self._local.pop(key, None)
+        return False
+
+    def _deny_locally(self, key, until):
+        with self._lock:
+            if len(self._local) > 10000:
+                now = time()
+                self._local = dict((k, v) for k, v in self._local.items() if v > now)
+            self._local[key] = until
+
+    def hit(self, ip, appkey=None, quota=0, token=None, verified=False):
+        """
+        返回 (状态, redis中的token), 已知超限的客户端在本地直接拒绝
+        verified表示token已在进程内校验通过(signed模式), 否则由脚本与redis中的token比较
+        """
+        config = current_app.config
+        now = time()
+        if self._local_denied(ip, now):
+            return BLOCKED, None
+        if appkey and self._local_denied('appkey:' + appkey, now):
+            return APPKEY_LIMITED, None
+        keys = ['ratelimit:block:' + ip, 'ratelimit:ip:' + ip]
+        if appkey:
+            keys.append('ratelimit:appkey:' + appkey)
+            # signed token在进程内校验, 不需要顺便取redis中的token
+            if config['API_TOKEN_FORMAT'] != 'signed':
+                keys.append(token_key(appkey))
+        args = [int(now * 1000), config['RATELIMIT_PERIOD'] * 1000, config['RATELIMIT_IP_LIMIT'], quota or 0, config['RATELIMIT_BLOCK_TIME'],
+            token or '', '1' if verified else '0']
+        # lua的false转为nil, 会截断返回的数组
+        result = self.script()(keys=keys, args=args)
+        status = result[0]
+        value = result[1] if len(result) > 1 else None
+        if status == ALLOWED:
+            return status, value.decode('utf-8') if type(value) == type(b'') else value
+        if status == APPKEY_LIMITED:
+            self._deny_locally('appkey:' + appkey, now + value / 1000.0)
+        else:
+            self._deny_locally(ip, now + value / 1000.0)
+        return status, None
+
+class SlidingWindowLimiter(Limiter):
+    # 滑动窗口计数: 上一窗口按剩余比例加权
+    algorithm = """
+local function allow(key, limit, now, period)
+    local window = math.floor(now / period)
+    local state = redis.call('HMGET', key, 'w', 'c', 'p')
+    local w = tonumber(state[1]) or window
+    local c = tonumber(state[2]) or 0
+    local p = tonumber(state[3]) or 0
+    if w ~= window then
+        if w == window - 1 then p = c else p = 0 end
+        c = 0
+    end
+    local weight = 1 - (now % period) / period
+    local retry = 0
+    if p * weight + c >= limit then
+        retry = period - now % period
+    else
+        c = c + 1
+    end
+    redis.call('HMSET', key, 'w', window, 'c', c, 'p', p)
+    redis.call('PEXPIRE', key, period * 2)
+    return retry
+end
+"""
+
+class TokenBucketLimiter(Limiter):
+    # 令牌桶: 容量为限额, 每个周期补满
+    algorithm = """
+local function allow(key, limit, now, period)
+    local state = redis.call('HMGET', key, 't', 'ts')
+    local tokens = tonumber(state[1]) or limit
+    local ts = tonumber(state[2]) or now
+    local rate = limit / period
+    tokens = math.min(limit, tokens + math.max(0, now - ts) * rate)
+    local retry = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        retry = math.ceil((1 - tokens) / rate)
+    end
+    redis.call('HMSET', key, 't', tokens, 'ts', now)
+    redis.call('PEXPIRE', key, period)
+    return retry
+end
+"""
+
+LIMITERS = {
+    'sliding_window': SlidingWindowLimiter,
+    'token_bucket': TokenBucketLimiter,
+}
+
+_limiters = {}
+
+def get_limiter():
+    strategy = current_app.config['RATELIMIT_STRATEGY']
+    limiter = _limiters.get(strategy)
+    if limiter is None:
+        limiter = _limiters.setdefault(strategy, LIMITERS[strategy]())
+    return limiter
@@ -0,0 +1,104 @@
+# coding=utf-8
+
+from flask import current_app
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from .cache import canonical_key
+from ..es import es
+from ..exceptions import InvalidCursor
+
+# search_after需要唯一的排序值, es5中用_uid兜底
+TIEBREAKER = [{'_uid': 'asc'}]
+
+# 游标参数之外的查询条件
+CURSOR_IGNORED = ('page', 'cursor', 'snapshot')
+
+# es时间单位换算为秒
+TIME_UNITS = (('ms', 0.001), ('s', 1), ('m', 60), ('h', 3600), ('d', 86400))
+
+def serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='search-cursor')
+
+def keepalive_seconds(keepalive):
+    """
+    '2m' -> 120; 先匹配ms, 不会被当作m
+    """
+    for unit, seconds in TIME_UNITS:
+        if keepalive.endswith(unit) and keepalive[:-len(unit)].isdigit():
+            return int(keepalive[:-len(unit)]) * seconds
+    raise ValueError('invalid keepalive: {0}'.format(keepalive))
+
+def load_cursor(cursor):
+    """
+    游标有效期与scroll保持时间相同, 过期的scroll在es中已被清除
+    """
+    max_age = keepalive_seconds(current_app.config['SEARCH_SCROLL_KEEPALIVE'])
+    return serializer().loads(cursor, max_age=max_age)
+
+def fingerprint(*parts):
+    """
+    游标只能用于生成它的那组查询条件
+    """
+    params = parts[-1]
+    params = dict((k, v) for k, v in params.items() if k not in CURSOR_IGNORED)
+    return canonical_key(*(parts[:-1] + (params,)))[:16]
+
+def encode_cursor(state):
+    return serializer().dumps(state)
+
+def decode_cursor(cursor, query_fingerprint):
+    try:
+        state = load_cursor(cursor)
+    except SignatureExpired:
+        raise InvalidCursor('cursor 已过期')
+    except BadSignature:
+        raise InvalidCursor('cursor 无效')
+    if not isinstance(state, dict) or state.get('f') != query_fingerprint:
+        raise InvalidCursor('cursor 与查询条件不符')
+    return state
+
+def cacheable(params):
+    """
+    只缓存普通翻页和游标首页; 游标后续页带着scroll状态或search_after位置, 不能缓存
+    """
+    if params['snapshot']:
+        return False
+    cursor = params['cursor']
+    if cursor in (None, '', '*'):
+        return True
+    try:
+        state = load_cursor(cursor)
+    except BadSignature:
+        return False
+    return not (isinstance(state, dict) and (state.get('scroll') or state.get('after')))
+
+def paginate(index, doc_type, body, query_fingerprint, cursor, snapshot=False):
+    """
+    游标翻页: 默认用search_after, snapshot为真时用scroll保持结果快照
+    返回 (es响应, 下一页游标), 没有下一页时游标为None
+    """
+    keepalive = current_app.config['SEARCH_SCROLL_KEEPALIVE']
+    size = body['size']
+    state = {} if cursor == '*' else decode_cursor(cursor, query_fingerprint)
+    if state.get('scroll'):
+        response = es.scroll(scroll_id=state['scroll'], scroll=keepalive)
+    else:
+        body = dict(body, sort=body['sort'] + TIEBREAKER)
+        body.pop('from', None)
+        if state.get('after'):
+            body['search_after'] = state['after']
+        if snapshot and not state.get('after'):
+            response = es.search(index=index, doc_type=doc_type, body=body, scroll=keepalive)
+        else:
+            response = es.search(index=index, doc_type=doc_type, body=body)
+    hits = response['hits']['hits']
+    scroll_id = response.pop('_scroll_id', None)
+    if len(hits) < size:
+        if scroll_id:
+            try:
+                es.clear_scroll(scroll_id=scroll_id)
+            except Exception:
+                pass
+        return response, None
+    if scroll_id:
+        return response, encode_cursor({'f': query_fingerprint, 'scroll': scroll_id})
+    return response, encode_cursor({'f': query_fingerprint, 'after': hits[-1]['sort']})
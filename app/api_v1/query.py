@@ -0,0 +1,161 @@
+# coding=utf-8
+
+from re import split
+from ..metrics import timed
+
+# 查询模板中不变的部分, 所有请求共用, 不能修改
+COMMON_HIGHLIGHT = {'fields': {
+    'title': {'fragment_size': 50},
+    'content': {'fragment_size': 100},
+    'tag': {'fragment_size': 50},
+    'description': {'fragment_size': 100},
+}}
+
+GDSZX_HIGHLIGHT = {'fields': {
+    'title': {'fragment_size': 50},
+    'content': {'fragment_size': 100},
+}}
+
+GDSZX_AGGS = {
+    'times_all': {'terms': {'field': 'times', 'size': 10}},
+    'channel_all': {'terms': {'field': 'channel', 'size': 10}},
+    'category_all': {'terms': {'field': 'category', 'size': 10}},
+    'location_all': {'terms': {'field': 'location', 'size': 10}},
+}
+
+# 综合搜索的term过滤, 顺序与参数对应字段
+COMMON_TERMS = (
+    ('author', 'author'), ('editor', 'editor'), ('origin', 'origin'),
+    ('category', 'category'), ('channel', 'channel'),
+    ('v1', 'reserved_1'), ('v2', 'reserved_2'), ('v3', 'reserved_3'),
+    ('v4', 'reserved_4'), ('v5', 'reserved_5'), ('v6', 'reserved_6'),
+)
+
+GDSZX_TERMS = (
+    ('times', 'times'), ('category', 'category'), ('location', 'location'), ('channel', 'channel'),
+)
+
+BOOLEANS = {'0': False, '1': True}
+
+# 聚合结果只取决于这些参数
+GDSZX_FACET_PARAMS = ('keyword', 'and', 'scope', 'times', 'category', 'location', 'channel', 'is_open')
+
+def compile_sort(o, field):
+    if o == '-':
+        if field == '_score':
+            raise ValueError('Sorting by `-_score` is not allowed.')
+        return [{field: {'order': 'desc'}}]
+    return [field]
+
+def compile_must(params):
+    scope = params['scope']
+    must = [{'multi_match': {'query': params['keyword'], 'fields': scope}}]
+    and_ = params['and']
+    if and_ != None and and_.strip() != '':
+        for word in split(r'\s+', and_.strip()):
+            must.append({'multi_match': {'query': word, 'fields': scope}})
+    return must
+
+def common_filters(domain, params):
+    filters = [{'term': {'website': domain}}]
+    for name, field in COMMON_TERMS:
+        value = params[name]
+        if value:
+            filters.append({'term': {field: value}})
+    for name in ('has_pic', 'has_video'):
+        if params[name] in BOOLEANS:
+            filters.append({'term': {name: BOOLEANS[params[name]]}})
+    filters.append({'range': {'pdate': {'gte': params['from'], 'lte': params['to']}}})
+    return filters
+
+def common_query(domain, params):
+    filters = common_filters(domain, params)
+    must = compile_must(params)
+    if params['not']:
+        filters.append({'bool': {'must_not': [{'multi_match': {'query': params['not'], 'fields': params['scope']}}]}})
+    if params['f'] == 'title':
+        filters.append({'bool': {'must_not': [{'terms': {'title.raw': params['l']}}]}})
+    elif params['f'] == 'url':
+        filters.append({'bool': {'must_not': [{'terms': {'url': params['l']}}]}})
+    return {'bool': {'filter': filters, 'must': must}}
+
+@timed('dsl')
+def compile_export(domain, params, fields):
+    """
+    导出请求体, 复用综合搜索的过滤条件, 关键词可以为空
+    """
+    filters = common_filters(domain, params)
+    if params['not']:
+        filters.append({'bool': {'must_not': [{'multi_match': {'query': params['not'], 'fields': params['scope']}}]}})
+    query = {'bool': {'filter': filters}}
+    if params['keyword']:
+        query['bool']['must'] = compile_must(params)
+    return {'query': query, '_source': fields}
+
+@timed('dsl')
+def compile_common(domain, params):
+    """
+    综合搜索请求体, 与elasticsearch_dsl构造的结果一致
+    """
+    page = params['page']
+    size = params['size']
+    return {
+        'query': common_query(domain, params),
+        'sort': compile_sort(params['o'], params['s']),
+        'from': (page - 1) * size,
+        'size': size,
+        'highlight': COMMON_HIGHLIGHT,
+    }
+
+def gdszx_query(params):
+    filters = []
+    for name, field in GDSZX_TERMS:
+        value = params[name]
+        if value:
+            filters.append({'term': {field: value}})
+    if params['is_open'] in BOOLEANS:
+        filters.append({'term': {'is_open': BOOLEANS[params['is_open']]}})
+    must = compile_must(params)
+    if filters:
+        return {'bool': {'filter': filters, 'must': must}}
+    if len(must) == 1:
+        return must[0]
+    return {'bool': {'must': must}}
+
+@timed('dsl')
+def compile_gdszx(params, aggs=True):
+    """
+    政协文史搜索请求体, 与elasticsearch_dsl构造的结果一致; aggs为假时只取结果列表
+    """
+    page = params['page']
+    size = params['size']
+    body = {
+        'query': gdszx_query(params),
+        'sort': compile_sort(params['o'], params['s']),
+        'from': (page - 1) * size,
+        'size': size,
+        'highlight': GDSZX_HIGHLIGHT,
+    }
+    if aggs:
+        body['aggs'] = GDSZX_AGGS
+    return body
+
+@timed('dsl')
+def compile_gdszx_facets(params):
+    """
+    只做聚合的请求体, 与分页和排序无关
+    """
+    return {'query': gdszx_query(params), 'aggs': GDSZX_AGGS, 'size': 0}
+
+def compile_suggest(domain, keyword, size):
+    """
+    联想词索引未命中时查es的请求体: 按标题前缀匹配, 只取与索引结果相同的字段
+    """
+    return {
+        'query': {'bool': {
+            'filter': [{'term': {'website': domain}}],
+            'must': [{'match_phrase_prefix': {'title': {'query': keyword, 'max_expansions': 50}}}],
+        }},
+        '_source': ['title', 'website'],
+        'size': size,
+    }
@@ -0,0 +1,23 @@
+# coding=utf-8
+
+from flask import current_app, make_response
+from flask_restful.representations.json import output_json as restful_output_json
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+def output_json(data, code, headers=None):
+    """
+    安装了ujson时用它序列化, 不支持的数据或调试模式下回退到flask_restful的实现
+    """
+    if ujson is None or current_app.debug:
+        return restful_output_json(data, code, headers)
+    try:
+        dumped = ujson.dumps(data, ensure_ascii=False) + '\n'
+    except (TypeError, ValueError, OverflowError):
+        return restful_output_json(data, code, headers)
+    response = make_response(dumped, code)
+    response.headers.extend(headers or {})
+    return response
@@ -0,0 +1,135 @@
+# coding=utf-8
+
+from collections import namedtuple
+from threading import Lock
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from .. import db, notify
+from ..snapshot import snapshot
+from ..metrics import timed
+from ..models import Token, Website
+
+Site = namedtuple('Site', ['website_id', 'domain', 'frequent'])
+
+TOPIC = 'resolver'
+
+class AppkeyResolver(object):
+    """
+    appkey -> (website_id, domain, frequent) 的进程内映射, 请求处理时不访问数据库
+    """
+    def __init__(self):
+        self._sites = {}
+        self._appkeys = {}
+        self._lock = Lock()
+        self._load_lock = Lock()
+        self.loaded = False
+
+    def _query(self):
+        return db.session.query(Token.id, Token.appkey, Token.frequent, Token.website_id, Website.domain).join(Website, Website.id == Token.website_id)
+
+    def load(self):
+        sites = {}
+        appkeys = {}
+        for row in self._query().all():
+            sites[row.appkey] = Site(row.website_id, row.domain, row.frequent)
+            appkeys[row.id] = row.appkey
+        with self._lock:
+            self._sites = sites
+            self._appkeys = appkeys
+            self.loaded = True
+
+    def refresh_token(self, token_id):
+        row = self._query().filter(Token.id == token_id).first()
+        with self._lock:
+            sites = dict(self._sites)
+            old = self._appkeys.pop(token_id, None)
+            if old is not None:
+                sites.pop(old, None)
+            if row is not None:
+                sites[row.appkey] = Site(row.website_id, row.domain, row.frequent)
+                self._appkeys[row.id] = row.appkey
+            self._sites = sites
+
+    def refresh_website(self, website_id):
+        rows = self._query().filter(Token.website_id == website_id).all()
+        with self._lock:
+            sites = dict((k, v) for k, v in self._sites.items() if v.website_id != website_id)
+            for row in rows:
+                sites[row.appkey] = Site(row.website_id, row.domain, row.frequent)
+                self._appkeys[row.id] = row.appkey
+            self._sites = sites
+
+    @timed('resolve')
+    def lookup(self, appkey):
+        if current_app.config['SNAPSHOT_ENABLED']:
+            return self.lookup_snapshot(appkey)
+        return self._sites.get(appkey)
+
+    def lookup_snapshot(self, appkey):
+        current = snapshot.current()
+        if current is None:
+            # 快照缺失或无法读取时退回从数据库加载, 之后按通知更新
+            if not self.loaded:
+                with self._load_lock:
+                    if not self.loaded:
+                        self.load()
+            return self._sites.get(appkey)
+        token = current.token(appkey)
+        if token is None:
+            return None
+        website = current.website(token['website_id'])
+        if website is None:
+            return None
+        return Site(token['website_id'], website['domain'], token['frequent'])
+
+    def on_notify(self, payload):
+        # 使用快照且没有退回进程内映射时不需要更新
+        if current_app.config['SNAPSHOT_ENABLED'] and not self.loaded:
+            return
+        if payload['kind'] == 'token':
+            self.refresh_token(payload['id'])
+        elif payload['kind'] == 'website':
+            self.refresh_website(payload['id'])
+        else:
+            self.load()
+
+resolver = AppkeyResolver()
+
+def _record_change(kind):
+    def listener(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('resolver_changes', set()).add((kind, target.id))
+    return listener
+
+def _publish_changes(session):
+    changes = session.info.pop('resolver_changes', None)
+    for kind, id in changes or ():
+        notify.publish(TOPIC, {'kind': kind, 'id': id})
+
+def _discard_changes(session):
+    session.info.pop('resolver_changes', None)
+
+def register_events():
+    """
+    后台修改Token/Website后, 提交时广播给所有worker
+    """
+    if event.contains(db.session, 'after_commit', _publish_changes):
+        return
+    for model, kind in ((Token, 'token'), (Website, 'website')):
+        listener = _record_change(kind)
+        for name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(model, name, listener)
+    event.listen(db.session, 'after_commit', _publish_changes)
+    event.listen(db.session, 'after_rollback', _discard_changes)
+    notify.subscribe(TOPIC, resolver.on_notify)
+
+def init_resolver(app):
+    # 使用快照时不在进程内另存一份
+    if app.config['SNAPSHOT_ENABLED']:
+        return
+    with app.app_context():
+        resolver.load()
+    notify.every(app.config['RESOLVER_REFRESH_INTERVAL'], resolver.load)
+    notify.start_listener(app)
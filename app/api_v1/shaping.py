@@ -0,0 +1,50 @@
+# coding=utf-8
+
+from flask import current_app
+
+# es返回中客户端用不到的字段
+BOOKKEEPING = ('_shards',)
+HIT_BOOKKEEPING = ('_index', '_type')
+
+def source_filter(endpoint, fields):
+    """
+    传fields时只取这些字段, 否则按接口排除大字段(高亮片段已包含正文匹配部分)
+    """
+    if fields:
+        return {'includes': fields}
+    excludes = current_app.config['SEARCH_SOURCE_EXCLUDES'].get(endpoint)
+    if excludes:
+        return {'excludes': excludes}
+    return None
+
+def project(endpoint, body, fields):
+    source = source_filter(endpoint, fields)
+    if source is not None:
+        body['_source'] = source
+    return body
+
+def truncate(text, size):
+    if len(text) <= size:
+        return text
+    return text[:size] + '...'
+
+def shape(response):
+    """
+    去掉es内部字段, 截断过长的文本字段, 原地修改并返回
+    """
+    if not isinstance(response, dict):
+        return response
+    limits = current_app.config['SEARCH_TRUNCATE_FIELDS']
+    for name in BOOKKEEPING:
+        response.pop(name, None)
+    for hit in response.get('hits', {}).get('hits', []):
+        for name in HIT_BOOKKEEPING:
+            hit.pop(name, None)
+        source = hit.get('_source')
+        if not source:
+            continue
+        for field, size in limits.items():
+            value = source.get(field)
+            if isinstance(value, str) and len(value) > size:
+                source[field] = truncate(value, size)
+    return response
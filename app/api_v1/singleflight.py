@@ -0,0 +1,150 @@
+# coding=utf-8
+
+import json
+import uuid
+import logging
+from threading import Event, Lock
+from time import time, sleep
+from flask import current_app
+from redis.exceptions import RedisError
+from .. import flask_redis, metrics
+
+logger = logging.getLogger(__name__)
+
+# 只删除自己持有的锁
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('del', KEYS[1])
+end
+if ARGV[2] ~= '' then
+    redis.call('setex', KEYS[2], tonumber(ARGV[3]), ARGV[2])
+end
+return 1
+"""
+
+class Call(object):
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    """
+    相同查询合并执行: 同一进程内后到的请求等待正在执行的那一个,
+    跨进程通过redis短锁选出一个执行者, 其他进程轮询它发布的结果
+    """
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self._calls = {}
+        self._lock = Lock()
+        self._release = None
+        self.counters = {'leaders': 0, 'local_followers': 0, 'remote_followers': 0, 'fallbacks': 0}
+
+    def _lock_key(self, key):
+        return 'search:flight:{0}:{1}'.format(self.namespace, key)
+
+    def _result_key(self, key):
+        return 'search:flight:{0}:{1}:result'.format(self.namespace, key)
+
+    def do(self, key, func):
+        config = current_app.config
+        if not config['SINGLEFLIGHT_ENABLED']:
+            return func()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Call()
+        if not leader:
+            self.counters['local_followers'] += 1
+            if call.event.wait(config['SINGLEFLIGHT_WAIT']):
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            self.counters['fallbacks'] += 1
+            return func()
+        try:
+            call.result = self.do_shared(key, func)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def do_shared(self, key, func):
+        config = current_app.config
+        token = uuid.uuid4().hex
+        lock_key = self._lock_key(key)
+        try:
+            acquired = flask_redis.set(lock_key, token, px=config['SINGLEFLIGHT_LOCK_MS'], nx=True)
+        except RedisError as e:
+            logger.warning('singleflight lock failed: %s', e)
+            return func()
+        if not acquired:
+            result = self.wait_result(key)
+            if result is not None:
+                self.counters['remote_followers'] += 1
+                return result
+            self.counters['fallbacks'] += 1
+            return func()
+        self.counters['leaders'] += 1
+        result = None
+        try:
+            result = func()
+            return result
+        finally:
+            self.release(key, token, result)
+
+    def wait_result(self, key):
+        """
+        轮询执行者发布的结果, 锁消失(执行者出错或超时)且没有结果时返回None
+        """
+        config = current_app.config
+        deadline = time() + config['SINGLEFLIGHT_WAIT']
+        interval = config['SINGLEFLIGHT_POLL_MS'] / 1000.0
+        lock_key = self._lock_key(key)
+        result_key = self._result_key(key)
+        try:
+            while True:
+                pipe = flask_redis.pipeline(transaction=False)
+                pipe.get(result_key)
+                pipe.exists(lock_key)
+                data, locked = pipe.execute()
+                if data is not None:
+                    return json.loads(data.decode('utf-8') if type(data) == type(b'') else data)
+                if not locked or time() >= deadline:
+                    return None
+                sleep(interval)
+        except RedisError as e:
+            logger.warning('singleflight wait failed: %s', e)
+            return None
+
+    def release(self, key, token, result):
+        config = current_app.config
+        data = '' if result is None else json.dumps(result, separators=(',', ':'), ensure_ascii=False)
+        try:
+            if self._release is None:
+                self._release = flask_redis.register_script(RELEASE_SCRIPT)
+            self._release(keys=[self._lock_key(key), self._result_key(key)], args=[token, data, config['SINGLEFLIGHT_RESULT_TTL']])
+        except RedisError as e:
+            logger.warning('singleflight release failed: %s', e)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['in_flight'] = len(self._calls)
+        return stats
+
+search_flight = SingleFlight('search')
+gdszx_flight = SingleFlight('gdszx')
+
+FLIGHTS = (search_flight, gdszx_flight)
+
+metrics.register('search_singleflight_calls_total', 'counter', 'coalesced query executions by role',
+    lambda: [({'flight': flight.namespace, 'role': role}, count) for flight in FLIGHTS for role, count in flight.counters.items()])
+metrics.register('search_singleflight_in_flight', 'gauge', 'queries currently executing per worker',
+    lambda: [({'flight': flight.namespace}, flight.stats()['in_flight']) for flight in FLIGHTS])
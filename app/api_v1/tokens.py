@@ -0,0 +1,117 @@
+# coding=utf-8
+
+import hmac
+import logging
+from hashlib import sha256
+from threading import Lock
+from time import time
+from flask import current_app
+from redis.exceptions import RedisError
+from .. import flask_redis, notify
+
+VERSION = 'v1'
+
+TOPIC = 'tokens'
+
+# appkey -> 失效截止时间, 到期时间不晚于它的token作废
+REVOKED = 'search:tokens:revoked'
+
+logger = logging.getLogger(__name__)
+
+def _signature(secret, payload):
+    return hmac.new(secret.encode('utf-8'), payload.encode('utf-8'), sha256).hexdigest()
+
+def issue(appkey, website_id, ttl=None):
+    """
+    签发 v1.appkey.website_id.到期时间.kid.签名, 返回(token, 有效秒数)
+    """
+    config = current_app.config
+    ttl = ttl or config['API_TOKEN_TTL']
+    kid = config['API_TOKEN_CURRENT_KID']
+    payload = '.'.join([VERSION, appkey, str(website_id), str(int(time()) + ttl), kid])
+    return '{0}.{1}'.format(payload, _signature(config['API_TOKEN_KEYS'][kid], payload)), ttl
+
+def parse(token):
+    """
+    返回 (appkey, website_id, 到期时间, kid, payload, 签名), 格式不对时返回None
+    """
+    if not token or not token.startswith(VERSION + '.'):
+        return None
+    # appkey中可能有'.', 从右边拆分
+    parts = token[len(VERSION) + 1:].rsplit('.', 4)
+    if len(parts) != 5:
+        return None
+    appkey, website_id, expires, kid, signature = parts
+    if not website_id.isdigit() or not expires.isdigit():
+        return None
+    return appkey, int(website_id), int(expires), kid, token[:-len(signature) - 1], signature
+
+class Revocations(object):
+    """
+    吊销名单保存在redis, 各worker在内存中保留一份, 校验时不访问redis
+    """
+    def __init__(self):
+        self._revoked = {}
+        self._lock = Lock()
+
+    def load(self):
+        try:
+            now = int(time())
+            flask_redis.zremrangebyscore(REVOKED, '-inf', now)
+            items = flask_redis.zrangebyscore(REVOKED, now, '+inf', withscores=True)
+        except RedisError as e:
+            # redis不可用时保留现有名单
+            logger.warning('token revocations load failed: %s', e)
+            return
+        revoked = dict((k.decode('utf-8') if type(k) == type(b'') else k, int(v)) for k, v in items)
+        with self._lock:
+            self._revoked = revoked
+
+    def is_revoked(self, appkey, expires):
+        until = self._revoked.get(appkey)
+        return until is not None and expires <= until
+
+    def on_notify(self, payload):
+        with self._lock:
+            revoked = dict(self._revoked)
+            revoked[payload['appkey']] = payload['until']
+            self._revoked = revoked
+
+    def revoke(self, appkey):
+        """
+        作废appkey目前已签发的所有token, 名单项在这些token全部过期后自动清除
+        """
+        until = int(time()) + current_app.config['API_TOKEN_TTL']
+        flask_redis.zadd(REVOKED, until, appkey)
+        self.on_notify({'appkey': appkey, 'until': until})
+        notify.publish(TOPIC, {'appkey': appkey, 'until': until})
+        return until
+
+revocations = Revocations()
+
+def verify(token, appkey, website_id):
+    """
+    进程内校验签名, 到期时间, 所属网站和吊销名单; 旧kid只要仍在API_TOKEN_KEYS中即有效
+    """
+    config = current_app.config
+    parsed = parse(token)
+    if parsed is None:
+        return False
+    token_appkey, token_website_id, expires, kid, payload, signature = parsed
+    secret = config['API_TOKEN_KEYS'].get(kid)
+    if secret is None:
+        return False
+    if not hmac.compare_digest(_signature(secret, payload), signature):
+        return False
+    if token_appkey != appkey or token_website_id != website_id or expires <= time():
+        return False
+    return not revocations.is_revoked(appkey, expires)
+
+def init_tokens(app):
+    if app.config['API_TOKEN_FORMAT'] != 'signed':
+        return
+    notify.subscribe(TOPIC, revocations.on_notify)
+    with app.app_context():
+        revocations.load()
+    notify.every(app.config['API_TOKEN_REVOCATION_REFRESH'], revocations.load)
+    notify.start_listener(app)
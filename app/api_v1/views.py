@@ -1,21 +1,36 @@
 # coding=utf-8
 
-from flask_restful import Resource, reqparse
-from flask import Response, request
-from .decorator import check_http_headers, check_request_frequency
+import logging
+from flask_restful import Resource
+from flask import Response, request, current_app, stream_with_context, g
+from .decorator import check_http_headers, check_request_frequency, check_token
+from .tokens import issue
+from .limiter import token_key
 from app.models import User, Token, Website
-from elasticsearch import Elasticsearch
-from elasticsearch_dsl.search import Search
 from .. import flask_redis
-from re import match, split
 from time import time
 from ..utils import hash_sha256
+from .cache import search_cache, gdszx_cache, facet_cache, FACET_SCOPE
+from .singleflight import search_flight, gdszx_flight
+from .query import compile_common, compile_gdszx, compile_gdszx_facets, GDSZX_FACET_PARAMS
+from .pagination import paginate, fingerprint, cacheable
+from .args import Schema, Argument, num_limit, date_limit, sort_limit, sort_2_limit, order_limt, filter_limit, format_limit, fields_limit
+from .query import compile_export, compile_suggest
+from .export import export_hits, export_stream
+from .shaping import project, shape
+from .resolver import resolver
+from ..history import history
+from ..sensitive import sensitive_filter
+from ..suggest import suggester
+from ..es import es, CircuitOpenError
+from ..indices import index_name
+from ..metrics import timed
+from ..exceptions import InvalidCursor
 
-# es连接实例
-client = Elasticsearch(hosts=['127.0.0.1:9200'], timeout=30000)
+logger = logging.getLogger(__name__)
 
-# 相关搜索
-def related_search(es_client, keyword, field='suggest', size=6):
+# 相关搜索, 与主查询并发执行, 超时或出错时返回空
+def related_search(keyword, field='suggest', size=6):
 	es_related_options = {
 		"suggest": {
 			"prefix": keyword,
@@ -25,68 +40,270 @@ def related_search(es_client, keyword, field='suggest', size=6):
 			}
 		}
 	}
+	timeout = current_app.config['ES_RELATED_TIMEOUT']
+	return es.submit('suggest', index=index_name('related'), body=es_related_options, request_timeout=timeout)
+
+def related_result(future):
 	try:
-		rs = es_client.suggest(index='related', body=es_related_options)
-		return rs
+		return future.result(timeout=current_app.config['ES_RELATED_TIMEOUT'])
 	except Exception as e:
+		logger.warning('related search failed: %r', e)
 		return ''
 
-# 数值限制
-def num_limit(value, name):
-	if value.isdigit() is False:
-		raise ValueError("{0} 必须是整数".format(name))
-	elif int(value) < 1:
-		raise ValueError("{0} 不能小于1".format(name))
-	elif int(value) > 50:
-		raise ValueError("{0} 不能大于50".format(name))
-	else:
-		return value
+# 请求参数定义, 导入时构造一次
+search_args = Schema('SearchArgs',
+	Argument('_', type=int, help='时间戳不能空', required=True, dest='ts'),
+	Argument('appkey', type=str, help='appkey不能空', required=True),
+	Argument('token', type=str, help='token不能空', required=True),
+	Argument('sign', type=str, help='sign不能空', required=True),
+	Argument('page', type=num_limit, default=1),
+	Argument('size', type=num_limit, default=10),
+	Argument('channel', type=str, help='频道'),
+	Argument('category', type=str, help='类别'),
+	Argument('origin', type=str, help='来源'),
+	Argument('has_pic', type=str, help='是否有图'), #为空则false, 否则true
+	Argument('has_video', type=str, help='是否有视频'),
+	Argument('author', type=str, help='作者'),
+	Argument('editor', type=str, help='编辑'),
+	Argument('v1', type=str, help='预留字段1'),
+	Argument('v2', type=str, help='预留字段2'),
+	Argument('v3', type=str, help='预留字段3'),
+	Argument('v4', type=str, help='预留字段4'),
+	Argument('v5', type=str, help='预留字段5'),
+	Argument('v6', type=str, help='预留字段6'),
+	Argument('s', type=sort_limit, help='排序字段', default='_score'),
+	Argument('o', type=order_limt, help='排序顺序', default=''),
+	Argument('f', type=filter_limit, help='过滤字段'),
+	Argument('l', type=str, help='过滤列表,用逗号分隔'),
+	Argument('scope', type=str, help='搜索范围', default=''),
+	Argument('from', type=date_limit, help='起始日期', default='1996-01-01', dest='from_'),
+	Argument('to', type=date_limit, help='结束日期', default='2038-01-01'),
+	Argument('keyword', type=str, required=True, help='关键词'),
+	Argument('not', type=str, help='非关键词', dest='not_'),
+	Argument('and', type=str, help='与关键词', dest='and_'),
+	Argument('cursor', type=str, help='翻页游标, 传*开始'),
+	Argument('snapshot', type=str, help='游标翻页时是否保持结果快照'),
+	Argument('fields', type=fields_limit, help='返回字段,用逗号分隔'),
+)
 
-# 日期限制
-def date_limit(value, name):
-	if match(r'^(?:(?!0000)[0-9]{4}-(?:(?:0[1-9]|1[0-2])-(?:0[1-9]|1[0-9]|2[0-8])|(?:0[13-9]|1[0-2])-(?:29|30)|(?:0[13578]|1[02])-31)|(?:[0-9]{2}(?:0[48]|[2468][048]|[13579][26])|(?:0[48]|[2468][048]|[13579][26])00)-02-29)$', value):
-		return value
-	else:
-		raise ValueError("{0} 必须是有效的日期格式yyyy-mm-dd".format(name))
+gdszx_args = Schema('GdszxSearchArgs',
+	Argument('_', type=int, help='时间戳不能空', required=True, dest='ts'),
+	Argument('appkey', type=str, help='appkey不能空', required=True),
+	Argument('token', type=str, help='token不能空', required=True),
+	Argument('sign', type=str, help='sign不能空', required=True),
+	Argument('page', type=num_limit, default=1),
+	Argument('size', type=num_limit, default=10),
+	Argument('channel', type=str, help='频道'),
+	Argument('category', type=str, help='类别'),
+	Argument('location', type=str, help='地区'),
+	Argument('times', type=str, help='年代'),
+	Argument('is_open', type=str, help='是否开放资源'),
+	Argument('scope', type=str, help='搜索范围', default=''),
+	Argument('keyword', type=str, required=True, help='关键词'),
+	Argument('s', type=sort_2_limit, help='排序字段', default='_score'),
+	Argument('o', type=order_limt, help='排序顺序', default=''),
+	Argument('and', type=str, help='与关键词', dest='and_'),
+	Argument('cursor', type=str, help='翻页游标, 传*开始'),
+	Argument('snapshot', type=str, help='游标翻页时是否保持结果快照'),
+	Argument('fields', type=fields_limit, help='返回字段,用逗号分隔'),
+)
+
+suggest_args = Schema('SuggestArgs',
+	Argument('_', type=int, help='时间戳不能空', required=True, dest='ts'),
+	Argument('appkey', type=str, help='appkey不能空', required=True),
+	Argument('token', type=str, help='token不能空', required=True),
+	Argument('sign', type=str, help='sign不能空', required=True),
+	Argument('keyword', type=str, required=True, help='关键词'),
+)
+
+token_args = Schema('TokenArgs',
+	Argument('_', type=int, help='时间戳不能空', required=True, dest='ts'),
+	Argument('appkey', type=str, required=True, help='appkey 不能空'),
+	Argument('appsecret', type=str, required=True, help='appsecret 不能空'),
+)
+
+export_args = Schema('ExportArgs',
+	Argument('_', type=int, help='时间戳不能空', required=True, dest='ts'),
+	Argument('appkey', type=str, help='appkey不能空', required=True),
+	Argument('token', type=str, help='token不能空', required=True),
+	Argument('sign', type=str, help='sign不能空', required=True),
+	Argument('channel', type=str, help='频道'),
+	Argument('category', type=str, help='类别'),
+	Argument('origin', type=str, help='来源'),
+	Argument('has_pic', type=str, help='是否有图'),
+	Argument('has_video', type=str, help='是否有视频'),
+	Argument('author', type=str, help='作者'),
+	Argument('editor', type=str, help='编辑'),
+	Argument('v1', type=str, help='预留字段1'),
+	Argument('v2', type=str, help='预留字段2'),
+	Argument('v3', type=str, help='预留字段3'),
+	Argument('v4', type=str, help='预留字段4'),
+	Argument('v5', type=str, help='预留字段5'),
+	Argument('v6', type=str, help='预留字段6'),
+	Argument('scope', type=str, help='搜索范围', default=''),
+	Argument('from', type=date_limit, help='起始日期', default='1996-01-01', dest='from_'),
+	Argument('to', type=date_limit, help='结束日期', default='2038-01-01'),
+	Argument('keyword', type=str, help='关键词'),
+	Argument('not', type=str, help='非关键词', dest='not_'),
+	Argument('and', type=str, help='与关键词', dest='and_'),
+	Argument('format', type=format_limit, help='导出格式ndjson或csv', default='ndjson'),
+	Argument('fields', type=fields_limit, help='导出字段,用逗号分隔'),
+	Argument('slice', type=int, help='分片序号', default=0),
+	Argument('slices', type=int, help='分片总数', default=1),
+)
 
-# 排序字段限制
-def sort_limit(value):
-	if value in ['pdate', 'channel', 'category', 'has_pic', 'has_video', 'author', 'origin']:
-		return value
+# 请求参数默认值, 预热等内部调用使用
+SEARCH_DEFAULTS = search_args.defaults()
+GDSZX_DEFAULTS = gdszx_args.defaults()
+
+# 敏感词处理, reject模式返回提示信息
+@timed('sensitive')
+def filter_sensitive(website_id, params):
+	mode = current_app.config['SENSITIVE_MODE']
+	for name in ('keyword', 'and'):
+		if not params[name]:
+			continue
+		if mode == 'reject':
+			if sensitive_filter.contains(website_id, params[name]):
+				return '关键词包含敏感词'
+		else:
+			params[name] = sensitive_filter.clean(website_id, params[name], mode)
+	return None
+
+# 综合搜索参数, 规范化后用于构造查询和缓存key
+def common_params(args):
+	scope = args['scope']
+	if scope in ['content', 'tag', 'title', 'description']:
+		scope = [scope]
 	else:
-		return '_score'
+		scope = ['content', 'tag', 'title', 'description']
+	l = args['l']
+	return {
+		'page': int(args['page']),
+		'size': int(args['size']),
+		'origin': args['origin'],
+		'channel': args['channel'],
+		'category': args['category'],
+		'author': args['author'],
+		'editor': args['editor'],
+		'from': args['from'],
+		'to': args['to'],
+		'has_pic': args['has_pic'],
+		'has_video': args['has_video'],
+		'v1': args['v1'],
+		'v2': args['v2'],
+		'v3': args['v3'],
+		'v4': args['v4'],
+		'v5': args['v5'],
+		'v6': args['v6'],
+		'not': args['not'],
+		'and': args['and'],
+		's': args['s'],
+		'o': args['o'],
+		'f': args['f'],
+		'l': [] if l is None else l.split(','),
+		'scope': scope,
+		'keyword': args['keyword'],
+		'cursor': args['cursor'],
+		'snapshot': args['snapshot'] == '1',
+		'fields': args['fields'],
+	}
 
-def sort_2_limit(value):
-	if value in ['category', 'years', 'channel', 'location', 'times']:
-		return value
+# 综合搜索, 传cursor时按游标翻页
+def common_search(domain, params):
+	cursor = params['cursor']
+	related = related_search(params['keyword']) if cursor in (None, '', '*') else None
+	body = project('search', compile_common(domain, params), params['fields'])
+	if cursor:
+		response, cursor = paginate(index_name('common'), 'search', body, fingerprint(domain, params), cursor, params['snapshot'])
 	else:
-		return '_score'
+		response = es.search(index=index_name('common'), doc_type='search', body=body)
+	result = {'success': 1, 'data': shape(response)}
+	if params['cursor']:
+		result['cursor'] = cursor
+	if related is not None:
+		result['related'] = related_result(related)
+	return result
+
+# 综合搜索并处理结果中的敏感词
+def search_site(site, params):
+	result = common_search(site.domain, params)
+	sensitive_filter.clean_highlight(site.website_id, result['data'], current_app.config['SENSITIVE_MODE'])
+	return result
 
-# 排序顺序限制
-def order_limt(value):
-	if value == 'desc':
-		return '-'
+# 政协文史搜索参数
+def gdszx_params(args):
+	scope = args['scope']
+	if scope in ['content', 'tag', 'title', 'description', 'author', 'writings']:
+		scope = [scope]
 	else:
-		return ''
+		scope = ['content', 'tag', 'title', 'description', 'author', 'writings']
+	return {
+		'page': int(args['page']),
+		'size': int(args['size']),
+		'channel': args['channel'],
+		'category': args['category'],
+		'location': args['location'],
+		'times': args['times'],
+		'is_open': args['is_open'],
+		'and': args['and'],
+		's': args['s'],
+		'o': args['o'],
+		'scope': scope,
+		'keyword': args['keyword'],
+		'cursor': args['cursor'],
+		'snapshot': args['snapshot'] == '1',
+		'fields': args['fields'],
+	}
+
+# 政协文史聚合, 缓存未命中时与结果列表查询并发执行
+def gdszx_facets(params):
+	facet_params = dict((name, params[name]) for name in GDSZX_FACET_PARAMS)
+	facets = facet_cache.get(FACET_SCOPE, facet_params)
+	if facets is not None:
+		return facet_params, facets
+	return facet_params, es.submit('search', index=index_name('gdszx'), doc_type='culture',
+		body=compile_gdszx_facets(params), request_cache=True)
 
-# 过滤字段限制
-def filter_limit(value, name):
-	if value in ['url', 'title']:
-		return value
+# 政协文史搜索, 传cursor时按游标翻页
+def gdszx_search(params):
+	facet_params, facets = gdszx_facets(params)
+	body = project('gdszx', compile_gdszx(params, aggs=False), params['fields'])
+	result = {'success': 1}
+	if params['cursor']:
+		response, result['cursor'] = paginate(index_name('gdszx'), 'culture', body, fingerprint(params), params['cursor'], params['snapshot'])
 	else:
-		raise ValueError("{0} 只能是url或title".format(name))
+		response = es.search(index=index_name('gdszx'), doc_type='culture', body=body)
+	if not isinstance(facets, dict):
+		try:
+			facets = facets.result(timeout=current_app.config['ES_TIMEOUT'])['aggregations']
+		except CircuitOpenError:
+			# 熔断半开时并发的聚合查询不放行, 主查询试探成功后再补查
+			facets = es.search(index=index_name('gdszx'), doc_type='culture', body=compile_gdszx_facets(params), request_cache=True)['aggregations']
+		facet_cache.set(FACET_SCOPE, facet_params, facets, current_app.config['FACET_CACHE_TTL'])
+	response['aggregations'] = facets
+	result['data'] = shape(response)
+	return result
+
+# 政协文史搜索并处理结果中的敏感词
+def gdszx_site(site, params):
+	result = gdszx_search(params)
+	sensitive_filter.clean_highlight(site.website_id, result['data'], current_app.config['SENSITIVE_MODE'])
+	return result
+
+# 相同查询合并执行, 只由执行者写入缓存
+def coalesced(flight, cache, domain, params, func):
+	def run():
+		result = func()
+		cache.set(domain, params, result)
+		return result
+	return flight.do(cache.key(domain, params), run)
 
 class SuggestApi(Resource):
 	decorators = [check_http_headers, check_request_frequency,]
 	def __init__(self):
 		super(SuggestApi, self).__init__()
-		self.parser = reqparse.RequestParser()
-		self.parser.add_argument('_', type=int, help='时间戳不能空', required=True)
-		self.parser.add_argument('appkey', type=str, help='appkey不能空', required=True)
-		self.parser.add_argument('token', type=str, help='token不能空', required=True)
-		self.parser.add_argument('sign', type=str, help='sign不能空', required=True)
-		self.parser.add_argument('keyword', type=str, required=True, help='关键词')
-		self.args = self.parser.parse_args()
+		self.args = suggest_args.parse()
 
 	def post(self):
 		ts = self.args['_']
@@ -94,25 +311,26 @@ class SuggestApi(Resource):
 			return {'success':0, 'message': '时间戳无效'}, 200
 		token = self.args['token']
 		appkey = self.args['appkey']
-		verify_token = flask_redis.get(appkey)
-		if verify_token is None:
+		if not check_token(appkey, token):
 			return {'success': 0, 'message': 'token 无效'}, 200
-		else:
-			verify_token = verify_token.decode('utf-8') if type(verify_token) == type(b'') else verify_token
-			if verify_token != token:
-				return {'success': 0, 'message': 'token 无效'}, 200
 		sign = self.args['sign']
 		if hash_sha256("{0},{1},{2}".format(ts, token, appkey)) != sign:
 			return {'success': 0, 'message': 'sign 无效'}, 200
 		keyword = self.args['keyword']
-		query = Website.query.join(Token, Website.id==Token.website_id).filter(Token.appkey == appkey).first()
-		domain = query.domain
+		site = resolver.lookup(appkey)
+		if site is None:
+			return {'success': 0, 'message': 'appkey 无效'}, 200
+		domain = site.domain
+		# 常见前缀由进程内索引直接返回, 未命中时再查es
+		size = current_app.config['SUGGEST_SIZE']
+		items = suggester.lookup(site.website_id, keyword, size)
+		if items:
+			hits = [{'_score': weight, '_source': {'title': text, 'website': domain}} for text, weight in items]
+			return {'success': 1, 'data': {'hits': {'total': len(hits), 'max_score': hits[0]['_score'], 'hits': hits}}}, 200
+		# 与索引一样按前缀匹配, 不再返回分词后任意命中的标题
 		try:
-			s = Search(using=client, index='suggest', doc_type='news')
-			s = s.filter('term', website=domain).query('match', title=keyword)
-			s = s[0:10]
-			response = s.execute()
-			return {'success': 1, 'data': response.to_dict()}, 200
+			response = es.search(index=index_name('suggest'), doc_type='news', body=compile_suggest(domain, keyword, size))
+			return {'success': 1, 'data': shape(response)}, 200
 		except Exception as e:
 			return {'success': 0, 'message': e}, 200
 		#return request.data.decode('utf-8')
@@ -121,11 +339,7 @@ class TokenApi(Resource):
 	decorators = [check_http_headers, check_request_frequency,]
 	def __init__(self):
 		super(TokenApi, self).__init__()
-		self.parser = reqparse.RequestParser()
-		self.parser.add_argument('_', type=int, help='时间戳不能空', required=True)
-		self.parser.add_argument('appkey', type=str, required=True, help='appkey 不能空')
-		self.parser.add_argument('appsecret', type=str, required=True, help='appsecret 不能空')
-		self.args = self.parser.parse_args()
+		self.args = token_args.parse()
 
 	def post(self):
 		ts = self.args['_']
@@ -135,12 +349,18 @@ class TokenApi(Resource):
 		appsecret = self.args['appsecret']
 		auth =Token.query.filter(Token.appkey == appkey, Token.appsecret == appsecret).first()
 		if auth is not None:
-			token = flask_redis.get(appkey)
+			g.auth_appkey = appkey
+		if auth is not None and current_app.config['API_TOKEN_FORMAT'] == 'signed':
+			token, expires = issue(appkey, auth.website_id)
+			return {'success': 1, 'data': {'token':token, 'expires': expires}}, 200
+		if auth is not None:
+			key = token_key(appkey)
+			token = flask_redis.get(key)
 			if token is None:
 				token = hash_sha256("{0}-{1}".format(appkey, ts))
-				flask_redis.setex(appkey, 1800, token)
+				flask_redis.setex(key, 1800, token)
 			token = token if type(token) != type(b'') else token.decode('utf-8')
-			expires = flask_redis.ttl(appkey)
+			expires = flask_redis.ttl(key)
 			return {'success': 1, 'data': {'token':token, 'expires': expires}}, 200
 		else:
 			return {'success': 0, 'message': '授权未通过'}, 200
@@ -149,37 +369,7 @@ class SearchApi(Resource):
 	decorators = [check_http_headers, check_request_frequency,]
 	def __init__(self):
 		super(SearchApi, self).__init__()
-		self.parser = reqparse.RequestParser()
-		self.parser.add_argument('_', type=int, help='时间戳不能空', required=True)
-		self.parser.add_argument('appkey', type=str, help='appkey不能空', required=True)
-		self.parser.add_argument('token', type=str, help='token不能空', required=True)
-		self.parser.add_argument('sign', type=str, help='sign不能空', required=True)
-		self.parser.add_argument('page', type=num_limit, default=1)
-		self.parser.add_argument('size', type=num_limit, default=10)
-		self.parser.add_argument('channel', type=str, help='频道')
-		self.parser.add_argument('category', type=str, help='类别')
-		self.parser.add_argument('origin', type=str, help='来源')
-		self.parser.add_argument('has_pic', type=str, help='是否有图') #为空则false, 否则true
-		self.parser.add_argument('has_video', type=str, help='是否有视频')
-		self.parser.add_argument('author', type=str, help='作者')
-		self.parser.add_argument('editor', type=str, help='编辑')
-		self.parser.add_argument('v1', type=str, help='预留字段1')
-		self.parser.add_argument('v2', type=str, help='预留字段2')
-		self.parser.add_argument('v3', type=str, help='预留字段3')
-		self.parser.add_argument('v4', type=str, help='预留字段4')
-		self.parser.add_argument('v5', type=str, help='预留字段5')
-		self.parser.add_argument('v6', type=str, help='预留字段6')
-		self.parser.add_argument('s', type=sort_limit, help='排序字段', default='_score')
-		self.parser.add_argument('o', type=order_limt, help='排序顺序', default='')
-		self.parser.add_argument('f', type=filter_limit, help='过滤字段')
-		self.parser.add_argument('l', type=str, help='过滤列表,用逗号分隔')
-		self.parser.add_argument('scope', type=str, help='搜索范围', default='')
-		self.parser.add_argument('from', type=date_limit, help='起始日期', default='1996-01-01')
-		self.parser.add_argument('to', type=date_limit, help='结束日期', default='2038-01-01')
-		self.parser.add_argument('keyword', type=str, required=True, help='关键词')
-		self.parser.add_argument('not', type=str, help='非关键词')
-		self.parser.add_argument('and', type=str, help='与关键词')
-		self.args = self.parser.parse_args()
+		self.args = search_args.parse()
 
 	def post(self):
 		ts = self.args['_']
@@ -187,101 +377,38 @@ class SearchApi(Resource):
 			return {'success':0, 'message': '时间戳无效'}, 200
 		token = self.args['token']
 		appkey = self.args['appkey']
-		verify_token = flask_redis.get(appkey)
-		if verify_token is None:
+		if not check_token(appkey, token):
 			return {'success': 0, 'message': 'token 无效'}, 200
-		else:
-			verify_token = verify_token.decode('utf-8') if type(verify_token) == type(b'') else verify_token
-			if verify_token != token:
-				return {'success': 0, 'message': 'token 无效'}, 200
 		sign = self.args['sign']
 		if hash_sha256("{0},{1},{2}".format(ts, token, appkey)) != sign:
 			return {'success': 0, 'message': 'sign 无效'}, 200
-		query = Website.query.join(Token, Website.id==Token.website_id).filter(Token.appkey == appkey).first()
-		domain = query.domain
-		page = int(self.args['page'])
-		size = int(self.args['size'])
-		from_size = (page - 1) * size
-		to_size = page * size
-		origin = self.args['origin']
-		channel = self.args['channel']
-		category = self.args['category']
-		author = self.args['author']
-		editor = self.args['editor']
-		begin = self.args['from']
-		to = self.args['to']
-		has_pic = self.args['has_pic']
-		has_video = self.args['has_video']
-		v1 = self.args['v1']
-		v2 = self.args['v2']
-		v3 = self.args['v3']
-		v4 = self.args['v4']
-		v5 = self.args['v5']
-		v6 = self.args['v6']
-		not_ = self.args['not']
-		and_ = self.args['and']
-		sort_field = self.args['s']
-		o = self.args['o']
-		f = self.args['f']
-		l = self.args['l']
-		l = [] if l is None else l.split(',')
-		scope = self.args['scope']
-		if scope in ['content', 'tag', 'title', 'description']:
-			scope = [scope]
-		else:
-			scope = ['content', 'tag', 'title', 'description']
-		keyword = self.args['keyword']
+		site = resolver.lookup(appkey)
+		if site is None:
+			return {'success': 0, 'message': 'appkey 无效'}, 200
+		domain = site.domain
+		params = common_params(self.args)
+		history.push(request.url, params['keyword'])
+		message = filter_sensitive(site.website_id, params)
+		if message is not None:
+			return {'success': 0, 'message': message}, 200
+		# 游标后续页有状态, 不缓存
+		use_cache = cacheable(params)
+		result = search_cache.get(domain, params) if use_cache else None
+		if result is not None:
+			return result, 200
 		try:
-			s = Search(using=client, index='common', doc_type='search')
-			s = s.filter('term', website=domain)
-			if author:
-				s = s.filter('term', author=author)
-			if editor:
-				s = s.filter('term', editor=editor)
-			if origin:
-				s = s.filter('term', origin=origin)
-			if category:
-				s = s.filter('term', category=category)
-			if channel:
-				s = s.filter('term', channel=channel)
-			if v1:
-				s = s.filter('term', reserved_1=v1)
-			if v2:
-				s = s.filter('term', reserved_2=v2)
-			if v3:
-				s = s.filter('term', reserved_3=v3)
-			if v4:
-				s = s.filter('term', reserved_4=v4)
-			if v5:
-				s = s.filter('term', reserved_5=v5)
-			if v6:
-				s = s.filter('term', reserved_6=v6)
-			if has_pic == '0':
-				s = s.filter('term', has_pic=False)
-			elif has_pic == '1':
-				s = s.filter('term', has_pic=True)
-			if has_video == '0':
-				s = s.filter('term', has_video=False)
-			elif has_video == '1':
-				s = s.filter('term', has_video=True)
-			s = s.filter('range', pdate={'gte': begin, 'lte': to})
-
-			s = s.query('multi_match', query=keyword, fields=scope)
-			if not_:
-				s = s.exclude('multi_match', query=not_, fields=scope)
-			if and_ != None and and_.strip() != '':
-				for word in split(r'\s+', and_.strip()):
-					s = s.query('multi_match', query=word, fields=scope)
-			s = s.highlight('title', fragment_size=50).highlight('content', fragment_size=100).highlight('tag', fragment_size=50).highlight('description', fragment_size=100)
-			if f == 'title':
-				s = s.exclude('terms', title__raw=l)
-			elif f == 'url':
-				s = s.exclude('terms', url=l)
-			s = s.sort(o+sort_field)
-			s = s[from_size:to_size]
-			response = s.execute()
-			related = related_search(client, keyword)
-			return {'success': 1, 'data': response.to_dict(), 'related': related}, 200
+			if use_cache:
+				result = coalesced(search_flight, search_cache, domain, params, lambda: search_site(site, params))
+			else:
+				result = search_site(site, params)
+			return result, 200
+		except InvalidCursor as e:
+			return {'success': 0, 'message': str(e)}, 200
+		except CircuitOpenError:
+			result = search_cache.get(domain, params, allow_stale=True)
+			if result is not None:
+				return result, 200
+			return {'success': 0, 'message': '搜索服务繁忙, 请稍后再试'}, 200
 		except Exception as e:
 			return {'success': 0, 'message': e}, 200
 
@@ -289,24 +416,7 @@ class GdszxSearch(Resource):
 	decorators = [check_http_headers, check_request_frequency,]
 	def __init__(self):
 		super(GdszxSearch, self).__init__()
-		self.parser = reqparse.RequestParser()
-		self.parser.add_argument('_', type=int, help='时间戳不能空', required=True)
-		self.parser.add_argument('appkey', type=str, help='appkey不能空', required=True)
-		self.parser.add_argument('token', type=str, help='token不能空', required=True)
-		self.parser.add_argument('sign', type=str, help='sign不能空', required=True)
-		self.parser.add_argument('page', type=num_limit, default=1)
-		self.parser.add_argument('size', type=num_limit, default=10)
-		self.parser.add_argument('channel', type=str, help='频道')
-		self.parser.add_argument('category', type=str, help='类别')
-		self.parser.add_argument('location', type=str, help='地区')
-		self.parser.add_argument('times', type=str, help='年代')
-		self.parser.add_argument('is_open', type=str, help='是否开放资源')
-		self.parser.add_argument('scope', type=str, help='搜索范围', default='')
-		self.parser.add_argument('keyword', type=str, required=True, help='关键词')
-		self.parser.add_argument('s', type=sort_2_limit, help='排序字段', default='_score')
-		self.parser.add_argument('o', type=order_limt, help='排序顺序', default='')
-		self.parser.add_argument('and', type=str, help='与关键词')
-		self.args = self.parser.parse_args()
+		self.args = gdszx_args.parse()
 
 	def post(self):
 		ts = self.args['_']
@@ -314,60 +424,72 @@ class GdszxSearch(Resource):
 			return {'success':0, 'message': '时间戳无效'}, 200
 		token = self.args['token']
 		appkey = self.args['appkey']
-		verify_token = flask_redis.get(appkey)
-		if verify_token is None:
+		if not check_token(appkey, token):
 			return {'success': 0, 'message': 'token 无效'}, 200
-		else:
-			verify_token = verify_token.decode('utf-8') if type(verify_token) == type(b'') else verify_token
-			if verify_token != token:
-				return {'success': 0, 'message': 'token 无效'}, 200
 		sign = self.args['sign']
 		if hash_sha256("{0},{1},{2}".format(ts, token, appkey)) != sign:
 			return {'success': 0, 'message': 'sign 无效'}, 200
-		page = int(self.args['page'])
-		size = int(self.args['size'])
-		from_size = (page - 1) * size
-		to_size = page * size
-		channel = self.args['channel']
-		category = self.args['category']
-		location = self.args['location']
-		times = self.args['times']
-		and_ = self.args['and']
-		sort_field = self.args['s']
-		is_open = self.args['is_open']
-		o = self.args['o']
-		scope = self.args['scope']
-		if scope in ['content', 'tag', 'title', 'description', 'author', 'writings']:
-			scope = [scope]
-		else:
-			scope = ['content', 'tag', 'title', 'description', 'author', 'writings']
-		keyword = self.args['keyword']
+		site = resolver.lookup(appkey)
+		if site is None:
+			return {'success': 0, 'message': 'appkey 无效'}, 200
+		params = gdszx_params(self.args)
+		history.push(request.url, params['keyword'])
+		message = filter_sensitive(site.website_id, params)
+		if message is not None:
+			return {'success': 0, 'message': message}, 200
+		# 游标后续页有状态, 不缓存
+		use_cache = cacheable(params)
+		result = gdszx_cache.get(site.website_id, params) if use_cache else None
+		if result is not None:
+			return result, 200
 		try:
-			s = Search(using=client, index='gdszx', doc_type='culture')
-			if times:
-				s = s.filter('term', times=times)
-			if category:
-				s = s.filter('term', category=category)
-			if location:
-				s = s.filter('term', location=location)
-			if channel:
-				s = s.filter('term', channel=channel)
-			if is_open == '0':
-				s = s.filter('term', is_open=False)
-			elif is_open == '1':
-				s = s.filter('term', is_open=True)
-			s = s.query('multi_match', query=keyword, fields=scope)
-			if and_ != None and and_.strip() != '':
-				for word in split(r'\s+', and_.strip()):
-					s = s.query('multi_match', query=word, fields=scope)
-			s = s.highlight('title', fragment_size=50).highlight('content', fragment_size=100)
-			s.aggs.bucket('times_all', 'terms', field='times', size=10)
-			s.aggs.bucket('channel_all', 'terms', field='channel', size=10)
-			s.aggs.bucket('category_all', 'terms', field='category', size=10)
-			s.aggs.bucket('location_all', 'terms', field='location', size=10)
-			s = s.sort(o+sort_field)
-			s = s[from_size:to_size]
-			response = s.execute()
-			return {'success': 1, 'data': response.to_dict()}, 200
+			if use_cache:
+				result = coalesced(gdszx_flight, gdszx_cache, site.website_id, params, lambda: gdszx_site(site, params))
+			else:
+				result = gdszx_site(site, params)
+			return result, 200
+		except InvalidCursor as e:
+			return {'success': 0, 'message': str(e)}, 200
+		except CircuitOpenError:
+			result = gdszx_cache.get(site.website_id, params, allow_stale=True)
+			if result is not None:
+				return result, 200
+			return {'success': 0, 'message': '搜索服务繁忙, 请稍后再试'}, 200
 		except Exception as e:
-			return {'success': 0, 'message': e}, 200
\ No newline at end of file
+			return {'success': 0, 'message': e}, 200
+
+class ExportApi(Resource):
+	decorators = [check_http_headers, check_request_frequency,]
+	def __init__(self):
+		super(ExportApi, self).__init__()
+		self.args = export_args.parse()
+
+	def post(self):
+		ts = self.args['_']
+		if abs(int(time() * 1000) - int(ts)) > 1800000:
+			return {'success':0, 'message': '时间戳无效'}, 200
+		token = self.args['token']
+		appkey = self.args['appkey']
+		if not check_token(appkey, token):
+			return {'success': 0, 'message': 'token 无效'}, 200
+		sign = self.args['sign']
+		if hash_sha256("{0},{1},{2}".format(ts, token, appkey)) != sign:
+			return {'success': 0, 'message': 'sign 无效'}, 200
+		site = resolver.lookup(appkey)
+		if site is None:
+			return {'success': 0, 'message': 'appkey 无效'}, 200
+		slices = self.args['slices']
+		slice_id = self.args['slice']
+		if slices < 1 or slices > current_app.config['EXPORT_MAX_SLICES'] or slice_id < 0 or slice_id >= slices:
+			return {'success': 0, 'message': 'slice 无效'}, 200
+		params = common_params(dict(SEARCH_DEFAULTS, **self.args.to_dict()))
+		message = filter_sensitive(site.website_id, params)
+		if message is not None:
+			return {'success': 0, 'message': message}, 200
+		fields = self.args['fields'] or current_app.config['EXPORT_FIELDS']
+		fmt = self.args['format']
+		hits = export_hits(index_name('common'), 'search', compile_export(site.domain, params, fields), slice_id, slices)
+		response = Response(stream_with_context(export_stream(hits, fmt, fields)),
+			mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson')
+		response.headers['Content-Disposition'] = 'attachment; filename=export.{0}'.format('csv' if fmt == 'csv' else 'ndjson')
+		return response
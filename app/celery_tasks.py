@@ -1,11 +1,13 @@
 # coding=utf-8
 
-import stmplib
+import smtplib
 import datetime
 from . import mail, flask_celery
 from flask_mail import Message
 from email.mime.text import MIMEText
 from .models import Reminder
+from .prewarm import prewarm
+from . import suggest, indexer
 
 @flask_celery.task(bind=True, ignore_result=True, default_retry_delay=300, max_retries=5)
 def remind(self, primary_key):
@@ -30,4 +32,26 @@ def remind(self, primary_key):
         self.retry(exc=err)
 
 def on_reminder_save(mapper, connect, self):
-    remind.apply_async(args=(self.id), eta=self.date)
\ No newline at end of file
+    remind.apply_async(args=(self.id), eta=self.date)
+
+@flask_celery.task(ignore_result=True)
+def prewarm_search():
+    """
+    replay hotwords and top recent queries to warm elasticsearch and the result cache
+    """
+    return prewarm()
+
+@flask_celery.task(ignore_result=True)
+def build_suggest():
+    """
+    rebuild the per-site suggestion index from hotwords, search history and titles
+    """
+    return suggest.build()
+
+@flask_celery.task(ignore_result=True)
+def index_full_load(namespace=None):
+    """
+    reload mongodb collections into elasticsearch, then warm the result cache
+    """
+    indexer.full_load(namespace)
+    prewarm_search.delay()
@@ -0,0 +1,154 @@
+# coding=utf-8
+
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import time, perf_counter
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import ConnectionError, ConnectionTimeout, TransportError
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker(object):
+    """
+    连续失败达到阈值后熔断, 冷却期过后放行一个试探请求
+    """
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self, probe=True):
+        """
+        熔断时抛出CircuitOpenError; 半开时只放行一个可以作为试探的请求, 返回是否占用了试探名额
+        """
+        if self.opened_at is None:
+            return False
+        with self._lock:
+            if not probe or time() - self.opened_at < self.reset_timeout or self._probing:
+                raise CircuitOpenError('elasticsearch circuit open')
+            self._probing = True
+            return True
+
+    def release(self):
+        """
+        试探请求结束但没有结论(非连接类异常)时归还名额, 下一个请求继续试探
+        """
+        with self._lock:
+            self._probing = False
+
+    def success(self):
+        if self.failures or self.opened_at is not None:
+            with self._lock:
+                self.failures = 0
+                self.opened_at = None
+                self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning('elasticsearch circuit opened after %d failures', self.failures)
+                self.opened_at = time()
+
+class ESClient(object):
+    """
+    按进程延迟创建es客户端, fork后的worker各自建立连接池
+    """
+    # 只有连接类错误计入熔断, 查询语法等错误照常抛出
+    FAILURES = (ConnectionError, ConnectionTimeout)
+
+    def __init__(self):
+        self._client = None
+        self._executor = None
+        self._pid = None
+        self._lock = Lock()
+        self.config = None
+        self.breaker = CircuitBreaker()
+
+    def init_app(self, app):
+        self.config = app.config
+        self.breaker.threshold = app.config['ES_CIRCUIT_THRESHOLD']
+        self.breaker.reset_timeout = app.config['ES_CIRCUIT_RESET_TIMEOUT']
+
+    def create(self, config):
+        return Elasticsearch(
+            hosts=config['ES_HOSTS'],
+            timeout=config['ES_TIMEOUT'],
+            maxsize=config['ES_MAXSIZE'],
+            max_retries=config['ES_MAX_RETRIES'],
+            retry_on_timeout=False,
+            sniff_on_start=config['ES_SNIFF_ON_START'],
+            sniff_on_connection_fail=config['ES_SNIFF_ON_CONNECTION_FAIL'],
+            sniffer_timeout=config['ES_SNIFFER_TIMEOUT'])
+
+    def _ensure(self):
+        pid = os.getpid()
+        if self._client is None or self._pid != pid:
+            with self._lock:
+                if self._client is None or self._pid != pid:
+                    self._client = self.create(self.config)
+                    self._executor = ThreadPoolExecutor(max_workers=self.config['ES_EXECUTOR_WORKERS'])
+                    self._pid = pid
+
+    @property
+    def client(self):
+        self._ensure()
+        return self._client
+
+    def submit(self, method, **kwargs):
+        """
+        在后台线程执行请求, 用于与主查询并发的辅助查询, 其失败不计入熔断, 也不作为半开时的试探请求
+        """
+        self._ensure()
+        return self._executor.submit(self.call, method, False, **kwargs)
+
+    def call(self, method, count_failures=True, **kwargs):
+        probing = self.breaker.before_call(probe=count_failures)
+        metrics.note_body(kwargs.get('body'))
+        started = perf_counter()
+        try:
+            result = getattr(self.client, method)(**kwargs)
+        except self.FAILURES:
+            if count_failures:
+                self.breaker.failure()
+            raise
+        except TransportError as e:
+            # 集群过载(429/5xx)同样计入熔断
+            if count_failures:
+                if isinstance(e.status_code, int) and (e.status_code == 429 or e.status_code >= 500):
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+            raise
+        else:
+            if count_failures:
+                self.breaker.success()
+            return result
+        finally:
+            metrics.record('es', perf_counter() - started)
+            if probing:
+                self.breaker.release()
+
+    def __getattr__(self, name):
+        return lambda **kwargs: self.call(name, **kwargs)
+
+es = ESClient()
@@ -1,2 +1,11 @@
 class ValidationError(ValueError):
     pass
+
+class InvalidCursor(ValueError):
+    pass
+
+class ReadError(RuntimeError):
+    pass
+
+class BulkError(RuntimeError):
+    pass
@@ -0,0 +1,97 @@
+# coding=utf-8
+
+import os
+import atexit
+import logging
+from collections import deque
+from datetime import datetime
+from threading import Thread, Event, Lock
+from . import db, metrics
+from .models import History
+
+logger = logging.getLogger(__name__)
+
+class HistoryBuffer(object):
+    """
+    搜索记录环形缓冲, 请求只做入队, 后台线程按数量或时间批量写入History
+    """
+    def __init__(self):
+        self._buffer = deque()
+        self._event = Event()
+        self._lock = Lock()
+        self._pid = None
+        self.app = None
+        self.maxlen = 10000
+        self.batch_size = 500
+        self.interval = 5
+        self.dropped = 0
+        self.flushed = 0
+
+    def push(self, request_url, keyword):
+        if self.app is None:
+            return
+        if len(self._buffer) >= self.maxlen:
+            self.dropped += 1
+            return
+        self._buffer.append((request_url, keyword, datetime.utcnow()))
+        if len(self._buffer) >= self.batch_size:
+            self._event.set()
+
+    def _drain(self):
+        records = []
+        popleft = self._buffer.popleft
+        while len(records) < self.batch_size:
+            try:
+                request_url, keyword, date = popleft()
+            except IndexError:
+                break
+            records.append({'request_url': request_url, 'keyword': keyword[:128] if keyword else keyword, 'date': date})
+        return records
+
+    def flush(self):
+        if self.app is None:
+            return
+        with self._lock, self.app.app_context():
+            while self._buffer:
+                records = self._drain()
+                try:
+                    db.session.bulk_insert_mappings(History, records)
+                    db.session.commit()
+                    self.flushed += len(records)
+                except Exception:
+                    db.session.rollback()
+                    self.dropped += len(records)
+                    logger.exception('history flush failed')
+            db.session.remove()
+
+    def _run(self):
+        while True:
+            self._event.wait(self.interval)
+            self._event.clear()
+            self.flush()
+
+    def start(self, app):
+        if not app.config['HISTORY_ENABLED'] or self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self.app = app
+        self.maxlen = app.config['HISTORY_BUFFER_SIZE']
+        self.batch_size = app.config['HISTORY_BATCH_SIZE']
+        self.interval = app.config['HISTORY_FLUSH_INTERVAL']
+        thread = Thread(target=self._run, name='history-flusher')
+        thread.daemon = True
+        thread.start()
+        atexit.register(self.flush)
+
+    def stats(self):
+        return {'buffered': len(self._buffer), 'flushed': self.flushed, 'dropped': self.dropped}
+
+history = HistoryBuffer()
+
+def _records():
+    stats = history.stats()
+    return [({'state': 'flushed'}, stats['flushed']), ({'state': 'dropped'}, stats['dropped'])]
+
+metrics.register('search_history_records_total', 'counter', 'search history records written or dropped', _records)
+metrics.register('search_history_buffered', 'gauge', 'search history records waiting to be written',
+    lambda: [({}, history.stats()['buffered'])])
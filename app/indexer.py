@@ -0,0 +1,295 @@
+# coding=utf-8
+
+import logging
+import threading
+from datetime import datetime, date
+from queue import Queue
+from time import time, sleep
+from bson import ObjectId
+from bson.timestamp import Timestamp
+from pymongo import CursorType
+from pymongo.errors import AutoReconnect
+from elasticsearch.helpers import parallel_bulk, bulk
+from flask import current_app
+from . import mongo, flask_redis
+from .es import es
+from .exceptions import ReadError, BulkError
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT = 'search:indexer:checkpoint'
+
+_DONE = object()
+
+def namespaces():
+    """
+    mongodb命名空间(库.集合) -> (es索引, 类型), 与mongo-connector默认的对应方式相同
+    """
+    return current_app.config['INDEXER_NAMESPACES']
+
+def collection(ns):
+    db, name = ns.split('.', 1)
+    return mongo.cx[db][name]
+
+def _format(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return dict((k, _format(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_format(v) for v in value]
+    return value
+
+def index_action(ns, doc):
+    index, doc_type = namespaces()[ns]
+    source = dict((k, _format(v)) for k, v in doc.items() if k != '_id')
+    return {'_op_type': 'index', '_index': index, '_type': doc_type, '_id': str(doc['_id']), '_source': source}
+
+def delete_action(ns, id):
+    index, doc_type = namespaces()[ns]
+    return {'_op_type': 'delete', '_index': index, '_type': doc_type, '_id': str(id)}
+
+def split_ranges(coll, parts):
+    """
+    按ObjectId中的时间把_id区间切成若干段, 各段可以并行读取; 不是ObjectId时整体一段
+    """
+    first = coll.find_one(sort=[('_id', 1)], projection=['_id'])
+    last = coll.find_one(sort=[('_id', -1)], projection=['_id'])
+    if first is None:
+        return []
+    lo, hi = first['_id'], last['_id']
+    if parts <= 1 or not isinstance(lo, ObjectId) or not isinstance(hi, ObjectId):
+        return [(None, None)]
+    start = lo.generation_time
+    step = (hi.generation_time - start) / parts
+    bounds = [ObjectId.from_datetime(start + step * i) for i in range(1, parts)]
+    bounds = sorted(set(b for b in bounds if lo < b <= hi))
+    return list(zip([None] + bounds, bounds + [None]))
+
+def read_range(ns, lo, hi, batch_size, queue):
+    query = {}
+    if lo is not None:
+        query.setdefault('_id', {})['$gte'] = lo
+    if hi is not None:
+        query.setdefault('_id', {})['$lt'] = hi
+    for doc in collection(ns).find(query, no_cursor_timeout=True).sort('_id', 1).batch_size(batch_size):
+        queue.put(index_action(ns, doc))
+
+def parallel_read(app, ns, ranges, batch_size, errors):
+    """
+    每个区间一个读线程, 通过有界队列汇总, 写入慢时读线程阻塞
+    读取失败的区间记入errors, 由调用方决定是否保存检查点
+    """
+    queue = Queue(maxsize=batch_size * 4)
+
+    def reader(lo, hi):
+        with app.app_context():
+            try:
+                read_range(ns, lo, hi, batch_size, queue)
+            except Exception as e:
+                logger.exception('indexer read failed: %s %s-%s', ns, lo, hi)
+                errors.append((lo, hi, e))
+            finally:
+                # 先记录错误再通知结束, 读完时errors已完整
+                queue.put(_DONE)
+
+    threads = [threading.Thread(target=reader, args=(lo, hi), name='indexer-read') for lo, hi in ranges]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    running = len(threads)
+    while running:
+        item = queue.get()
+        if item is _DONE:
+            running -= 1
+        else:
+            yield item
+
+def _settings(index):
+    settings = es.client.indices.get_settings(index=index)
+    # 读别名时返回的是实际索引名
+    current = list(settings.values())[0]['settings']['index']
+    return {'refresh_interval': current.get('refresh_interval', '1s'), 'number_of_replicas': current.get('number_of_replicas', '1')}
+
+class Throughput(object):
+    def __init__(self, name, interval=10):
+        self.name = name
+        self.interval = interval
+        self.started = self.last = time()
+        self.done = 0
+        self.errors = 0
+
+    def add(self, done, errors=0):
+        self.done += done
+        self.errors += errors
+        now = time()
+        if now - self.last >= self.interval:
+            self.last = now
+            logger.info('%s: %d indexed, %d errors, %.0f docs/s', self.name, self.done, self.errors, self.done / (now - self.started))
+
+    def stats(self):
+        elapsed = time() - self.started
+        return {'namespace': self.name, 'indexed': self.done, 'errors': self.errors,
+            'seconds': round(elapsed, 1), 'docs_per_second': round(self.done / elapsed, 1) if elapsed else 0}
+
+def oplog_position():
+    entry = mongo.cx.local['oplog.rs'].find_one(sort=[('$natural', -1)], projection=['ts'])
+    return entry['ts'] if entry else None
+
+def save_checkpoint(ts):
+    flask_redis.set(CHECKPOINT, '{0}:{1}'.format(ts.time, ts.inc))
+
+def load_checkpoint():
+    value = flask_redis.get(CHECKPOINT)
+    if value is None:
+        return None
+    value = value.decode('utf-8') if type(value) == type(b'') else value
+    seconds, inc = value.split(':')
+    return Timestamp(int(seconds), int(inc))
+
+def full_load(ns=None):
+    """
+    全量导入: 多线程按_id区间读取, parallel_bulk写入; 期间关闭刷新和副本, 结束后恢复
+    开始前记录oplog位置, 导入完成后增量同步从这里继续; 有区间读取失败时抛出ReadError, 不保存检查点
+    """
+    app = current_app._get_current_object()
+    config = app.config
+    position = oplog_position()
+    results = []
+    for name in ([ns] if ns else sorted(namespaces())):
+        index = namespaces()[name][0]
+        original = _settings(index)
+        es.client.indices.put_settings(index=index, body={'index': {'refresh_interval': '-1', 'number_of_replicas': 0}})
+        meter = Throughput(name)
+        errors = []
+        try:
+            ranges = split_ranges(collection(name), config['INDEXER_READ_THREADS'])
+            actions = parallel_read(app, name, ranges, config['INDEXER_BATCH_SIZE'], errors)
+            for ok, item in parallel_bulk(es.client, actions, thread_count=config['INDEXER_BULK_THREADS'],
+                    chunk_size=config['INDEXER_BULK_SIZE'], raise_on_error=False, request_timeout=config['INDEXER_TIMEOUT']):
+                if not ok:
+                    logger.warning('indexer bulk error: %s', item)
+                meter.add(1 if ok else 0, 0 if ok else 1)
+        finally:
+            es.client.indices.put_settings(index=index, body={'index': original})
+            es.client.indices.refresh(index=index)
+        if errors:
+            lo, hi, e = errors[0]
+            raise ReadError('{0}: {1} of {2} ranges failed, first {3}-{4}: {5}'.format(name, len(errors), len(ranges), lo, hi, e))
+        logger.info('full load finished: %s', meter.stats())
+        results.append(meter.stats())
+    if position is not None and not ns:
+        save_checkpoint(position)
+    return results
+
+def _apply(ns, entry):
+    op = entry['op']
+    if op == 'i':
+        return index_action(ns, entry['o'])
+    if op == 'd':
+        return delete_action(ns, entry['o']['_id'])
+    if op == 'u':
+        id = entry['o2']['_id']
+        if any(key.startswith('$') for key in entry['o']):
+            # 局部更新, 取最新的完整文档
+            doc = collection(ns).find_one({'_id': id})
+            return delete_action(ns, id) if doc is None else index_action(ns, doc)
+        doc = dict(entry['o'], _id=id)
+        return index_action(ns, doc)
+    return None
+
+def _bulk(actions, **kwargs):
+    done, errors = bulk(es.client, actions, raise_on_error=False, raise_on_exception=False, **kwargs)
+    # 删除不存在的文档不算错误
+    return done, [error for error in errors if error.get('delete', {}).get('status') != 404]
+
+def _flush(actions, last_ts, meter):
+    """
+    写入一批oplog操作, 没有错误才推进检查点; 失败时退避后重试同一批,
+    重试用完抛出BulkError, 检查点不变, 由supervisor重启后从原位置继续
+    """
+    config = current_app.config
+    if actions:
+        delay = config['INDEXER_RETRY_DELAY']
+        for attempt in range(config['INDEXER_RETRIES'] + 1):
+            done, errors = _bulk(actions)
+            if not errors:
+                break
+            for error in errors[:10]:
+                logger.warning('indexer sync error: %s', error)
+            if attempt == config['INDEXER_RETRIES']:
+                meter.add(done, len(errors))
+                raise BulkError('{0} of {1} sync actions failed after {2} retries'.format(len(errors), len(actions), attempt))
+            logger.warning('indexer sync retry in %ss: %d of %d actions failed', delay, len(errors), len(actions))
+            sleep(delay)
+            delay = min(delay * 2, config['INDEXER_RETRY_MAX_DELAY'])
+        meter.add(done, 0)
+    if last_ts is not None:
+        save_checkpoint(last_ts)
+
+def replay(since, names, index):
+    """
+    把since之后的oplog写入指定索引, 重建索引时追上reindex期间的写入, 返回最后的位置; 写入出错时抛出BulkError
+    """
+    query = {'ts': {'$gt': since}, 'ns': {'$in': names}, 'op': {'$in': ['i', 'u', 'd']}}
+    actions = []
+    for entry in mongo.cx.local['oplog.rs'].find(query, oplog_replay=True):
+        action = _apply(entry['ns'], entry)
+        if action is not None:
+            action['_index'] = index
+            actions.append(action)
+        since = entry['ts']
+    if actions:
+        done, errors = _bulk(actions, chunk_size=current_app.config['INDEXER_BULK_SIZE'])
+        if errors:
+            for error in errors[:10]:
+                logger.warning('indexer replay error: %s', error)
+            raise BulkError('{0} of {1} replay actions failed'.format(len(errors), len(actions)))
+    return since
+
+def sync(stop=None):
+    """
+    增量同步: 从redis中的检查点开始跟踪oplog, 批量写入es后推进检查点, 重启后继续
+    写入重试仍失败时抛出BulkError, 检查点停在失败的批次之前
+    pymongo 3.5不支持change stream, 直接读取副本集oplog
+    """
+    config = current_app.config
+    names = sorted(namespaces())
+    checkpoint = load_checkpoint() or oplog_position()
+    if checkpoint is None:
+        raise RuntimeError('oplog not found, mongod must run as a replica set')
+    stopped = lambda: stop is not None and stop.is_set()
+    meter = Throughput('sync')
+    oplog = mongo.cx.local['oplog.rs']
+    while not stopped():
+        query = {'ts': {'$gt': checkpoint}, 'ns': {'$in': names}, 'op': {'$in': ['i', 'u', 'd']}}
+        cursor = oplog.find(query, cursor_type=CursorType.TAILABLE_AWAIT, oplog_replay=True)
+        actions, last_ts, flushed = [], None, time()
+        try:
+            while cursor.alive and not stopped():
+                try:
+                    entry = cursor.next()
+                except StopIteration:
+                    # 等待超时没有新操作, 游标仍然有效
+                    entry = None
+                if entry is not None:
+                    action = _apply(entry['ns'], entry)
+                    if action is not None:
+                        actions.append(action)
+                    last_ts = entry['ts']
+                if len(actions) >= config['INDEXER_BULK_SIZE'] or (last_ts is not None and time() - flushed >= config['INDEXER_FLUSH_INTERVAL']):
+                    _flush(actions, last_ts, meter)
+                    checkpoint = last_ts
+                    actions, last_ts, flushed = [], None, time()
+            _flush(actions, last_ts, meter)
+            if last_ts is not None:
+                checkpoint = last_ts
+        except AutoReconnect as e:
+            # 未写入的操作丢弃, 从检查点重新读取
+            logger.warning('oplog cursor lost: %s', e)
+            sleep(1)
+        finally:
+            cursor.close()
+    return meter.stats()
@@ -0,0 +1,159 @@
+# coding=utf-8
+
+import re
+import logging
+from datetime import datetime
+from time import sleep
+from flask import current_app
+from .es import es
+
+logger = logging.getLogger(__name__)
+
+# rebuild创建的版本索引: 名称_年月日时分秒
+VERSION_SUFFIX = re.compile(r'^_\d{14}$')
+
+def index_name(name):
+    """
+    接口读取时使用的别名
+    """
+    return current_app.config['ES_INDEX_ALIASES'].get(name, name)
+
+def cluster_major():
+    return int(es.client.info()['version']['number'].split('.')[0])
+
+def concrete_indices(alias):
+    """
+    别名当前指向的索引; 同名的普通索引(尚未改用别名)返回[alias]
+    """
+    if es.client.indices.exists_alias(name=alias):
+        return sorted(es.client.indices.get_alias(name=alias).keys())
+    if es.client.indices.exists(index=alias):
+        return [alias]
+    return []
+
+def _tune_mapping(mappings, eager_fields):
+    for mapping in mappings.values():
+        properties = mapping.get('properties', {})
+        for field in eager_fields:
+            spec = properties.get(field)
+            if spec is not None and spec.get('type') == 'keyword':
+                spec['eager_global_ordinals'] = True
+    return mappings
+
+def index_body(name, source):
+    """
+    以当前索引的mapping为基础, 聚合字段预加载global ordinals, 构建期间不刷新不复制
+    """
+    config = current_app.config
+    current = es.client.indices.get(index=source)[source] if source else {}
+    mappings = _tune_mapping(current.get('mappings', {}), config['ES_INDEX_EAGER_FIELDS'].get(name, ()))
+    settings = current.get('settings', {}).get('index', {})
+    index = {
+        'number_of_shards': settings.get('number_of_shards', 5),
+        'number_of_replicas': 0,
+        'refresh_interval': '-1',
+    }
+    if 'analysis' in settings:
+        index['analysis'] = settings['analysis']
+    sort = config['ES_INDEX_SORT'].get(name)
+    # index sorting需要es6以上
+    if sort and cluster_major() >= 6:
+        index['sort.field'] = [field for field, order in sort]
+        index['sort.order'] = [order for field, order in sort]
+    return {'settings': {'index': index}, 'mappings': mappings}
+
+def wait_task(task_id, interval=5):
+    while True:
+        task = es.client.tasks.get(task_id=task_id)
+        status = task['task']['status']
+        logger.info('reindex %s: %d/%d', task_id, status.get('created', 0) + status.get('updated', 0), status.get('total', 0))
+        if task.get('completed'):
+            if task.get('error'):
+                raise RuntimeError('reindex failed: {0}'.format(task['error']))
+            return task.get('response', {})
+        sleep(interval)
+
+def warm(name, index):
+    """
+    新索引切换前先跑一遍热词查询和聚合, 加载文件缓存和global ordinals
+    """
+    from .models import Website
+    from .prewarm import hot_keywords
+    from .api_v1.query import compile_common, compile_gdszx, compile_gdszx_facets
+    from .api_v1.views import SEARCH_DEFAULTS, GDSZX_DEFAULTS, common_params, gdszx_params
+    count = 0
+    if name not in ('common', 'gdszx'):
+        return count
+    for website in Website.query.all():
+        for keyword in hot_keywords(website.id):
+            if name == 'common':
+                es.client.search(index=index, body=compile_common(website.domain, common_params(dict(SEARCH_DEFAULTS, keyword=keyword))))
+            elif name == 'gdszx':
+                params = gdszx_params(dict(GDSZX_DEFAULTS, keyword=keyword))
+                es.client.search(index=index, body=compile_gdszx(params, aggs=False))
+                es.client.search(index=index, body=compile_gdszx_facets(params), request_cache=True)
+            count += 1
+    return count
+
+def rebuild(name, keep=None, replace_concrete=False):
+    """
+    建新版本索引 -> reindex -> 恢复副本和刷新 -> 预热 -> 补写oplog -> 原子切换别名 -> 再补写一次 -> 清理旧版本
+    """
+    config = current_app.config
+    alias = index_name(name)
+    keep = config['ES_INDEX_KEEP'] if keep is None else keep
+    old = concrete_indices(alias)
+    if old == [alias] and not replace_concrete:
+        raise RuntimeError('{0} is a concrete index, rerun with replace_concrete to convert it to an alias'.format(alias))
+    new = '{0}_{1}'.format(name, datetime.utcnow().strftime('%Y%m%d%H%M%S'))
+    position = _oplog_position()
+    es.client.indices.create(index=new, body=index_body(name, old[-1] if old else None))
+    logger.info('created %s', new)
+    if old:
+        task = es.client.reindex(body={'source': {'index': alias, 'size': config['INDEXER_BULK_SIZE']}, 'dest': {'index': new}},
+            wait_for_completion=False, request_timeout=config['INDEXER_TIMEOUT'])
+        wait_task(task['task'])
+    es.client.indices.put_settings(index=new, body={'index': {
+        'number_of_replicas': config['ES_INDEX_REPLICAS'], 'refresh_interval': config['ES_INDEX_REFRESH_INTERVAL']}})
+    es.client.indices.refresh(index=new)
+    es.client.cluster.health(index=new, wait_for_status='yellow' if config['ES_INDEX_REPLICAS'] == 0 else 'green',
+        request_timeout=config['INDEXER_TIMEOUT'])
+    logger.info('warmed %s with %d queries', new, warm(name, new))
+    if position is not None:
+        position = _replay(position, alias, name, new)
+    if old == [alias]:
+        # 普通索引与别名不能同名, 只能先删除, 期间有短暂不可用
+        es.client.indices.delete(index=alias)
+        old = []
+    actions = [{'remove': {'index': index, 'alias': alias}} for index in old]
+    actions.append({'add': {'index': new, 'alias': alias}})
+    es.client.indices.update_aliases(body={'actions': actions})
+    logger.info('alias %s -> %s', alias, new)
+    if position is not None:
+        # 上次补写到切换之间增量同步仍写入旧索引, 切换后从该位置再补一次
+        _replay(position, alias, name, new)
+    versions = sorted(index for index in es.client.indices.get(index=name + '_*')
+        if index != new and is_version(name, index))
+    for index in versions[:max(0, len(versions) - keep)]:
+        es.client.indices.delete(index=index)
+        logger.info('deleted %s', index)
+    return new
+
+def is_version(name, index):
+    return index.startswith(name) and VERSION_SUFFIX.match(index[len(name):]) is not None
+
+def _replay(position, alias, name, index):
+    """
+    reindex是从旧索引复制的时间点快照, 期间mongodb的写入从oplog补上
+    """
+    from .indexer import namespaces, replay
+    names = [ns for ns, (target, doc_type) in namespaces().items() if target in (alias, name)]
+    return replay(position, names, index) if names else position
+
+def _oplog_position():
+    try:
+        from .indexer import oplog_position
+        return oplog_position()
+    except Exception as e:
+        logger.warning('oplog position unavailable, writes during reindex are not replayed: %s', e)
+        return None
@@ -7,7 +7,7 @@ from flask_login import login_required, current_user
 from wtforms.fields import StringField, PasswordField
 from wtforms.validators import Email, Required, Length, Regexp
 from werkzeug.security import generate_password_hash
-from flask import redirect, url_for
+from flask import redirect, url_for, current_app, request, abort
 
 
 class MyIndexView(BaseView):
@@ -25,7 +25,25 @@ class MyIndexView(BaseView):
     @login_required
     @expose()
     def index(self):
-        return self.render(self._template)
+        from ..profiler import profiler
+        try:
+            slow_queries = profiler.ranking()
+        except Exception:
+            slow_queries = []
+        return self.render(self._template, slow_queries=slow_queries, profiler_enabled=profiler.enabled)
+
+    @login_required
+    @expose('/profiler', methods=['POST'])
+    def profiler(self):
+        from ..profiler import profiler
+        if current_user.role_id != 1:
+            abort(403)
+        action = request.form.get('action')
+        if action == 'reset':
+            profiler.reset()
+        else:
+            profiler.toggle(action == 'on')
+        return redirect(url_for('.index'))
 
 class ModelMixin(object):
     def is_accessible(self):
@@ -37,6 +55,21 @@ class ModelMixin(object):
     def is_visible(self):
         return True
 
+class SnapshotMixin(object):
+    """
+    保存后重新发布查找表快照, api进程按文件版本自动切换
+    """
+    def publish_snapshot(self):
+        from ..snapshot import snapshot
+        if current_app.config['SNAPSHOT_ENABLED']:
+            snapshot.publish()
+
+    def after_model_change(self, form, model, is_created):
+        self.publish_snapshot()
+
+    def after_model_delete(self, model):
+        self.publish_snapshot()
+
 class UserView(ModelMixin, ModelView):
     can_create = True
     can_edit = True
@@ -83,7 +116,7 @@ class RightView(ModelMixin, ModelView):
         from ..models import Permission
         super(RightView, self).__init__(Permission, session, **kwargs)
 
-class WebsiteView(ModelMixin, ModelView):
+class WebsiteView(SnapshotMixin, ModelMixin, ModelView):
     can_create = True
     can_edit = True
     can_delete = True
@@ -94,7 +127,7 @@ class WebsiteView(ModelMixin, ModelView):
         from ..models import Website
         super(WebsiteView, self).__init__(Website, session, **kwargs)
 
-class ChannelView(ModelMixin, ModelView):
+class ChannelView(SnapshotMixin, ModelMixin, ModelView):
     can_create = True
     can_edit = False
     can_delete = False
@@ -104,21 +137,21 @@ class ChannelView(ModelMixin, ModelView):
         from ..models import Channel
         super(ChannelView, self).__init__(Channel, session, **kwargs)
 
-class HotwordView(ModelMixin, ModelView):
+class HotwordView(SnapshotMixin, ModelMixin, ModelView):
     column_labels = dict(keyword='热词', inuse='是否启用', since='添加日期')
 
     def __init__(self, session, **kwargs):
         from ..models import Hotword
         super(HotwordView, self).__init__(Hotword, session, **kwargs)
 
-class SensitiveView(ModelMixin, ModelView):
+class SensitiveView(SnapshotMixin, ModelMixin, ModelView):
     column_labels = dict(keyword='敏感词', inuse='是否启用', since='添加日期')
 
     def __init__(self, session, **kwargs):
         from ..models import Sensitive
         super(SensitiveView, self).__init__(Sensitive, session, **kwargs)
 
-class TokenView(ModelMixin, ModelView):
+class TokenView(SnapshotMixin, ModelMixin, ModelView):
     column_labels = dict(info='说明', create_at='添加日期')
 
     def __init__(self, session, **kwargs):
@@ -0,0 +1,274 @@
+# coding=utf-8
+
+import os
+import hmac
+import json
+import logging
+from bisect import bisect_left
+from functools import wraps
+from threading import Lock
+from time import perf_counter, time
+from flask import g, request, current_app, has_request_context, Response, abort, _app_ctx_stack
+
+logger = logging.getLogger(__name__)
+
+# 直方图上界(秒)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def record(stage, elapsed):
+    """
+    累加当前请求某个阶段的耗时, 不在请求中(后台线程, celery任务)时忽略
+    """
+    ctx = _app_ctx_stack.top
+    if ctx is not None:
+        spans = getattr(ctx.g, '_spans', None)
+        if spans is not None:
+            spans[stage] = spans.get(stage, 0.0) + elapsed
+
+def timed(stage):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(stage, perf_counter() - started)
+        return wrapper
+    return decorator
+
+def note_body(body):
+    """
+    记下本次请求最后发给es的请求体, 慢查询日志使用
+    """
+    if body is not None and has_request_context():
+        g._es_body = body
+
+# 各模块自己维护的计数: 名称 -> (类型, 说明, 取值函数), 取值函数返回 [(标签dict, 值)]
+_families = {}
+
+def register(name, kind, help, func):
+    """
+    登记一组计数, 随各worker的统计一起写入文件, /metrics合并输出
+    """
+    _families[name] = (kind, help, func)
+
+def family_values():
+    values = []
+    for name, (kind, help, func) in list(_families.items()):
+        try:
+            for labels, value in func():
+                values.append([name, sorted(labels.items()), value])
+        except Exception:
+            logger.exception('metrics family %s failed', name)
+    return values
+
+class Histogram(object):
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, counts=None, total=0.0):
+        self.counts = counts or [0] * (len(BUCKETS) + 1)
+        self.sum = total
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+    def merge(self, counts, total):
+        for i, n in enumerate(counts):
+            self.counts[i] += n
+        self.sum += total
+
+class Registry(object):
+    """
+    每个worker各自统计, 定期写入METRICS_DIR下以pid命名的文件, /metrics合并所有文件输出
+    """
+    def __init__(self):
+        self.requests = {}
+        self.stages = {}
+        self.appkeys = {}
+        self._lock = Lock()
+
+    def observe(self, endpoint, appkey, total, spans):
+        with self._lock:
+            histogram = self.requests.get(endpoint)
+            if histogram is None:
+                histogram = self.requests[endpoint] = Histogram()
+            histogram.observe(total)
+            for stage, elapsed in spans.items():
+                key = (endpoint, stage)
+                histogram = self.stages.get(key)
+                if histogram is None:
+                    histogram = self.stages[key] = Histogram()
+                histogram.observe(elapsed)
+            if appkey:
+                item = self.appkeys.get(appkey)
+                if item is None:
+                    item = self.appkeys[appkey] = [0, 0.0]
+                item[0] += 1
+                item[1] += total
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'requests': [[endpoint, h.counts, h.sum] for endpoint, h in self.requests.items()],
+                'stages': [[endpoint, stage, h.counts, h.sum] for (endpoint, stage), h in self.stages.items()],
+                'appkeys': [[appkey, item[0], item[1]] for appkey, item in self.appkeys.items()],
+                'families': family_values(),
+                'kinds': dict((name, family[0]) for name, family in _families.items()),
+                'pid': os.getpid(),
+            }
+
+    def dump(self, directory=None):
+        directory = directory or current_app.config['METRICS_DIR']
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, 'worker-{0}.json'.format(os.getpid()))
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+        os.rename(path + '.tmp', path)
+
+registry = Registry()
+
+def _alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def collect(directory, max_age=None):
+    """
+    合并所有worker的统计, 已退出worker的文件保留, 计数保持单调递增
+    gauge只取仍在运行且max_age秒内写过文件的worker, 退出的worker留下的值不再累加
+    """
+    requests, stages, appkeys, families = {}, {}, {}, {}
+    now = time()
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            fresh = max_age is None or now - os.path.getmtime(path) <= max_age
+        except (IOError, OSError, ValueError):
+            continue
+        for endpoint, counts, total in data['requests']:
+            requests.setdefault(endpoint, Histogram()).merge(counts, total)
+        for endpoint, stage, counts, total in data['stages']:
+            stages.setdefault((endpoint, stage), Histogram()).merge(counts, total)
+        for appkey, count, total in data['appkeys']:
+            item = appkeys.setdefault(appkey, [0, 0.0])
+            item[0] += count
+            item[1] += total
+        kinds = data.get('kinds', {})
+        live = fresh and _alive(data.get('pid'))
+        for name, labels, value in data.get('families', []):
+            kind = kinds.get(name) or _families.get(name, ('untyped',))[0]
+            if kind == 'gauge' and not live:
+                continue
+            key = (name, tuple(tuple(pair) for pair in labels))
+            families[key] = families.get(key, 0) + value
+    return requests, stages, appkeys, families
+
+def _histogram_lines(name, labels, histogram):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+        cumulative += count
+        lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(name, labels, bound, cumulative))
+    lines.append('{0}_sum{{{1}}} {2}'.format(name, labels, histogram.sum))
+    lines.append('{0}_count{{{1}}} {2}'.format(name, labels, cumulative))
+    return lines
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render(requests, stages, appkeys, families=None):
+    """
+    prometheus文本格式
+    """
+    lines = ['# HELP search_request_duration_seconds api request latency',
+        '# TYPE search_request_duration_seconds histogram']
+    for endpoint in sorted(requests):
+        lines.extend(_histogram_lines('search_request_duration_seconds', 'endpoint="{0}"'.format(_label(endpoint)), requests[endpoint]))
+    lines.extend(['# HELP search_stage_duration_seconds time spent in each stage of an api request',
+        '# TYPE search_stage_duration_seconds histogram'])
+    for endpoint, stage in sorted(stages):
+        labels = 'endpoint="{0}",stage="{1}"'.format(_label(endpoint), _label(stage))
+        lines.extend(_histogram_lines('search_stage_duration_seconds', labels, stages[(endpoint, stage)]))
+    lines.extend(['# HELP search_appkey_requests_total api requests per appkey',
+        '# TYPE search_appkey_requests_total counter'])
+    for appkey in sorted(appkeys):
+        lines.append('search_appkey_requests_total{{appkey="{0}"}} {1}'.format(_label(appkey), appkeys[appkey][0]))
+    lines.extend(['# HELP search_appkey_duration_seconds_total total api latency per appkey',
+        '# TYPE search_appkey_duration_seconds_total counter'])
+    for appkey in sorted(appkeys):
+        lines.append('search_appkey_duration_seconds_total{{appkey="{0}"}} {1}'.format(_label(appkey), appkeys[appkey][1]))
+    current = None
+    for name, labels in sorted(families or {}):
+        if name != current:
+            current = name
+            kind, help = _families.get(name, ('untyped', name))[:2]
+            lines.extend(['# HELP {0} {1}'.format(name, help), '# TYPE {0} {1}'.format(name, kind)])
+        label = ','.join('{0}="{1}"'.format(k, _label(v)) for k, v in labels)
+        lines.append('{0}{1} {2}'.format(name, '{' + label + '}' if label else '', families[(name, labels)]))
+    return '\n'.join(lines) + '\n'
+
+def before_request():
+    if request.path.startswith('/api/'):
+        g._spans = {}
+        g._started = perf_counter()
+
+def after_request(response):
+    spans = g.get('_spans')
+    if spans is None:
+        return response
+    total = perf_counter() - g._started
+    endpoint = request.endpoint or 'unknown'
+    # 只统计通过校验的appkey, 随意传入的appkey不会生成新的统计项
+    appkey = g.get('auth_appkey')
+    registry.observe(endpoint, appkey, total, spans)
+    if total >= current_app.config['METRICS_SLOW_TIME']:
+        logger.warning('slow request %s appkey=%s %.3fs stages=%s body=%s', endpoint, appkey, total,
+            json.dumps(dict((k, round(v, 4)) for k, v in spans.items())),
+            json.dumps(g.get('_es_body'), ensure_ascii=False, separators=(',', ':')))
+    return response
+
+def allowed():
+    """
+    默认拒绝: 配置了METRICS_TOKEN时凭 Authorization: Bearer <token> 访问;
+    经nginx转发的请求remote_addr都是127.0.0.1, METRICS_ALLOWED_IPS只适合直接访问gunicorn的抓取端
+    """
+    config = current_app.config
+    token = config['METRICS_TOKEN']
+    if token:
+        header = request.headers.get('Authorization', '')
+        if header.startswith('Bearer ') and hmac.compare_digest(header[7:].encode('utf-8'), token.encode('utf-8')):
+            return True
+    return request.remote_addr in config['METRICS_ALLOWED_IPS']
+
+def metrics_view():
+    if not allowed():
+        abort(403)
+    config = current_app.config
+    directory = config['METRICS_DIR']
+    registry.dump(directory)
+    # 正常运行的worker每个刷新间隔都会重写文件
+    max_age = config['METRICS_FLUSH_INTERVAL'] * 3
+    return Response(render(*collect(directory, max_age)), mimetype='text/plain; version=0.0.4')
+
+def init_app(app):
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+def init_metrics(app):
+    from . import notify
+    notify.every(app.config['METRICS_FLUSH_INTERVAL'], registry.dump)
+    notify.start_listener(app)
@@ -0,0 +1,87 @@
+# coding=utf-8
+
+import os
+import json
+import logging
+from threading import Thread, Lock
+from time import sleep, time
+from redis.exceptions import RedisError
+from . import flask_redis, db
+
+CHANNEL = 'search:notify'
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+_periodic = []
+_lock = Lock()
+_listener_pid = None
+
+def subscribe(topic, handler):
+    handlers = _handlers.setdefault(topic, [])
+    if handler not in handlers:
+        handlers.append(handler)
+
+def every(interval, handler):
+    _periodic.append([interval, handler, time()])
+
+def publish(topic, payload=None):
+    message = json.dumps({'topic': topic, 'payload': payload}, separators=(',', ':'))
+    try:
+        flask_redis.publish(CHANNEL, message)
+    except RedisError as e:
+        logger.warning('notify publish failed: %s', e)
+
+def dispatch(app, topic, payload):
+    with app.app_context():
+        for handler in _handlers.get(topic, []):
+            try:
+                handler(payload)
+            except Exception:
+                logger.exception('notify handler failed: %s', topic)
+            finally:
+                db.session.remove()
+
+def _run_periodic(app):
+    now = time()
+    for item in _periodic:
+        interval, handler, last = item
+        if now - last < interval:
+            continue
+        item[2] = now
+        with app.app_context():
+            try:
+                handler()
+            except Exception:
+                logger.exception('periodic handler failed')
+            finally:
+                db.session.remove()
+
+def _listen(app):
+    while True:
+        try:
+            pubsub = flask_redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CHANNEL)
+            while True:
+                message = pubsub.get_message(timeout=1.0)
+                if message is not None and message['type'] == 'message':
+                    data = message['data']
+                    data = json.loads(data.decode('utf-8') if type(data) == type(b'') else data)
+                    dispatch(app, data['topic'], data['payload'])
+                _run_periodic(app)
+        except RedisError as e:
+            logger.warning('notify listener disconnected: %s', e)
+            sleep(1)
+
+def start_listener(app):
+    """
+    每个worker进程启动一个后台线程订阅广播消息
+    """
+    global _listener_pid
+    with _lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+    thread = Thread(target=_listen, args=(app,), name='notify-listener')
+    thread.daemon = True
+    thread.start()
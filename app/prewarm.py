@@ -0,0 +1,98 @@
+# coding=utf-8
+
+import logging
+from copy import deepcopy
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from . import db
+from .models import Website, Hotword, History
+from .sensitive import sensitive_filter
+from .snapshot import snapshot
+from .api_v1.resolver import Site
+from .api_v1.cache import canonical_key
+
+logger = logging.getLogger(__name__)
+
+def hot_keywords(website_id):
+    """
+    网站在用的热词, 加上近期搜索次数最多的关键词
+    """
+    config = current_app.config
+    current = snapshot.current() if config['SNAPSHOT_ENABLED'] else None
+    if current is not None and 'hotwords' in current.tables:
+        keywords = current.words('hotwords', website_id)
+    else:
+        keywords = [row.keyword for row in db.session.query(Hotword.keyword).filter(Hotword.website_id == website_id, Hotword.inuse == True)]
+    since = datetime.utcnow() - timedelta(days=config['PREWARM_HISTORY_DAYS'])
+    rows = db.session.query(History.keyword, func.count(History.id).label('total')) \
+        .filter(History.date >= since, History.keyword != None) \
+        .group_by(History.keyword).order_by(func.count(History.id).desc()) \
+        .limit(config['PREWARM_HISTORY_TOP'])
+    for row in rows:
+        if row.keyword not in keywords:
+            keywords.append(row.keyword)
+    return keywords
+
+def prewarm_jobs():
+    """
+    (类型, 网站列表, 参数); 政协文史查询与网站无关, 按缓存key合并, 同一查询只执行一次
+    """
+    from .api_v1.views import SEARCH_DEFAULTS, GDSZX_DEFAULTS, common_params, gdszx_params, filter_sensitive
+    config = current_app.config
+    gdszx_websites = config['PREWARM_GDSZX_WEBSITES']
+    jobs = []
+    gdszx = OrderedDict()
+    for website in Website.query.all():
+        site = Site(website.id, website.domain, 0)
+        for keyword in hot_keywords(website.id):
+            for page in range(1, config['PREWARM_PAGES'] + 1):
+                params = common_params(dict(SEARCH_DEFAULTS, keyword=keyword, page=page))
+                if filter_sensitive(site.website_id, params) is None:
+                    jobs.append(('search', [site], params))
+                if gdszx_websites is None or website.id in gdszx_websites:
+                    params = gdszx_params(dict(GDSZX_DEFAULTS, keyword=keyword, page=page))
+                    # 敏感词替换后的参数才是缓存key
+                    if filter_sensitive(site.website_id, params) is None:
+                        gdszx.setdefault(canonical_key(params), ('gdszx', [], params))[1].append(site)
+    jobs.extend(gdszx.values())
+    return jobs
+
+def prewarm_one(app, job):
+    """
+    执行一个查询并写入各网站的缓存, 返回写入的条数
+    """
+    from .api_v1.views import search_site, gdszx_search
+    from .api_v1.cache import search_cache, gdszx_cache
+    kind, sites, params = job
+    with app.app_context():
+        config = app.config
+        try:
+            if kind == 'search':
+                site = sites[0]
+                search_cache.set(site.domain, params, search_site(site, params), config['PREWARM_TTL'])
+                return 1
+            result = gdszx_search(params)
+            for site in sites:
+                # 高亮按各网站的敏感词处理, 每个网站一份拷贝
+                data = deepcopy(result)
+                sensitive_filter.clean_highlight(site.website_id, data['data'], config['SENSITIVE_MODE'])
+                gdszx_cache.set(site.website_id, params, data, config['PREWARM_TTL'])
+            return len(sites)
+        except Exception:
+            logger.exception('prewarm failed: %s %s', kind, params['keyword'])
+            return 0
+
+def prewarm():
+    """
+    按热词和搜索记录回放查询, 预热es缓存并写入搜索结果缓存
+    """
+    app = current_app._get_current_object()
+    sensitive_filter.load()
+    jobs = prewarm_jobs()
+    with ThreadPoolExecutor(max_workers=app.config['PREWARM_CONCURRENCY']) as executor:
+        done = sum(executor.map(lambda job: prewarm_one(app, job), jobs))
+    logger.info('prewarmed %d cache entries from %d queries', done, len(jobs))
+    return done
@@ -0,0 +1,179 @@
+# coding=utf-8
+
+import os
+import re
+import logging
+import traceback
+from hashlib import sha1
+from time import perf_counter
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from redis.exceptions import RedisError
+from . import flask_redis, notify
+
+TOPIC = 'profiler'
+
+RANKING = 'search:slowsql'
+STATE = 'search:profiler:enabled'
+
+logger = logging.getLogger(__name__)
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,?)+\)', re.I)
+_SPACES = re.compile(r'\s+')
+
+def normalize(statement):
+    """
+    去掉字面量和空白差异, 相同结构的语句归为一类
+    """
+    statement = _STRING.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _SPACES.sub(' ', statement).strip()
+    return _IN_LIST.sub('IN (?)', statement)
+
+def call_site():
+    """
+    调用栈中最近一个应用内(非本模块)的位置
+    """
+    for frame in reversed(traceback.extract_stack()[:-3]):
+        filename = frame[0]
+        if filename.startswith(APP_ROOT) and not filename.endswith('profiler.py'):
+            return '{0}:{1} {2}'.format(os.path.relpath(filename, APP_ROOT), frame[1], frame[2])
+    return ''
+
+class Profiler(object):
+    """
+    记录超过FLASKY_SLOW_DB_QUERY_TIME的sql, 按规范化后的语句汇总到redis
+    关闭时游标事件只做一次属性判断
+    """
+    def __init__(self):
+        self.enabled = False
+        self.threshold = 0.5
+        self.top = 20
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.enabled:
+            conn.info.setdefault('profiler_started', []).append(perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not self.enabled:
+            return
+        stack = conn.info.get('profiler_started')
+        if not stack:
+            return
+        elapsed = perf_counter() - stack.pop()
+        if elapsed < self.threshold:
+            return
+        item = (statement, elapsed, call_site())
+        if has_request_context():
+            g.setdefault('_slow_queries', []).append(item)
+        else:
+            self.save([item], None)
+
+    def handle_error(self, context):
+        # 执行出错时没有after_cursor_execute, 弹出对应的开始时间
+        conn = context.connection
+        if conn is None:
+            return
+        stack = conn.info.get('profiler_started')
+        if stack:
+            stack.pop()
+
+    def save(self, items, endpoint):
+        try:
+            pipe = flask_redis.pipeline(transaction=False)
+            for statement, elapsed, site in items:
+                normalized = normalize(statement)
+                digest = sha1(normalized.encode('utf-8')).hexdigest()
+                key = '{0}:{1}'.format(RANKING, digest)
+                pipe.zincrby(RANKING, digest, elapsed)
+                pipe.hincrby(key, 'count', 1)
+                pipe.hincrbyfloat(key, 'total', elapsed)
+                pipe.hset(key, 'statement', normalized)
+                pipe.hset(key, 'call_site', site)
+                pipe.hset(key, 'last', elapsed)
+                if endpoint:
+                    pipe.hset(key, 'endpoint', endpoint)
+            pipe.execute()
+        except RedisError as e:
+            logger.warning('slow query record failed: %s', e)
+        for statement, elapsed, site in items:
+            logger.warning('slow query %.3fs at %s: %s', elapsed, site, statement)
+
+    def after_request(self, response):
+        items = g.pop('_slow_queries', None)
+        if items:
+            self.save(items, request.endpoint)
+        return response
+
+    def ranking(self, limit=None):
+        """
+        按总耗时排序的前N条
+        """
+        limit = limit or self.top
+        digests = flask_redis.zrevrange(RANKING, 0, limit - 1)
+        pipe = flask_redis.pipeline(transaction=False)
+        for digest in digests:
+            pipe.hgetall('{0}:{1}'.format(RANKING, digest.decode('utf-8') if type(digest) == type(b'') else digest))
+        rows = []
+        for data in pipe.execute():
+            data = dict((k.decode('utf-8') if type(k) == type(b'') else k, v.decode('utf-8') if type(v) == type(b'') else v) for k, v in data.items())
+            if not data:
+                continue
+            count = int(data.get('count', 0))
+            total = float(data.get('total', 0))
+            rows.append({
+                'statement': data.get('statement', ''),
+                'call_site': data.get('call_site', ''),
+                'endpoint': data.get('endpoint', ''),
+                'count': count,
+                'total': round(total, 3),
+                'avg': round(total / count, 3) if count else 0,
+                'last': round(float(data.get('last', 0)), 3),
+            })
+        return rows
+
+    def reset(self):
+        digests = flask_redis.zrange(RANKING, 0, -1)
+        pipe = flask_redis.pipeline(transaction=False)
+        for digest in digests:
+            pipe.delete('{0}:{1}'.format(RANKING, digest.decode('utf-8') if type(digest) == type(b'') else digest))
+        pipe.delete(RANKING)
+        pipe.execute()
+
+    def on_notify(self, payload):
+        self.enabled = bool(payload.get('enabled'))
+
+    def toggle(self, enabled):
+        """
+        通知所有worker开关记录, 状态保存在redis中, 新启动的worker也会读取
+        """
+        flask_redis.set(STATE, '1' if enabled else '0')
+        self.enabled = enabled
+        notify.publish(TOPIC, {'enabled': enabled})
+
+profiler = Profiler()
+
+def init_app(app):
+    profiler.threshold = app.config['FLASKY_SLOW_DB_QUERY_TIME']
+    profiler.top = app.config['PROFILER_TOP']
+    profiler.enabled = app.config['PROFILER_ENABLED']
+    app.after_request(profiler.after_request)
+    if not event.contains(Engine, 'before_cursor_execute', profiler.before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', profiler.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', profiler.after_cursor_execute)
+        event.listen(Engine, 'handle_error', profiler.handle_error)
+        notify.subscribe(TOPIC, profiler.on_notify)
+
+def init_profiler(app):
+    try:
+        state = flask_redis.get(STATE)
+    except RedisError:
+        state = None
+    if state is not None:
+        profiler.enabled = state in (b'1', '1')
+    notify.start_listener(app)
@@ -0,0 +1,247 @@
+# coding=utf-8
+
+from bisect import bisect_left
+from collections import deque, OrderedDict
+from threading import Lock
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+from . import db, notify
+from .metrics import timed
+from .models import Sensitive
+from .snapshot import snapshot
+
+TOPIC = 'sensitive'
+
+class Matcher(object):
+    """
+    search/replace基于子类的finditer, 每个结束位置给出最长的匹配
+    """
+    __slots__ = ()
+
+    def search(self, text):
+        for span in self.finditer(text):
+            return span
+        return None
+
+    def replace(self, text, repl='*'):
+        spans = list(self.finditer(text))
+        if not spans:
+            return text
+        chars = list(text)
+        for begin, end in spans:
+            for i in range(begin, end):
+                chars[i] = None
+        result = []
+        masked = False
+        for ch in chars:
+            if ch is not None:
+                result.append(ch)
+                masked = False
+            elif repl == '*':
+                result.append('*')
+            elif not masked and repl:
+                result.append(repl)
+                masked = True
+        return ''.join(result)
+
+class Automaton(Matcher):
+    """
+    Aho-Corasick自动机, 一次线性扫描找出所有敏感词
+    """
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [0]
+        for word in words:
+            self._add(word)
+        self._build()
+
+    def _add(self, word):
+        node = 0
+        for ch in word:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(0)
+            node = nxt
+        self.output[node] = max(self.output[node], len(word))
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0) if self.goto[f].get(ch, 0) != nxt else 0
+                # 合并后缀节点的输出, 记录最长匹配长度
+                self.output[nxt] = max(self.output[nxt], self.output[self.fail[nxt]])
+
+    def finditer(self, text):
+        node = 0
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if output[node]:
+                yield i + 1 - output[node], i + 1
+
+class MappedAutomaton(Matcher):
+    """
+    快照中扁平化的自动机: 节点表(fail, output, 边区间)和按字符排序的边表, 二分查找转移
+    """
+    __slots__ = ('root', 'fail', 'output', 'lo', 'hi', 'chars', 'targets')
+
+    def __init__(self, nodes, edges, root):
+        self.root = root
+        self.fail = nodes.columns['fail']
+        self.output = nodes.columns['output']
+        self.lo = nodes.columns['lo']
+        self.hi = nodes.columns['hi']
+        self.chars = edges.columns['char']
+        self.targets = edges.columns['target']
+
+    def finditer(self, text):
+        root = node = self.root
+        fail, output, lo, hi, chars, targets = self.fail, self.output, self.lo, self.hi, self.chars, self.targets
+        for i, ch in enumerate(text):
+            code = ord(ch)
+            while True:
+                start, end = lo[node], hi[node]
+                j = bisect_left(chars, code, start, end)
+                if j < end and chars[j] == code:
+                    node = targets[j]
+                    break
+                if node == root:
+                    break
+                node = fail[node]
+            if output[node]:
+                yield i + 1 - output[node], i + 1
+
+def automaton_tables(rows):
+    """
+    rows: 按网站排序的(website_id, keyword); 各网站的自动机拼成一张节点表和一张边表写入快照,
+    节点编号全局唯一, roots记录每个网站的根节点
+    """
+    words = OrderedDict()
+    for website_id, keyword in rows:
+        if keyword:
+            words.setdefault(website_id, []).append(keyword)
+    roots, nodes, edges = [], [], []
+    for website_id, keywords in words.items():
+        automaton = Automaton(keywords)
+        base = len(nodes)
+        roots.append((website_id, base))
+        for node, goto in enumerate(automaton.goto):
+            lo = len(edges)
+            for ch in sorted(goto):
+                edges.append((ord(ch), base + goto[ch]))
+            nodes.append((base + automaton.fail[node], automaton.output[node], lo, len(edges)))
+    return [
+        ('sensitive_roots', (('website_id', 'i'), ('root', 'i')), roots),
+        ('sensitive_nodes', (('fail', 'i'), ('output', 'i'), ('lo', 'i'), ('hi', 'i')), nodes),
+        ('sensitive_edges', (('char', 'i'), ('target', 'i')), edges),
+    ]
+
+class SensitiveFilter(object):
+    """
+    每个网站一个自动机, 后台修改后重建并整体替换
+    开启快照时直接使用快照中的自动机, 快照不可用才在进程内构建
+    """
+    def __init__(self):
+        self._automata = {}
+        self._lock = Lock()
+        self.loaded = False
+
+    def load(self, website_id=None):
+        query = db.session.query(Sensitive.website_id, Sensitive.keyword).filter(Sensitive.inuse == True)
+        if website_id is not None:
+            query = query.filter(Sensitive.website_id == website_id)
+        words = {}
+        for row in query.all():
+            words.setdefault(row.website_id, []).append(row.keyword)
+        with self._lock:
+            automata = dict(self._automata) if website_id is not None else {}
+            if website_id is not None:
+                automata.pop(website_id, None)
+            for id, keywords in words.items():
+                automata[id] = Automaton(keywords)
+            self._automata = automata
+            if website_id is None:
+                self.loaded = True
+
+    def get(self, website_id):
+        if current_app.config['SNAPSHOT_ENABLED']:
+            current = snapshot.current()
+            if current is not None and 'sensitive_nodes' in current.tables:
+                return current.automaton(website_id)
+            if not self.loaded:
+                self.load()
+        return self._automata.get(website_id)
+
+    def contains(self, website_id, text):
+        automaton = self.get(website_id)
+        return automaton is not None and bool(text) and automaton.search(text) is not None
+
+    def clean(self, website_id, text, mode='mask'):
+        automaton = self.get(website_id)
+        if automaton is None or not text:
+            return text
+        return automaton.replace(text, '*' if mode == 'mask' else '')
+
+    @timed('sensitive')
+    def clean_highlight(self, website_id, data, mode='mask'):
+        automaton = self.get(website_id)
+        if automaton is None or not isinstance(data, dict):
+            return data
+        repl = '*' if mode == 'mask' else ''
+        for hit in data.get('hits', {}).get('hits', []):
+            for field, fragments in hit.get('highlight', {}).items():
+                hit['highlight'][field] = [automaton.replace(fragment, repl) for fragment in fragments]
+        return data
+
+    def on_notify(self, payload):
+        # 使用快照时由快照的通知切换, 只有退回进程内自动机后才需要重建
+        if self.loaded:
+            self.load(payload.get('website_id'))
+
+sensitive_filter = SensitiveFilter()
+
+def _record_change(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        changes = session.info.setdefault('sensitive_changes', set())
+        changes.add(target.website_id)
+        # 修改了所属网站时旧网站也要重建
+        changes.update(inspect(target).attrs.website_id.history.deleted or ())
+
+def _publish_changes(session):
+    for website_id in session.info.pop('sensitive_changes', None) or ():
+        notify.publish(TOPIC, {'website_id': website_id})
+
+def _discard_changes(session):
+    session.info.pop('sensitive_changes', None)
+
+def register_events():
+    if event.contains(db.session, 'after_commit', _publish_changes):
+        return
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(Sensitive, name, _record_change)
+    event.listen(db.session, 'after_commit', _publish_changes)
+    event.listen(db.session, 'after_rollback', _discard_changes)
+    notify.subscribe(TOPIC, sensitive_filter.on_notify)
+
+def init_sensitive(app):
+    if not app.config['SNAPSHOT_ENABLED']:
+        with app.app_context():
+            sensitive_filter.load()
+    notify.start_listener(app)
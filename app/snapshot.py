@@ -0,0 +1,282 @@
+# coding=utf-8
+
+import os
+import mmap
+import struct
+import logging
+from array import array
+from bisect import bisect_left
+from threading import Lock
+from time import time
+from flask import current_app
+from . import db, notify
+from .models import Website, Token, Hotword, Sensitive, Channel
+
+logger = logging.getLogger(__name__)
+
+TOPIC = 'snapshot'
+
+MAGIC = b'SRCHSNAP'
+FORMAT = 1
+HEADER = struct.Struct('<8sIQI')
+ENTRY = struct.Struct('<16sQ')
+TABLE = struct.Struct('<II')
+COLUMN = struct.Struct('<16s1s3xQQ')
+
+# 表名 -> (查询, 列定义, 排序列); appsecret不导出
+def _tables():
+    return (
+        ('websites', db.session.query(Website.id, Website.domain, Website.name),
+            (('id', 'i'), ('domain', 's'), ('name', 's')), ('id',)),
+        ('tokens', db.session.query(Token.appkey, Token.id, Token.website_id, Token.frequent),
+            (('appkey', 's'), ('id', 'i'), ('website_id', 'i'), ('frequent', 'i')), ('appkey',)),
+        ('hotwords', db.session.query(Hotword.website_id, Hotword.keyword).filter(Hotword.inuse == True),
+            (('website_id', 'i'), ('keyword', 's')), ('website_id', 'keyword')),
+        ('sensitive', db.session.query(Sensitive.website_id, Sensitive.keyword).filter(Sensitive.inuse == True),
+            (('website_id', 'i'), ('keyword', 's')), ('website_id', 'keyword')),
+        ('channels', db.session.query(Channel.website_id, Channel.name),
+            (('website_id', 'i'), ('name', 's')), ('website_id', 'name')),
+    )
+
+def _pad(buf):
+    buf.extend(b'\0' * (-len(buf) % 8))
+
+def _name(value):
+    return value.encode('ascii').ljust(16, b'\0')
+
+def serialize(tables, generation):
+    """
+    tables: [(表名, 列定义, 行列表)], 行已按查找列排序
+    整数列为int64数组, 字符串列为uint32偏移数组加utf-8字符串表
+    """
+    buf = bytearray(HEADER.size + ENTRY.size * len(tables))
+    entries = []
+    for name, columns, rows in tables:
+        _pad(buf)
+        table_offset = len(buf)
+        entries.append(ENTRY.pack(_name(name), table_offset))
+        buf.extend(TABLE.pack(len(rows), len(columns)))
+        slots = len(buf)
+        buf.extend(b'\0' * (COLUMN.size * len(columns)))
+        specs = []
+        for i, (column, kind) in enumerate(columns):
+            _pad(buf)
+            start = len(buf)
+            values = [row[i] for row in rows]
+            if kind == 'i':
+                buf.extend(array('q', [int(v or 0) for v in values]).tobytes())
+            else:
+                blobs = [(v or '').encode('utf-8') for v in values]
+                offsets = array('I', [0])
+                for blob in blobs:
+                    offsets.append(offsets[-1] + len(blob))
+                buf.extend(offsets.tobytes())
+                buf.extend(b''.join(blobs))
+            specs.append(COLUMN.pack(_name(column), kind.encode('ascii'), start, len(buf) - start))
+        buf[slots:slots + COLUMN.size * len(columns)] = b''.join(specs)
+    buf[:HEADER.size] = HEADER.pack(MAGIC, FORMAT, generation, len(tables))
+    buf[HEADER.size:HEADER.size + ENTRY.size * len(tables)] = b''.join(entries)
+    return bytes(buf)
+
+class StrColumn(object):
+    """
+    字符串列, 按需解码, 可直接用于bisect
+    """
+    __slots__ = ('offsets', 'blob')
+
+    def __init__(self, view, rows):
+        self.offsets = view[:(rows + 1) * 4].cast('I')
+        self.blob = view[(rows + 1) * 4:]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+class Table(object):
+    def __init__(self, view, offset):
+        self.rows, ncols = TABLE.unpack_from(view, offset)
+        self.columns = {}
+        for i in range(ncols):
+            name, kind, start, length = COLUMN.unpack_from(view, offset + TABLE.size + COLUMN.size * i)
+            data = view[start:start + length]
+            name = name.rstrip(b'\0').decode('ascii')
+            self.columns[name] = data.cast('q') if kind == b'i' else StrColumn(data, self.rows)
+
+    def __len__(self):
+        return self.rows
+
+    def row(self, i):
+        return dict((name, column[i]) for name, column in self.columns.items())
+
+    def find(self, column, value):
+        """
+        在排序列上二分查找, 返回行号或None
+        """
+        values = self.columns[column]
+        i = bisect_left(values, value)
+        if i < len(values) and values[i] == value:
+            return i
+        return None
+
+    def group(self, column, value):
+        """
+        排序列等于value的行号区间
+        """
+        values = self.columns[column]
+        lo = bisect_left(values, value)
+        hi = bisect_left(values, value + 1, lo)
+        return range(lo, hi)
+
+class Snapshot(object):
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.key = (stat.st_ino, stat.st_mtime_ns)
+        view = memoryview(self._mmap)
+        magic, fmt, self.generation, count = HEADER.unpack_from(view, 0)
+        if magic != MAGIC or fmt != FORMAT:
+            raise ValueError('invalid snapshot file: {0}'.format(path))
+        self.tables = {}
+        self._derived = {}
+        for i in range(count):
+            name, offset = ENTRY.unpack_from(view, HEADER.size + ENTRY.size * i)
+            self.tables[name.rstrip(b'\0').decode('ascii')] = Table(view, offset)
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    def token(self, appkey):
+        tokens = self.tables['tokens']
+        i = tokens.find('appkey', appkey)
+        return None if i is None else tokens.row(i)
+
+    def website(self, website_id):
+        websites = self.tables['websites']
+        i = websites.find('id', website_id)
+        return None if i is None else websites.row(i)
+
+    def words(self, table, website_id):
+        """
+        某个网站的热词/敏感词/栏目
+        """
+        table = self.tables[table]
+        column = table.columns['name' if 'name' in table.columns else 'keyword']
+        return [column[i] for i in table.group('website_id', website_id)]
+
+    def automaton(self, website_id):
+        """
+        某个网站的敏感词自动机, 直接在映射的内存上匹配; 没有敏感词时返回None
+        """
+        key = ('automaton', website_id)
+        if key not in self._derived:
+            from .sensitive import MappedAutomaton
+            roots = self.tables['sensitive_roots']
+            i = roots.find('website_id', website_id)
+            self._derived[key] = None if i is None else MappedAutomaton(self.tables['sensitive_nodes'],
+                self.tables['sensitive_edges'], roots.columns['root'][i])
+        return self._derived[key]
+
+    def suggester(self, website_id):
+        """
+        某个网站的搜索提示前缀索引, 没有候选词时返回None
+        """
+        key = ('suggester', website_id)
+        if key not in self._derived:
+            from .suggest import MappedPrefixIndex
+            index = MappedPrefixIndex(self.tables['suggest'], self.tables['suggest_top'], website_id)
+            self._derived[key] = index if len(index) else None
+        return self._derived[key]
+
+class SnapshotStore(object):
+    """
+    各worker只读映射同一个快照文件, 内存占用与worker数无关
+    发布时写临时文件再rename, 读取方按间隔stat文件发现新版本
+    """
+    def __init__(self):
+        self._snapshot = None
+        self._checked = 0
+        self._lock = Lock()
+        self.path = None
+        self.interval = 1
+
+    def init_app(self, app):
+        self.path = app.config['SNAPSHOT_PATH']
+        self.interval = app.config['SNAPSHOT_CHECK_INTERVAL']
+
+    def build(self):
+        """
+        导出各表, 再附上由敏感词编译的自动机和redis中的搜索提示索引, 各worker不必各自构建
+        """
+        from .sensitive import automaton_tables
+        from .suggest import suggest_tables
+        tables = []
+        rows = {}
+        for name, query, columns, order in _tables():
+            positions = [i for i, (column, kind) in enumerate(columns) if column in order]
+            rows[name] = sorted((tuple(row) for row in query.all()), key=lambda row: [row[i] for i in positions])
+            tables.append((name, columns, rows[name]))
+        tables.extend(automaton_tables(rows['sensitive']))
+        tables.extend(suggest_tables([row[0] for row in rows['websites']]))
+        return serialize(tables, int(time() * 1000))
+
+    def publish(self):
+        data = self.build()
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.path)
+        generation = HEADER.unpack_from(data, 0)[2]
+        logger.info('snapshot published: %d bytes, generation %d', len(data), generation)
+        # 文件就位后再通知, worker收到时读到的一定是新版本
+        self._checked = 0
+        notify.publish(TOPIC, {'generation': generation})
+        return len(data)
+
+    def current(self):
+        now = time()
+        if self._snapshot is not None and now - self._checked < self.interval:
+            return self._snapshot
+        with self._lock:
+            if self._snapshot is not None and now - self._checked < self.interval:
+                return self._snapshot
+            self._checked = now
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                return self._snapshot
+            if self._snapshot is None or self._snapshot.key != (stat.st_ino, stat.st_mtime_ns):
+                try:
+                    # 旧的映射在没有引用后自动释放
+                    self._snapshot = Snapshot(self.path)
+                except (IOError, OSError, ValueError) as e:
+                    logger.warning('snapshot load failed: %s', e)
+            return self._snapshot
+
+    def on_notify(self, payload):
+        """
+        发布后立即重新打开, 不等检查间隔
+        """
+        self._checked = 0
+        current = self.current()
+        if current is not None and current.generation < payload.get('generation', 0):
+            logger.warning('snapshot generation %d is older than published %d', current.generation, payload['generation'])
+
+snapshot = SnapshotStore()
+
+def init_snapshot(app):
+    if not app.config['SNAPSHOT_ENABLED']:
+        return
+    notify.subscribe(TOPIC, snapshot.on_notify)
+    with app.app_context():
+        if not os.path.exists(snapshot.path):
+            snapshot.publish()
+        snapshot.current()
+    notify.start_listener(app)
@@ -0,0 +1,242 @@
+# coding=utf-8
+
+import json
+import heapq
+import logging
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from threading import Lock
+from flask import current_app
+from sqlalchemy import func
+from elasticsearch.helpers import scan
+from redis.exceptions import RedisError
+from . import db, flask_redis, notify
+from .models import Website, Hotword, History
+from .sensitive import sensitive_filter
+from .snapshot import snapshot
+from .es import es
+from .indices import index_name
+
+TOPIC = 'suggest'
+
+logger = logging.getLogger(__name__)
+
+def _key(website_id):
+    return 'search:suggest:{0}'.format(website_id)
+
+def _items(website_id):
+    data = flask_redis.get(_key(website_id))
+    if data is None:
+        return None
+    return json.loads(data.decode('utf-8') if type(data) == type(b'') else data)
+
+def normalize(text):
+    return ' '.join(text.split()).lower()
+
+class PrefixIndex(object):
+    """
+    按规范化文本排序的数组, 用二分查找定位前缀区间; 短前缀的结果预先算好
+    """
+    __slots__ = ('keys', 'texts', 'weights', 'top')
+
+    def __init__(self, items, size=10, precompute=2):
+        merged = {}
+        for text, weight in items:
+            key = normalize(text)
+            if not key:
+                continue
+            # 规范化后相同的词合并权重, 展示权重最大的写法
+            old = merged.get(key)
+            if old is None:
+                merged[key] = [text.strip(), weight, weight]
+            else:
+                if weight > old[2]:
+                    old[0], old[2] = text.strip(), weight
+                old[1] += weight
+        keys = sorted(merged)
+        self.keys = keys
+        self.texts = [merged[key][0] for key in keys]
+        self.weights = [merged[key][1] for key in keys]
+        self.top = {}
+        prefixes = set()
+        for key in keys:
+            for n in range(1, min(precompute, len(key)) + 1):
+                prefixes.add(key[:n])
+        for prefix in prefixes:
+            self.top[prefix] = self._scan(prefix, size)
+
+    def _scan(self, prefix, size):
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + '\U0010ffff', lo)
+        best = heapq.nlargest(size, range(lo, hi), key=self.weights.__getitem__)
+        return [(self.texts[i], self.weights[i]) for i in best]
+
+    def lookup(self, prefix, size=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        items = self.top.get(prefix)
+        if items is None:
+            items = self._scan(prefix, size)
+        return items[:size]
+
+    def __len__(self):
+        return len(self.keys)
+
+class MappedPrefixIndex(object):
+    """
+    快照中的前缀索引: 各网站的候选词按(website_id, 规范化文本)排序, 短前缀的结果以json存在suggest_top表
+    """
+    __slots__ = ('rows', 'keys', 'texts', 'weights', 'tops', 'prefixes', 'items')
+
+    def __init__(self, terms, top, website_id):
+        self.rows = terms.group('website_id', website_id)
+        self.keys = terms.columns['key']
+        self.texts = terms.columns['text']
+        self.weights = terms.columns['weight']
+        self.tops = top.group('website_id', website_id)
+        self.prefixes = top.columns['prefix']
+        self.items = top.columns['items']
+
+    def _scan(self, prefix, size):
+        lo = bisect_left(self.keys, prefix, self.rows.start, self.rows.stop)
+        hi = bisect_left(self.keys, prefix + '\U0010ffff', lo, self.rows.stop)
+        best = heapq.nlargest(size, range(lo, hi), key=self.weights.__getitem__)
+        return [(self.texts[i], self.weights[i]) for i in best]
+
+    def lookup(self, prefix, size=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        i = bisect_left(self.prefixes, prefix, self.tops.start, self.tops.stop)
+        if i < self.tops.stop and self.prefixes[i] == prefix:
+            return [tuple(item) for item in json.loads(self.items[i])][:size]
+        return self._scan(prefix, size)
+
+    def __len__(self):
+        return len(self.rows)
+
+def suggest_tables(website_ids):
+    """
+    把redis中各网站的候选词编成快照表, 与进程内PrefixIndex的结果一致
+    """
+    config = current_app.config
+    terms, tops = [], []
+    for id in sorted(website_ids):
+        try:
+            items = _items(id)
+        except RedisError as e:
+            logger.warning('suggest index not included in snapshot: %s', e)
+            return []
+        if items is None:
+            continue
+        index = PrefixIndex(items, config['SUGGEST_SIZE'], config['SUGGEST_PRECOMPUTE'])
+        terms.extend((id, key, text, weight) for key, text, weight in zip(index.keys, index.texts, index.weights))
+        tops.extend((id, prefix, json.dumps(items, separators=(',', ':'), ensure_ascii=False)) for prefix, items in sorted(index.top.items()))
+    return [
+        ('suggest', (('website_id', 'i'), ('key', 's'), ('text', 's'), ('weight', 'i')), terms),
+        ('suggest_top', (('website_id', 'i'), ('prefix', 's'), ('items', 's')), tops),
+    ]
+
+class Suggester(object):
+    """
+    每个网站一个前缀索引, 由构建任务写入redis, worker加载到进程内存
+    开启快照时直接查快照中的索引, 快照不可用才加载到进程内
+    """
+    def __init__(self):
+        self._indexes = {}
+        self._lock = Lock()
+        self.loaded = False
+
+    def load(self, website_id=None):
+        config = current_app.config
+        ids = [website_id] if website_id is not None else [row.id for row in db.session.query(Website.id)]
+        indexes = {}
+        for id in ids:
+            try:
+                items = _items(id)
+            except RedisError as e:
+                logger.warning('suggest index load failed: %s', e)
+                return
+            if items is None:
+                continue
+            indexes[id] = PrefixIndex(items, config['SUGGEST_SIZE'], config['SUGGEST_PRECOMPUTE'])
+        with self._lock:
+            merged = dict(self._indexes) if website_id is not None else {}
+            if website_id is not None:
+                merged.pop(website_id, None)
+            merged.update(indexes)
+            self._indexes = merged
+            if website_id is None:
+                self.loaded = True
+
+    def get(self, website_id):
+        if current_app.config['SNAPSHOT_ENABLED']:
+            current = snapshot.current()
+            if current is not None and 'suggest' in current.tables:
+                return current.suggester(website_id)
+            if not self.loaded:
+                self.load()
+        return self._indexes.get(website_id)
+
+    def lookup(self, website_id, prefix, size=10):
+        index = self.get(website_id)
+        if index is None:
+            return []
+        return index.lookup(prefix, size)
+
+    def on_notify(self, payload):
+        # 使用快照时由快照的通知切换
+        if self.loaded:
+            self.load(payload.get('website_id'))
+
+suggester = Suggester()
+
+def collect_terms(website):
+    """
+    热词, 近期搜索记录和文档标题, 按来源给不同权重, 含敏感词的不收录
+    """
+    config = current_app.config
+    weights = {}
+    def add(text, weight):
+        if text and not sensitive_filter.contains(website.id, text):
+            weights[text] = weights.get(text, 0) + weight
+    for row in db.session.query(Hotword.keyword).filter(Hotword.website_id == website.id, Hotword.inuse == True):
+        add(row.keyword, config['SUGGEST_HOTWORD_WEIGHT'])
+    # 搜索记录没有记录网站, 各网站共用
+    since = datetime.utcnow() - timedelta(days=config['SUGGEST_HISTORY_DAYS'])
+    rows = db.session.query(History.keyword, func.count(History.id).label('total')) \
+        .filter(History.date >= since, History.keyword != None) \
+        .group_by(History.keyword).order_by(func.count(History.id).desc()) \
+        .limit(config['SUGGEST_HISTORY_TOP'])
+    for row in rows:
+        add(row.keyword, row.total)
+    body = {'query': {'bool': {'filter': [{'term': {'website': website.domain}}]}}, '_source': ['title']}
+    for count, hit in enumerate(scan(es.client, query=body, index=index_name('suggest'), doc_type='news', size=1000)):
+        if count >= config['SUGGEST_TITLE_LIMIT']:
+            break
+        add(hit.get('_source', {}).get('title'), 1)
+    return sorted(weights.items(), key=lambda item: -item[1])
+
+def build():
+    """
+    为每个网站生成候选词, 写入redis后通知所有worker重新加载; 开启快照时重新发布快照
+    """
+    sensitive_filter.load()
+    total = 0
+    for website in Website.query.all():
+        items = collect_terms(website)
+        flask_redis.set(_key(website.id), json.dumps(items, separators=(',', ':'), ensure_ascii=False))
+        notify.publish(TOPIC, {'website_id': website.id})
+        total += len(items)
+    logger.info('suggest index built with %d terms', total)
+    if current_app.config['SNAPSHOT_ENABLED']:
+        snapshot.publish()
+    return total
+
+def init_suggest(app):
+    notify.subscribe(TOPIC, suggester.on_notify)
+    if not app.config['SNAPSHOT_ENABLED']:
+        with app.app_context():
+            suggester.load()
+    notify.start_listener(app)
@@ -0,0 +1,244 @@
+# coding=utf-8
+"""
+离线基准测试: 本地模拟es + fakeredis + sqlite, 通过Flask测试客户端走完整的wsgi流程,
+统计吞吐, 延迟分位数和各阶段耗时, 结果保存为json便于不同提交之间对比
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/bench_api.py --out before.json
+    python benchmarks/bench_api.py --out after.json
+    python benchmarks/bench_api.py --compare before.json after.json
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from time import time, perf_counter
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from loadtest import HEADERS, KEYWORDS, percentile, zipf_keywords, signed
+import fake_es
+
+APPKEY = 'benchappkey'
+APPSECRET = 'benchappsecret'
+DOMAIN = 'www.example.com'
+
+# 应用自身app.metrics记录的阶段
+STAGES = ('parse', 'ratelimit', 'auth', 'resolve', 'cache', 'dsl', 'es', 'sensitive', 'serialize')
+# 包含在其他阶段之内, 计算other时不重复扣除
+NESTED = ('resolve',)
+
+ENDPOINTS = {
+    'search': '/api/v1/search',
+    'gdszx': '/api/v1/gdszxsearch',
+    'suggest': '/api/v1/suggest',
+}
+
+_local = threading.local()
+
+class BenchmarkError(Exception):
+    pass
+
+def capture_stages(app):
+    """
+    各阶段耗时直接取app.metrics为当前请求记录的数据, 测试客户端在本线程内处理请求
+    """
+    from flask import g
+
+    @app.after_request
+    def capture(response):
+        _local.stages = dict(g.get('_spans') or {})
+        return response
+
+def create(opts, workdir, es_port):
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit('fakeredis is required: pip install -r benchmarks/requirements.txt')
+    import config
+    from app import create_app, db, flask_redis
+    from app.models import Website, Token, Hotword, Sensitive
+
+    class BenchmarkConfig(config.TestingConfig):
+        TESTING = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, 'bench.sqlite')
+        SQLALCHEMY_RECORD_QUERIES = False
+        ES_HOSTS = ['127.0.0.1:{0}'.format(es_port)]
+        ES_SNIFF_ON_START = False
+        ES_SNIFF_ON_CONNECTION_FAIL = False
+        SEARCH_CACHE_ENABLED = opts.cache
+        API_TOKEN_FORMAT = 'signed' if opts.signed_tokens else 'opaque'
+        RATELIMIT_IP_LIMIT = 10 ** 9
+        HISTORY_ENABLED = True
+        SNAPSHOT_PATH = os.path.join(workdir, 'snapshot.bin')
+
+    config.config['benchmark'] = BenchmarkConfig
+    app = create_app('benchmark')
+    capture_stages(app)
+    flask_redis._redis_client = fakeredis.FakeStrictRedis()
+    with app.app_context():
+        db.create_all()
+        db.session.add(Website(id=1, name='benchmark', domain=DOMAIN))
+        db.session.add(Token(info='benchmark', appkey=APPKEY, appsecret=APPSECRET, frequent=10 ** 9, website_id=1))
+        for keyword in KEYWORDS[:5]:
+            db.session.add(Hotword(keyword=keyword, website_id=1))
+        db.session.add(Sensitive(keyword='敏感词', website_id=1))
+        db.session.commit()
+    return app
+
+def fetch_token(client):
+    result = json.loads(client.post('/api/v1/token', headers=HEADERS,
+        data={'_': int(time() * 1000), 'appkey': APPKEY, 'appsecret': APPSECRET}).get_data(as_text=True))
+    if not result.get('success'):
+        raise BenchmarkError('token request failed: {0}'.format(result))
+    return result['data']['token']
+
+def run_endpoint(app, path, keywords, threads):
+    latencies = []
+    stages = dict((stage, 0.0) for stage in STAGES)
+    errors = [0]
+    lock = threading.Lock()
+    index = [0]
+
+    failures = []
+
+    def worker():
+        try:
+            work()
+        except Exception as e:
+            with lock:
+                failures.append(e)
+
+    def work():
+        client = app.test_client()
+        token = fetch_token(client)
+        while True:
+            with lock:
+                if index[0] >= len(keywords):
+                    return
+                keyword, page = keywords[index[0]]
+                index[0] += 1
+            _local.stages = {}
+            started = perf_counter()
+            response = client.post(path, headers=HEADERS, data=signed(APPKEY, token, keyword=keyword, page=page))
+            elapsed = perf_counter() - started
+            ok = response.status_code == 200 and json.loads(response.get_data(as_text=True)).get('success') == 1
+            with lock:
+                latencies.append(elapsed)
+                for stage, value in _local.stages.items():
+                    stages[stage] = stages.get(stage, 0.0) + value
+                if not ok:
+                    errors[0] += 1
+            _local.stages = None
+
+    started = perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    if failures:
+        raise BenchmarkError('{0} of {1} workers failed: {2}'.format(len(failures), threads, failures[0]))
+    duration = perf_counter() - started
+    n = len(latencies) or 1
+    total = sum(latencies)
+    breakdown = dict((stage, round(value / n * 1000, 3)) for stage, value in stages.items())
+    breakdown['other'] = round(max(0.0, total - sum(v for k, v in stages.items() if k not in NESTED)) / n * 1000, 3)
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'duration': round(duration, 3),
+        'throughput': round(len(latencies) / duration, 2),
+        'mean_ms': round(total / n * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'stages_ms': breakdown,
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(opts):
+    workdir = tempfile.mkdtemp(prefix='bench-api-')
+    server, port = fake_es.serve(docs=opts.docs, latency=opts.es_latency / 1000.0)
+    try:
+        app = create(opts, workdir, port)
+        words = zipf_keywords(KEYWORDS, opts.requests)
+        pages = zipf_keywords([1, 2, 3, 4, 5], opts.requests, s=1.5)
+        keywords = list(zip(words, pages))
+        results = {}
+        for name in opts.endpoints.split(','):
+            path = ENDPOINTS[name]
+            run_endpoint(app, path, keywords[:opts.warmup], opts.threads)
+            results[name] = run_endpoint(app, path, keywords, opts.threads)
+        return {
+            'commit': git_commit(),
+            'created': int(time()),
+            'options': {'requests': opts.requests, 'threads': opts.threads, 'cache': opts.cache, 'signed_tokens': opts.signed_tokens,
+                'es_latency_ms': opts.es_latency, 'docs': opts.docs},
+            'results': results,
+        }
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def compare(files):
+    runs = []
+    for name in files:
+        with open(name) as f:
+            runs.append((os.path.basename(name), json.load(f)))
+    keys = ['throughput', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'errors']
+    base = runs[0][1]['results']
+    for endpoint in base:
+        print('[{0}]'.format(endpoint))
+        print('{0:24s}'.format('') + ''.join('{0:>12s}'.format(k) for k in keys + list(STAGES)))
+        for name, data in runs:
+            result = data['results'].get(endpoint)
+            if result is None:
+                continue
+            row = [result[k] for k in keys] + [result['stages_ms'].get(stage) for stage in STAGES]
+            print('{0:24s}'.format('{0} {1}'.format(name, data.get('commit') or '')[:24]) + ''.join('{0:>12}'.format(v) for v in row))
+            if result is not base[endpoint] and base[endpoint]['throughput']:
+                change = (result['throughput'] - base[endpoint]['throughput']) / base[endpoint]['throughput'] * 100
+                print('{0:24s}{1:>+11.1f}%'.format('  throughput vs first', change))
+
+def main():
+    parser = argparse.ArgumentParser(description='offline api_v1 benchmark')
+    parser.add_argument('--endpoints', default='search,gdszx,suggest')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--docs', type=int, default=2000)
+    parser.add_argument('--es-latency', type=float, default=0, help='模拟es每个请求的延迟(毫秒)')
+    parser.add_argument('--cache', action='store_true', help='开启搜索结果缓存')
+    parser.add_argument('--signed-tokens', action='store_true', help='使用进程内校验的签名token')
+    parser.add_argument('--out')
+    parser.add_argument('--compare', nargs='+')
+    opts = parser.parse_args()
+    if opts.compare:
+        compare(opts.compare)
+        return
+    try:
+        result = run(opts)
+    except BenchmarkError as e:
+        sys.exit('benchmark failed: {0}'.format(e))
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if opts.out:
+        with open(opts.out, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    failed = [name for name, item in result['results'].items() if item['errors'] or not item['requests']]
+    if failed:
+        sys.exit('requests failed on: {0}'.format(', '.join(sorted(failed))))
+
+if __name__ == '__main__':
+    main()
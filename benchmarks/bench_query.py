@@ -0,0 +1,115 @@
+# coding=utf-8
+"""
+对比elasticsearch_dsl链式构造与预编译模板生成请求体的CPU耗时, 并校验两者结果一致
+
+    python benchmarks/bench_query.py [次数]
+"""
+
+import os
+import sys
+import json
+from re import split
+from timeit import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from elasticsearch_dsl.search import Search
+from app.api_v1.query import compile_common, compile_gdszx
+from app.api_v1.views import SEARCH_DEFAULTS, GDSZX_DEFAULTS, common_params, gdszx_params
+
+DOMAIN = 'www.example.com'
+
+# 改造前SearchApi.post中的构造方式
+def dsl_common(domain, params):
+	page = params['page']
+	size = params['size']
+	scope = params['scope']
+	s = Search(index='common', doc_type='search')
+	s = s.filter('term', website=domain)
+	for name, field in (('author', 'author'), ('editor', 'editor'), ('origin', 'origin'), ('category', 'category'), ('channel', 'channel'),
+			('v1', 'reserved_1'), ('v2', 'reserved_2'), ('v3', 'reserved_3'), ('v4', 'reserved_4'), ('v5', 'reserved_5'), ('v6', 'reserved_6')):
+		if params[name]:
+			s = s.filter('term', **{field: params[name]})
+	for name in ('has_pic', 'has_video'):
+		if params[name] == '0':
+			s = s.filter('term', **{name: False})
+		elif params[name] == '1':
+			s = s.filter('term', **{name: True})
+	s = s.filter('range', pdate={'gte': params['from'], 'lte': params['to']})
+	s = s.query('multi_match', query=params['keyword'], fields=scope)
+	if params['not']:
+		s = s.exclude('multi_match', query=params['not'], fields=scope)
+	if params['and'] != None and params['and'].strip() != '':
+		for word in split(r'\s+', params['and'].strip()):
+			s = s.query('multi_match', query=word, fields=scope)
+	s = s.highlight('title', fragment_size=50).highlight('content', fragment_size=100).highlight('tag', fragment_size=50).highlight('description', fragment_size=100)
+	if params['f'] == 'title':
+		s = s.exclude('terms', title__raw=params['l'])
+	elif params['f'] == 'url':
+		s = s.exclude('terms', url=params['l'])
+	s = s.sort(params['o'] + params['s'])
+	s = s[(page - 1) * size:page * size]
+	return s.to_dict()
+
+# 改造前GdszxSearch.post中的构造方式
+def dsl_gdszx(params):
+	page = params['page']
+	size = params['size']
+	scope = params['scope']
+	s = Search(index='gdszx', doc_type='culture')
+	for name in ('times', 'category', 'location', 'channel'):
+		if params[name]:
+			s = s.filter('term', **{name: params[name]})
+	if params['is_open'] == '0':
+		s = s.filter('term', is_open=False)
+	elif params['is_open'] == '1':
+		s = s.filter('term', is_open=True)
+	s = s.query('multi_match', query=params['keyword'], fields=scope)
+	if params['and'] != None and params['and'].strip() != '':
+		for word in split(r'\s+', params['and'].strip()):
+			s = s.query('multi_match', query=word, fields=scope)
+	s = s.highlight('title', fragment_size=50).highlight('content', fragment_size=100)
+	s.aggs.bucket('times_all', 'terms', field='times', size=10)
+	s.aggs.bucket('channel_all', 'terms', field='channel', size=10)
+	s.aggs.bucket('category_all', 'terms', field='category', size=10)
+	s.aggs.bucket('location_all', 'terms', field='location', size=10)
+	s = s.sort(params['o'] + params['s'])
+	s = s[(page - 1) * size:page * size]
+	return s.to_dict()
+
+COMMON_CASES = [
+	dict(SEARCH_DEFAULTS, keyword='广州'),
+	dict(SEARCH_DEFAULTS, keyword='广州 地铁', page='3', size='20', s='pdate', o='-'),
+	dict(SEARCH_DEFAULTS, keyword='台风', channel='news', category='local', origin='xinhua', has_pic='1', has_video='0',
+		v1='a', v3='c', v6='f', author='tony', editor='li', scope='title', **{'not': '谣言', 'and': '暴雨  预警'}),
+	dict(SEARCH_DEFAULTS, keyword='高考', f='title', l='标题一,标题二', **{'from': '2017-01-01', 'to': '2017-12-31'}),
+	dict(SEARCH_DEFAULTS, keyword='高考', f='url', l='http://a.com/1.html'),
+]
+
+GDSZX_CASES = [
+	dict(GDSZX_DEFAULTS, keyword='岭南'),
+	dict(GDSZX_DEFAULTS, keyword='岭南', **{'and': '文化 历史'}),
+	dict(GDSZX_DEFAULTS, keyword='岭南', times='民国', category='人物', location='广州', channel='文史', is_open='1', s='times', o='-', page='2'),
+]
+
+def canonical(body):
+	return json.dumps(body, sort_keys=True, ensure_ascii=False)
+
+def main():
+	number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	common = [common_params(args) for args in COMMON_CASES]
+	gdszx = [gdszx_params(args) for args in GDSZX_CASES]
+	for params in common:
+		assert canonical(dsl_common(DOMAIN, params)) == canonical(compile_common(DOMAIN, params)), params
+	for params in gdszx:
+		assert canonical(dsl_gdszx(params)) == canonical(compile_gdszx(params)), params
+	print('request bodies identical for {0} cases'.format(len(common) + len(gdszx)))
+	for name, old, new, cases in (
+			('search', lambda p: dsl_common(DOMAIN, p), lambda p: compile_common(DOMAIN, p), common),
+			('gdszx', dsl_gdszx, compile_gdszx, gdszx)):
+		t_old = timeit(lambda: [old(p) for p in cases], number=number) / (number * len(cases))
+		t_new = timeit(lambda: [new(p) for p in cases], number=number) / (number * len(cases))
+		print('{0:8s} dsl {1:8.1f}us  compiled {2:8.1f}us  speedup {3:5.1f}x'.format(name, t_old * 1e6, t_new * 1e6, t_old / t_new))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,131 @@
+# coding=utf-8
+"""
+本地模拟的elasticsearch, 只实现api_v1用到的接口, 返回固定结构的结果, 可设置固定延迟
+
+    python benchmarks/fake_es.py --port 9201 --latency 5
+"""
+
+import re
+import json
+import random
+import argparse
+import threading
+from time import sleep
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+WORDS = ['广州', '深圳', '台风', '高考', '地铁', '天气', '疫苗', '房价', '交通', '教育', '医院', '旅游', '美食', '文化', '体育',
+    '市民', '政府', '发布', '通知', '活动', '城市', '建设', '服务', '新闻', '记者', '报道', '今天', '工作', '发展', '项目']
+
+AGGS = ('times_all', 'channel_all', 'category_all', 'location_all')
+
+def make_docs(n, seed=1):
+    rnd = random.Random(seed)
+    docs = []
+    for i in range(n):
+        title = ''.join(rnd.choice(WORDS) for _ in range(rnd.randint(4, 10)))
+        docs.append({
+            '_index': 'common', '_type': 'search', '_id': str(i),
+            '_source': {
+                'title': title,
+                'content': ''.join(rnd.choice(WORDS) for _ in range(rnd.randint(300, 1500))),
+                'description': ''.join(rnd.choice(WORDS) for _ in range(30)),
+                'url': 'http://www.example.com/{0}.html'.format(i),
+                'pdate': '2017-{0:02d}-{1:02d}'.format(rnd.randint(1, 12), rnd.randint(1, 28)),
+                'channel': rnd.choice(['news', 'local', 'sports']),
+                'category': rnd.choice(['a', 'b', 'c']),
+                'website': 'www.example.com',
+            },
+            'highlight': {'title': ['<em>' + title[:4] + '</em>' + title[4:]]},
+        })
+    return docs
+
+class FakeES(object):
+    def __init__(self, docs=2000, latency=0.0):
+        self.docs = make_docs(docs)
+        self.latency = latency
+        self.requests = 0
+
+    def search(self, body):
+        size = body.get('size', 10)
+        start = body.get('from', 0)
+        hits = []
+        for i in range(size):
+            hit = dict(self.docs[(start + i) % len(self.docs)])
+            if 'highlight' not in body:
+                hit.pop('highlight')
+            if 'sort' in body:
+                hit['sort'] = [start + i, hit['_id']]
+            hits.append(hit)
+        response = {
+            'took': 3, 'timed_out': False,
+            '_shards': {'total': 5, 'successful': 5, 'failed': 0},
+            'hits': {'total': len(self.docs), 'max_score': 1.0, 'hits': hits},
+        }
+        for name in body.get('aggs', ()):
+            response.setdefault('aggregations', {})[name] = {
+                'doc_count_error_upper_bound': 0, 'sum_other_doc_count': 0,
+                'buckets': [{'key': word, 'doc_count': 100 - j} for j, word in enumerate(WORDS[:10])]}
+        return response
+
+    def suggest(self, body):
+        result = {'_shards': {'total': 5, 'successful': 5, 'failed': 0}}
+        for name, spec in body.items():
+            prefix = spec.get('prefix') or spec.get('text') or ''
+            result[name] = [{'text': prefix, 'offset': 0, 'length': len(prefix),
+                'options': [{'text': prefix + word, 'score': 1.0} for word in WORDS[:6]]}]
+        return result
+
+    def __call__(self, environ, start_response):
+        self.requests += 1
+        if self.latency:
+            sleep(self.latency)
+        path = environ.get('PATH_INFO', '/')
+        method = environ['REQUEST_METHOD']
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        raw = environ['wsgi.input'].read(length) if length else b''
+        body = json.loads(raw.decode('utf-8')) if raw else {}
+        if re.search(r'/_search/scroll', path):
+            result = {} if method == 'DELETE' else self.search({'size': 0})
+        elif path.endswith('/_search'):
+            result = self.search(body)
+        elif path.endswith('/_suggest'):
+            result = self.suggest(body)
+        else:
+            result = {'name': 'fake', 'version': {'number': '5.4.0'}}
+        data = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        start_response('200 OK', [('Content-Type', 'application/json; charset=UTF-8'), ('Content-Length', str(len(data)))])
+        return [data]
+
+class ThreadingServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+def serve(port=0, docs=2000, latency=0.0):
+    """
+    在后台线程启动, 返回 (服务器, 端口)
+    """
+    server = make_server('127.0.0.1', port, FakeES(docs, latency), server_class=ThreadingServer, handler_class=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, name='fake-es')
+    thread.daemon = True
+    thread.start()
+    return server, server.server_address[1]
+
+def main():
+    parser = argparse.ArgumentParser(description='fake elasticsearch for offline benchmarks')
+    parser.add_argument('--port', type=int, default=9201)
+    parser.add_argument('--docs', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0, help='每个请求的固定延迟(毫秒)')
+    opts = parser.parse_args()
+    server = make_server('127.0.0.1', opts.port, FakeES(opts.docs, opts.latency / 1000.0), server_class=ThreadingServer, handler_class=QuietHandler)
+    print('fake elasticsearch on http://127.0.0.1:{0}'.format(opts.port))
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
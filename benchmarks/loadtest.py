@@ -0,0 +1,194 @@
+# coding=utf-8
+"""
+对运行中的服务做并发压测, 统计吞吐, 延迟分位数和gunicorn进程组内存, 用于比较sync与gevent部署
+
+    gunicorn -w 49 -b 127.0.0.1:5050 wsgi:application
+    python benchmarks/loadtest.py --appkey KEY --appsecret SECRET --pid <gunicorn主进程pid> --out sync.json
+
+    gunicorn -c gunicorn_gevent.py wsgi:application
+    python benchmarks/loadtest.py --appkey KEY --appsecret SECRET --pid <gunicorn主进程pid> --out gevent.json
+
+    python benchmarks/loadtest.py --compare sync.json gevent.json
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import threading
+from bisect import bisect
+from hashlib import sha256
+from time import time, sleep
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) loadtest',
+    'Referer': 'http://loadtest.example.com/',
+}
+
+KEYWORDS = ['广州', '深圳', '台风', '高考', '地铁', '天气', '疫苗', '房价', '交通', '教育', '医院', '旅游', '美食', '文化', '体育']
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def zipf_keywords(keywords, n, s=1.1):
+    # random.choices要3.6以上, 用累积权重二分
+    cumulative = []
+    total = 0.0
+    for i in range(len(keywords)):
+        total += 1.0 / (i + 1) ** s
+        cumulative.append(total)
+    last = len(keywords) - 1
+    return [keywords[min(bisect(cumulative, random.random() * total), last)] for _ in range(n)]
+
+def post(base, path, params, timeout):
+    data = urlencode(params).encode('utf-8')
+    req = Request(base + path + '?_=' + str(params['_']), data=data, headers=HEADERS)
+    with urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read().decode('utf-8'))
+
+def fetch_token(base, appkey, appsecret):
+    result = post(base, '/api/v1/token', {'_': int(time() * 1000), 'appkey': appkey, 'appsecret': appsecret}, 10)
+    if not result.get('success'):
+        raise SystemExit('token request failed: {0}'.format(result))
+    return result['data']['token']
+
+def signed(appkey, token, **params):
+    ts = int(time() * 1000)
+    params.update({'_': ts, 'appkey': appkey, 'token': token,
+        'sign': sha256('{0},{1},{2}'.format(ts, token, appkey).encode('utf-8')).hexdigest()})
+    return params
+
+def rss_bytes(pid):
+    """
+    主进程及所有子进程的常驻内存之和
+    """
+    pids = [pid]
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{0}/stat'.format(entry)) as f:
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                    pids.append(int(entry))
+        except (IOError, OSError, IndexError, ValueError):
+            continue
+    total = 0
+    for p in pids:
+        try:
+            with open('/proc/{0}/status'.format(p)) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except (IOError, OSError):
+            continue
+    return total
+
+def run(opts):
+    token = fetch_token(opts.base, opts.appkey, opts.appsecret)
+    keywords = zipf_keywords(KEYWORDS, opts.requests)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    index = [0]
+
+    def worker():
+        while True:
+            with lock:
+                if index[0] >= len(keywords):
+                    return
+                keyword = keywords[index[0]]
+                index[0] += 1
+            params = signed(opts.appkey, token, keyword=keyword, page=random.choice([1, 1, 1, 2, 3]))
+            started = time()
+            try:
+                result = post(opts.base, opts.path, params, opts.timeout)
+                ok = result.get('success') == 1
+            except Exception:
+                ok = False
+            elapsed = time() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    rss = []
+    stop = threading.Event()
+
+    def sample_rss():
+        while not stop.is_set():
+            rss.append(rss_bytes(opts.pid))
+            sleep(1)
+
+    sampler = None
+    if opts.pid:
+        sampler = threading.Thread(target=sample_rss)
+        sampler.daemon = True
+        sampler.start()
+    started = time()
+    threads = [threading.Thread(target=worker) for _ in range(opts.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duration = time() - started
+    stop.set()
+    if sampler is not None:
+        sampler.join()
+    throughput = len(latencies) / duration
+    peak_rss = max(rss) if rss else 0
+    return {
+        'path': opts.path,
+        'concurrency': opts.concurrency,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'duration': round(duration, 3),
+        'throughput': round(throughput, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'rss_mb': round(peak_rss / 1048576.0, 1),
+        'throughput_per_gb': round(throughput / (peak_rss / 1073741824.0), 2) if peak_rss else None,
+    }
+
+def compare(files):
+    results = []
+    for name in files:
+        with open(name) as f:
+            results.append((name, json.load(f)))
+    keys = ['throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'rss_mb', 'throughput_per_gb', 'errors']
+    print('{0:24s}'.format('') + ''.join('{0:>18s}'.format(k) for k in keys))
+    for name, result in results:
+        print('{0:24s}'.format(os.path.basename(name)) + ''.join('{0:>18}'.format(result.get(k)) for k in keys))
+
+def main():
+    parser = argparse.ArgumentParser(description='api_v1 load test')
+    parser.add_argument('--base', default='http://127.0.0.1:5050')
+    parser.add_argument('--path', default='/api/v1/search')
+    parser.add_argument('--appkey')
+    parser.add_argument('--appsecret')
+    parser.add_argument('--pid', type=int, default=0, help='gunicorn主进程pid, 用于统计内存')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--out')
+    parser.add_argument('--compare', nargs='+')
+    opts = parser.parse_args()
+    if opts.compare:
+        compare(opts.compare)
+        return
+    if not opts.appkey or not opts.appsecret:
+        parser.error('--appkey and --appsecret are required')
+    result = run(opts)
+    print(json.dumps(result, indent=2))
+    if opts.out:
+        with open(opts.out, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# coding=utf-8
+
+import pytest
+from flask import Flask
+from config import config
+
+@pytest.fixture
+def app():
+    """
+    只加载测试配置, 不连接数据库和redis, 供纯逻辑的单元测试使用
+    """
+    app = Flask('app')
+    app.config.from_object(config['testing'])
+    with app.test_request_context():
+        yield app
+
+@pytest.fixture
+def redis(monkeypatch):
+    """
+    用fakeredis代替redis连接, 需要安装benchmarks/requirements.txt
+    """
+    fakeredis = pytest.importorskip('fakeredis')
+    from app import flask_redis
+    client = fakeredis.FakeStrictRedis()
+    client.flushall()
+    monkeypatch.setattr(flask_redis, '_redis_client', client)
+    return client
+
+class BrokenRedis(object):
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            from redis.exceptions import ConnectionError
+            raise ConnectionError('redis down')
+        return fail
+
+@pytest.fixture
+def broken_redis(monkeypatch):
+    """
+    所有redis命令都抛出连接错误
+    """
+    from app import flask_redis
+    monkeypatch.setattr(flask_redis, '_redis_client', BrokenRedis())
+
+@pytest.fixture
+def database(app):
+    """
+    内存sqlite, 只建网站和授权表
+    """
+    from app import db
+    from app.models import Website, Token
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    db.Model.metadata.create_all(bind=db.engine, tables=[Website.__table__, Token.__table__])
+    yield db
+    db.session.remove()
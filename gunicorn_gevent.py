@@ -0,0 +1,21 @@
+# coding=utf-8
+# gevent协程模式: gunicorn -c gunicorn_gevent.py wsgi:application
+
+import os
+import multiprocessing
+
+os.environ.setdefault('FLASK_CONFIG', 'gevent')
+
+from config import config
+
+bind = os.getenv('GUNICORN_BIND', '127.0.0.1:5050')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gevent'
+worker_connections = config[os.environ['FLASK_CONFIG']].GEVENT_WORKER_CONNECTIONS
+# 应用在worker中加载, monkey patch先于redis/es/sqlalchemy等模块导入
+preload_app = False
+timeout = 30
+graceful_timeout = 10
+keepalive = 5
+max_requests = 100000
+max_requests_jitter = 1000
@@ -29,6 +29,62 @@ def deploy():
     upgrade()
     Role.insert_roles()
     User.insert_users()
+    from app.celery_tasks import prewarm_search
+    try:
+        prewarm_search.delay()
+    except Exception as e:
+        print('prewarm not scheduled: {0}'.format(e))
+
+@manager.command
+def prewarm():
+    from app.prewarm import prewarm
+    print('{0} cache entries prewarmed'.format(prewarm()))
+
+@manager.command
+def index_full(namespace=None):
+    from app.indexer import full_load
+    for stats in full_load(namespace):
+        print(stats)
+
+@manager.command
+def index_sync():
+    from app.indexer import sync
+    sync()
+
+@manager.command
+def index_rebuild(name, replace_concrete=False):
+    from app.indices import rebuild
+    print('{0} now serves {1}'.format(rebuild(name, replace_concrete=replace_concrete), name))
+
+@manager.command
+def snapshot_build():
+    from app.snapshot import snapshot
+    print('snapshot written: {0} bytes'.format(snapshot.publish()))
+
+@manager.command
+def suggest_build():
+    from app.suggest import build
+    print('{0} suggestion terms built'.format(build()))
+
+@manager.command
+def cache_invalidate(domain):
+    from app.api_v1.cache import search_cache, gdszx_cache, facet_cache, FACET_SCOPE
+    count = search_cache.invalidate(domain)
+    # 政协文史结果按网站id缓存, 聚合结果各网站共用
+    website = Website.query.filter_by(domain=domain).first()
+    if website is not None:
+        count += gdszx_cache.invalidate(website.id) + facet_cache.invalidate(FACET_SCOPE)
+    print('{0} cached results removed for {1}'.format(count, domain))
+
+@manager.command
+def token_revoke(appkey):
+    from app import flask_redis
+    from app.api_v1.tokens import revocations
+    from app.api_v1.limiter import token_key
+    # opaque token直接删除, signed token加入吊销名单
+    flask_redis.delete(token_key(appkey))
+    until = revocations.revoke(appkey)
+    print('tokens of {0} revoked until {1}'.format(appkey, until))
 
 if __name__ == '__main__':
     manager.run()
\ No newline at end of file
@@ -0,0 +1,59 @@
+# coding=utf-8
+
+import json
+import pytest
+from werkzeug.exceptions import HTTPException
+from app.api_v1.args import Schema, Argument, num_limit, date_limit, fields_limit, sort_limit
+
+schema = Schema('TestArgs',
+    Argument('_', type=int, help='时间戳不能空', required=True, dest='ts'),
+    Argument('page', type=num_limit, default=1),
+    Argument('start', type=date_limit),
+    Argument('s', type=sort_limit, default='_score'),
+    Argument('fields', type=fields_limit),
+)
+
+def parse(app, **kwargs):
+    with app.test_request_context('/api/v1/search', method='POST', **kwargs):
+        return schema.parse()
+
+def parse_error(app, **kwargs):
+    with pytest.raises(HTTPException) as info:
+        parse(app, **kwargs)
+    assert info.value.code == 400
+    return info.value.data['message']
+
+def test_form_values(app):
+    args = parse(app, data={'_': '123', 'page': '3', 'start': '2017-02-28', 's': 'pdate', 'fields': 'title, url'})
+    assert args['_'] == 123
+    assert args.ts == 123
+    assert args['page'] == '3'
+    assert args['s'] == 'pdate'
+    assert args['fields'] == ['title', 'url']
+    assert args.to_dict()['start'] == '2017-02-28'
+
+def test_defaults(app):
+    args = parse(app, query_string={'_': '1', 's': 'unknown'})
+    assert args['page'] == 1
+    assert args['s'] == '_score'
+    assert args['fields'] is None
+    assert args.get('missing', 'x') == 'x'
+
+def test_json_body(app):
+    args = parse(app, data=json.dumps({'_': 1, 'page': '2'}), content_type='application/json')
+    assert args['page'] == '2'
+
+def test_missing_required(app):
+    message = parse_error(app, data={'page': '2'})
+    assert message == {'_': '时间戳不能空'}
+
+def test_invalid_values(app):
+    assert 'page' in parse_error(app, data={'_': '1', 'page': '51'})
+    assert 'start' in parse_error(app, data={'_': '1', 'start': '2017-02-30'})
+    assert 'fields' in parse_error(app, data={'_': '1', 'fields': 'title,bad-field'})
+
+def test_non_string_json_values(app):
+    # 非字符串的json值不能导致500
+    assert 'page' in parse_error(app, data=json.dumps({'_': 1, 'page': 2}), content_type='application/json')
+    assert 'fields' in parse_error(app, data=json.dumps({'_': 1, 'fields': ['title']}), content_type='application/json')
+    assert '_' in parse_error(app, data=json.dumps({'_': {'a': 1}}), content_type='application/json')
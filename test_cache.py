@@ -0,0 +1,53 @@
+# coding=utf-8
+
+from app import notify
+from app.api_v1.cache import LocalLRU, ResultCache, canonical_key, on_notify, search_cache
+from app.metrics import Registry, collect, render
+
+def test_canonical_key_ignores_dict_order():
+    assert canonical_key('search', 'a.com', {'page': 1, 'keyword': 'x'}) == canonical_key('search', 'a.com', {'keyword': 'x', 'page': 1})
+    assert canonical_key('search', 'a.com', {'page': 1}) != canonical_key('search', 'a.com', {'page': 2})
+
+def test_local_lru():
+    lru = LocalLRU(maxsize=2)
+    lru.set('a', 1, 60, 'a.com')
+    lru.set('b', 2, 60, 'b.com')
+    assert lru.get('a') == 1
+    lru.set('c', 3, 60, 'a.com')
+    # b最久未使用, 被淘汰
+    assert lru.get('b') is None
+    assert lru.invalidate('a.com') == 2
+    assert len(lru) == 0
+    lru.set('d', 4, -1)
+    assert lru.get('d') is None
+    assert lru.get('d', allow_stale=True) == 4
+
+def test_result_cache_round_trip(app, redis, monkeypatch):
+    published = []
+    monkeypatch.setattr(notify, 'publish', lambda topic, payload=None: published.append((topic, payload)))
+    app.config['SEARCH_CACHE_ENABLED'] = True
+    cache = ResultCache('test')
+    params = {'keyword': '政协', 'page': 1}
+    assert cache.get('a.com', params) is None
+    cache.set('a.com', params, {'success': 1})
+    assert cache.get('a.com', params) == {'success': 1}
+    cache.local.clear()
+    assert cache.get('a.com', params) == {'success': 1}
+    assert cache.counters['local_hits'] == 1
+    assert cache.counters['redis_hits'] == 1
+    assert cache.counters['misses'] == 1
+    assert cache.invalidate('a.com') == 1
+    assert published == [('cache', {'namespace': 'test', 'domain': 'a.com'})]
+    assert cache.get('a.com', params) is None
+
+def test_invalidation_notice_clears_local_copy(app):
+    search_cache.local.set('k', {'success': 1}, 60, 7)
+    on_notify({'namespace': 'search', 'domain': 7})
+    assert search_cache.local.get('k') is None
+
+def test_cache_counters_exported(tmpdir, monkeypatch):
+    monkeypatch.setitem(search_cache.counters, 'misses', 3)
+    Registry().dump(str(tmpdir))
+    text = render(*collect(str(tmpdir)))
+    assert 'search_cache_events_total{cache="search",event="misses"} 3' in text
+    assert '# TYPE search_cache_events_total counter' in text
@@ -0,0 +1,105 @@
+# coding=utf-8
+
+import os
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from elasticsearch.exceptions import ConnectionError, TransportError
+from app.es import CircuitBreaker, CircuitOpenError, ESClient
+
+class FakeClient(object):
+    def __init__(self):
+        self.error = None
+        self.calls = 0
+
+    def search(self, **kwargs):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return {'hits': {'hits': []}}
+
+def make_client(threshold=2):
+    client = ESClient()
+    client.breaker = CircuitBreaker(threshold=threshold, reset_timeout=30)
+    client._client = FakeClient()
+    client._executor = ThreadPoolExecutor(max_workers=1)
+    client._pid = os.getpid()
+    return client
+
+def expire(breaker):
+    breaker.opened_at -= breaker.reset_timeout
+
+def test_breaker_cycle():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+    assert breaker.state == 'closed'
+    breaker.failure()
+    assert breaker.state == 'closed'
+    breaker.failure()
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    expire(breaker)
+    assert breaker.state == 'half-open'
+    assert breaker.before_call() is True
+    # 只放行一个试探请求
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.success()
+    assert breaker.state == 'closed'
+    assert breaker.before_call() is False
+
+def test_breaker_probe_failure_reopens():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=30)
+    breaker.failure()
+    expire(breaker)
+    assert breaker.before_call() is True
+    breaker.failure()
+    assert breaker.state == 'open'
+    expire(breaker)
+    assert breaker.before_call() is True
+
+def test_breaker_non_probe_calls_rejected_when_half_open():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=30)
+    breaker.failure()
+    expire(breaker)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call(probe=False)
+    # 辅助请求不占用试探名额
+    assert breaker.before_call() is True
+
+def test_client_recovers_after_open():
+    client = make_client()
+    client._client.error = ConnectionError('N/A', 'down', None)
+    for i in range(2):
+        with pytest.raises(ConnectionError):
+            client.search(index='common', body={})
+    with pytest.raises(CircuitOpenError):
+        client.search(index='common', body={})
+    client._client.error = None
+    expire(client.breaker)
+    # 辅助查询先到也不能卡住试探名额
+    with pytest.raises(CircuitOpenError):
+        client.submit('search', index='related', body={}).result()
+    assert client.search(index='common', body={}) == {'hits': {'hits': []}}
+    assert client.breaker.state == 'closed'
+    assert client.submit('search', index='related', body={}).result() == {'hits': {'hits': []}}
+
+def test_client_probe_released_on_unexpected_error():
+    client = make_client(threshold=1)
+    client._client.error = ConnectionError('N/A', 'down', None)
+    with pytest.raises(ConnectionError):
+        client.search(index='common', body={})
+    expire(client.breaker)
+    client._client.error = ValueError('bad body')
+    with pytest.raises(ValueError):
+        client.search(index='common', body={})
+    assert client.breaker.state == 'half-open'
+    client._client.error = None
+    assert client.search(index='common', body={}) == {'hits': {'hits': []}}
+    assert client.breaker.state == 'closed'
+
+def test_client_overload_counts_as_failure():
+    client = make_client(threshold=1)
+    client._client.error = TransportError(429, 'es_rejected_execution_exception', {})
+    with pytest.raises(TransportError):
+        client.search(index='common', body={})
+    assert client.breaker.state == 'open'
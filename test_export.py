@@ -0,0 +1,86 @@
+# coding=utf-8
+
+import csv
+import io
+import json
+import pytest
+from elasticsearch.exceptions import ConnectionError
+from app.api_v1 import export
+
+class FakeClient(object):
+    """
+    每页两条, fail_after页之后scroll抛出连接错误
+    """
+    def __init__(self, pages, fail_after=None):
+        self.pages = pages
+        self.fail_after = fail_after
+        self.searches = []
+        self.scrolls = 0
+        self.cleared = []
+
+    def page(self, n):
+        hits = [{'_id': str(n * 2 + i), '_source': {'title': '标题{0}'.format(n * 2 + i), 'url': 'u'}} for i in range(2)] if n < self.pages else []
+        return {'_scroll_id': 'scroll-{0}'.format(n), 'hits': {'hits': hits}, '_shards': {'total': 1, 'failed': 0}}
+
+    def search(self, body, **kwargs):
+        self.searches.append(body)
+        self.scrolls = 0
+        return self.page(0)
+
+    def scroll(self, scroll_id, **kwargs):
+        self.scrolls += 1
+        if self.fail_after is not None and self.scrolls >= self.fail_after:
+            raise ConnectionError('N/A', 'scroll lost', None)
+        return self.page(self.scrolls)
+
+    def clear_scroll(self, body, **kwargs):
+        self.cleared.extend(body['scroll_id'])
+
+class FakeES(object):
+    def __init__(self, client):
+        self.client = client
+
+@pytest.fixture
+def client(app, monkeypatch):
+    def install(pages, fail_after=None):
+        client = FakeClient(pages, fail_after)
+        monkeypatch.setattr(export, 'es', FakeES(client))
+        return client
+    return install
+
+def body(chunks):
+    return b''.join(chunks).decode('utf-8')
+
+def test_export_hits_slices_and_limit(app, client):
+    fake = client(pages=5)
+    hits = list(export.export_hits('common', 'search', {'query': {'match_all': {}}}, 1, 4))
+    assert len(hits) == 10
+    assert fake.searches[0]['slice'] == {'id': 1, 'max': 4}
+    assert fake.cleared
+    app.config['EXPORT_MAX_DOCS'] = 3
+    assert len(list(export.export_hits('common', 'search', {}, 0, 1))) == 3
+    assert 'slice' not in fake.searches[1]
+
+def test_ndjson_complete(app, client):
+    client(pages=3)
+    lines = body(export.export_stream(export.export_hits('common', 'search', {}), 'ndjson', ['title'])).splitlines()
+    assert len(lines) == 6
+    assert json.loads(lines[0]) == {'_id': '0', 'title': '标题0'}
+
+def test_ndjson_error_trailer(app, client):
+    client(pages=5, fail_after=2)
+    lines = body(export.export_stream(export.export_hits('common', 'search', {}), 'ndjson', ['title'])).splitlines()
+    assert len(lines) == 5
+    assert json.loads(lines[-1]) == {'_error': '导出中断: ConnectionError'}
+
+def test_csv_error_marker(app, client):
+    client(pages=5, fail_after=2)
+    rows = list(csv.reader(io.StringIO(body(export.export_stream(export.export_hits('common', 'search', {}), 'csv', ['title', 'url'])))))
+    assert rows[0] == ['_id', 'title', 'url']
+    assert rows[1] == ['0', '标题0', 'u']
+    assert len(rows) == 6
+    assert rows[-1] == ['#error', '导出中断: ConnectionError']
+
+def test_chunked_sizes():
+    chunks = list(export.chunked(['a\n'] * 250, size=100))
+    assert [len(chunk) for chunk in chunks] == [200, 200, 100]
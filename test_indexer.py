@@ -0,0 +1,103 @@
+# coding=utf-8
+
+import pytest
+from bson.timestamp import Timestamp
+from app import indexer
+from app.exceptions import ReadError, BulkError
+
+def fake_read_range(ns, lo, hi, batch_size, queue):
+    if lo == 'bad':
+        raise IOError('cursor lost')
+    for i in range(3):
+        queue.put({'_id': '{0}-{1}'.format(lo, i)})
+
+class FakeIndices(object):
+    def get_settings(self, index):
+        return {index: {'settings': {'index': {'refresh_interval': '1s', 'number_of_replicas': '1'}}}}
+
+    def put_settings(self, index, body):
+        pass
+
+    def refresh(self, index):
+        pass
+
+class FakeClient(object):
+    indices = FakeIndices()
+
+class FakeES(object):
+    client = FakeClient()
+
+@pytest.fixture
+def loader(app, monkeypatch):
+    app.config.update(INDEXER_NAMESPACES={'db.article': ('article', 'article')}, INDEXER_READ_THREADS=2,
+        INDEXER_BATCH_SIZE=10, INDEXER_BULK_THREADS=1, INDEXER_BULK_SIZE=10, INDEXER_TIMEOUT=10)
+    saved = []
+    monkeypatch.setattr(indexer, 'read_range', fake_read_range)
+    monkeypatch.setattr(indexer, 'es', FakeES())
+    monkeypatch.setattr(indexer, 'collection', lambda ns: None)
+    monkeypatch.setattr(indexer, 'oplog_position', lambda: 'ts')
+    monkeypatch.setattr(indexer, 'save_checkpoint', saved.append)
+    monkeypatch.setattr(indexer, 'parallel_bulk', lambda client, actions, **kwargs: ((True, action) for action in actions))
+    return saved
+
+def test_parallel_read_records_errors(app, monkeypatch):
+    monkeypatch.setattr(indexer, 'read_range', fake_read_range)
+    errors = []
+    items = list(indexer.parallel_read(app, 'db.article', [('a', 'b'), ('bad', 'c')], 10, errors))
+    assert len(items) == 3
+    assert [(lo, hi) for lo, hi, e in errors] == [('bad', 'c')]
+
+def test_full_load_saves_checkpoint(loader, monkeypatch):
+    monkeypatch.setattr(indexer, 'split_ranges', lambda coll, parts: [('a', 'b'), ('c', 'd')])
+    results = indexer.full_load()
+    assert results[0]['indexed'] == 6
+    assert loader == ['ts']
+
+def test_full_load_read_failure_skips_checkpoint(loader, monkeypatch):
+    monkeypatch.setattr(indexer, 'split_ranges', lambda coll, parts: [('a', 'b'), ('bad', 'c')])
+    with pytest.raises(ReadError):
+        indexer.full_load()
+    assert loader == []
+
+class FakeBulk(object):
+    """
+    前failures次调用返回连接错误, 之后全部成功
+    """
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, client, actions, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            return 0, [{'index': {'_id': action['_id'], 'status': 'N/A', 'error': 'ConnectionError'}} for action in actions]
+        return len(actions), []
+
+@pytest.fixture
+def flusher(app, redis, monkeypatch):
+    app.config.update(INDEXER_RETRIES=2, INDEXER_RETRY_DELAY=0, INDEXER_RETRY_MAX_DELAY=0)
+    monkeypatch.setattr(indexer, 'es', FakeES())
+    indexer.save_checkpoint(Timestamp(100, 1))
+    return app
+
+ACTIONS = [{'_op_type': 'index', '_index': 'common', '_type': 'search', '_id': '1', '_source': {}}]
+
+def test_flush_failure_keeps_checkpoint(flusher, monkeypatch):
+    fake = FakeBulk(failures=10)
+    monkeypatch.setattr(indexer, 'bulk', fake)
+    with pytest.raises(BulkError):
+        indexer._flush(ACTIONS, Timestamp(200, 1), indexer.Throughput('sync'))
+    assert fake.calls == 3
+    assert indexer.load_checkpoint() == Timestamp(100, 1)
+
+def test_flush_retries_same_batch(flusher, monkeypatch):
+    fake = FakeBulk(failures=2)
+    monkeypatch.setattr(indexer, 'bulk', fake)
+    indexer._flush(ACTIONS, Timestamp(200, 1), indexer.Throughput('sync'))
+    assert fake.calls == 3
+    assert indexer.load_checkpoint() == Timestamp(200, 1)
+
+def test_flush_ignores_missing_deletes(flusher, monkeypatch):
+    monkeypatch.setattr(indexer, 'bulk', lambda client, actions, **kwargs: (0, [{'delete': {'_id': '1', 'status': 404}}]))
+    indexer._flush([{'_op_type': 'delete', '_id': '1'}], Timestamp(200, 1), indexer.Throughput('sync'))
+    assert indexer.load_checkpoint() == Timestamp(200, 1)
@@ -0,0 +1,137 @@
+# coding=utf-8
+
+import copy
+import pytest
+from bson.timestamp import Timestamp
+from app import indices, indexer
+
+MAPPINGS = {'search': {'properties': {
+    'channel': {'type': 'keyword'}, 'title': {'type': 'text'}, 'category': {'type': 'keyword'}}}}
+SETTINGS = {'index': {'number_of_shards': '3', 'number_of_replicas': '1', 'analysis': {'analyzer': {'ik': {}}}}}
+
+class FakeIndices(object):
+    def __init__(self, log, existing, aliases):
+        self.log = log
+        self.existing = existing
+        self.aliases = aliases
+
+    def exists_alias(self, name):
+        return name in self.aliases
+
+    def get_alias(self, name):
+        return dict((index, {}) for index in self.aliases[name])
+
+    def exists(self, index):
+        return index in self.existing
+
+    def get(self, index):
+        if index.endswith('*'):
+            return dict((name, {}) for name in self.existing if name.startswith(index[:-1]))
+        return {index: {'mappings': copy.deepcopy(MAPPINGS), 'settings': copy.deepcopy(SETTINGS)}}
+
+    def create(self, index, body):
+        self.log.append(('create', index))
+        self.existing.append(index)
+
+    def put_settings(self, index, body):
+        pass
+
+    def refresh(self, index):
+        pass
+
+    def delete(self, index):
+        self.log.append(('delete', index))
+        self.existing.remove(index)
+
+    def update_aliases(self, body):
+        self.log.append(('update_aliases', body['actions']))
+
+class FakeClient(object):
+    def __init__(self, existing=(), aliases=None, major=5):
+        self.log = []
+        self.major = major
+        self.indices = FakeIndices(self.log, list(existing), aliases or {})
+        self.tasks = self
+        self.cluster = self
+
+    def info(self):
+        return {'version': {'number': '{0}.6.0'.format(self.major)}}
+
+    def reindex(self, body, **kwargs):
+        self.log.append(('reindex', body['source']['index'], body['dest']['index']))
+        return {'task': 'node:1'}
+
+    def get(self, task_id):
+        return {'completed': True, 'task': {'status': {}}, 'response': {}}
+
+    def health(self, **kwargs):
+        pass
+
+class FakeES(object):
+    def __init__(self, client):
+        self.client = client
+
+@pytest.fixture
+def client(app, monkeypatch):
+    app.config.update(INDEXER_NAMESPACES={'common.search': ('common', 'search'), 'gdszx.culture': ('gdszx', 'culture')})
+    client = FakeClient(existing=['common_20180101000000', 'common_20180201000000', 'common_backup', 'common'],
+        aliases={'common': ['common_20180201000000']})
+    monkeypatch.setattr(indices, 'es', FakeES(client))
+    monkeypatch.setattr(indices, 'warm', lambda name, index: 0)
+    monkeypatch.setattr(indices, '_oplog_position', lambda: Timestamp(100, 1))
+    return client
+
+@pytest.fixture
+def replays(client, monkeypatch):
+    calls = []
+    def replay(since, names, index):
+        client.log.append(('replay', since, index))
+        calls.append(names)
+        return Timestamp(since.time + 100, 1)
+    monkeypatch.setattr(indexer, 'replay', replay)
+    return calls
+
+def test_index_body_tunes_mapping(client):
+    body = indices.index_body('common', 'common_20180201000000')
+    properties = body['mappings']['search']['properties']
+    assert properties['channel']['eager_global_ordinals'] is True
+    assert properties['category']['eager_global_ordinals'] is True
+    assert 'eager_global_ordinals' not in properties['title']
+    assert body['settings']['index'] == {'number_of_shards': '3', 'number_of_replicas': 0, 'refresh_interval': '-1',
+        'analysis': {'analyzer': {'ik': {}}}}
+
+def test_index_body_sort_needs_es6(client):
+    assert 'sort.field' not in indices.index_body('common', None)['settings']['index']
+    client.major = 6
+    index = indices.index_body('common', None)['settings']['index']
+    assert index['sort.field'] == ['pdate'] and index['sort.order'] == ['desc']
+    assert index['number_of_shards'] == 5
+
+def test_replay_selects_namespaces(client, replays):
+    assert indices._replay(Timestamp(1, 1), 'common', 'common', 'common_new') == Timestamp(101, 1)
+    assert replays == [['common.search']]
+    assert indices._replay(Timestamp(1, 1), 'related', 'related', 'related_new') == Timestamp(1, 1)
+    assert len(replays) == 1
+
+def test_rebuild_replays_after_alias_swap(client, replays):
+    new = indices.rebuild('common', keep=1)
+    steps = [step[0] for step in client.log]
+    assert steps[:3] == ['create', 'reindex', 'replay']
+    assert steps[3:5] == ['update_aliases', 'replay']
+    first, second = [step for step in client.log if step[0] == 'replay']
+    # 切换后的补写从上一次返回的位置开始
+    assert first[1] == Timestamp(100, 1) and second[1] == Timestamp(200, 1)
+    assert second[2] == new
+    assert client.log[3][1] == [{'remove': {'index': 'common_20180201000000', 'alias': 'common'}}, {'add': {'index': new, 'alias': 'common'}}]
+
+def test_rebuild_deletes_only_old_versions(client, replays):
+    new = indices.rebuild('common', keep=1)
+    deleted = [step[1] for step in client.log if step[0] == 'delete']
+    assert deleted == ['common_20180101000000']
+    assert 'common_backup' in client.indices.existing
+    assert new in client.indices.existing
+
+def test_is_version():
+    assert indices.is_version('common', 'common_20180101000000')
+    assert not indices.is_version('common', 'common_backup')
+    assert not indices.is_version('common', 'common_20180101000000_old')
@@ -0,0 +1,50 @@
+# coding=utf-8
+
+from app.api_v1.limiter import TokenBucketLimiter, SlidingWindowLimiter, token_key, ALLOWED, BLOCKED, IP_LIMITED, APPKEY_LIMITED
+from app.api_v1.decorator import valid_appkey
+
+def setup_limits(app, ip_limit=100):
+    app.config.update(RATELIMIT_PERIOD=60, RATELIMIT_IP_LIMIT=ip_limit, RATELIMIT_BLOCK_TIME=300, API_TOKEN_FORMAT='opaque')
+
+def test_ip_limit_blocks(app, redis):
+    setup_limits(app, ip_limit=2)
+    limiter = SlidingWindowLimiter()
+    assert limiter.hit('1.2.3.4')[0] == ALLOWED
+    assert limiter.hit('1.2.3.4')[0] == ALLOWED
+    assert limiter.hit('1.2.3.4')[0] == IP_LIMITED
+    assert redis.exists('ratelimit:block:1.2.3.4')
+    assert limiter.hit('1.2.3.4')[0] == BLOCKED
+
+def test_appkey_quota_needs_valid_token(app, redis):
+    setup_limits(app)
+    redis.set(token_key('partner'), 'secret-token')
+    limiter = TokenBucketLimiter()
+    # 只知道appkey的人不消耗限额
+    for i in range(5):
+        assert limiter.hit('5.6.7.8', 'partner', 2, 'guess') == (ALLOWED, 'secret-token')
+    assert limiter.hit('1.2.3.4', 'partner', 2, 'secret-token')[0] == ALLOWED
+    assert limiter.hit('1.2.3.4', 'partner', 2, 'secret-token')[0] == ALLOWED
+    assert limiter.hit('1.2.3.4', 'partner', 2, 'secret-token')[0] == APPKEY_LIMITED
+
+def test_appkey_quota_for_verified_signed_token(app, redis):
+    setup_limits(app)
+    app.config['API_TOKEN_FORMAT'] = 'signed'
+    limiter = TokenBucketLimiter()
+    assert limiter.hit('1.2.3.4', 'partner', 1, 'v1.x', verified=False) == (ALLOWED, None)
+    assert limiter.hit('1.2.3.4', 'partner', 1, 'v1.x', verified=True)[0] == ALLOWED
+    assert limiter.hit('1.2.3.4', 'partner', 1, 'v1.x', verified=True)[0] == APPKEY_LIMITED
+
+def test_keys_are_namespaced(app, redis):
+    setup_limits(app)
+    redis.zadd('search:slowsql', 1, 'digest')
+    redis.hset('ratelimit:ip:x', 't', 1)
+    limiter = TokenBucketLimiter()
+    assert limiter.hit('search:slowsql', 'ratelimit:ip:x', 1, 'token')[0] == ALLOWED
+
+def test_valid_appkey():
+    assert valid_appkey('benchappkey')
+    assert valid_appkey('app-key_1.2')
+    assert not valid_appkey('ratelimit:ip:x')
+    assert not valid_appkey('a' * 33)
+    assert not valid_appkey('')
+    assert not valid_appkey(12)
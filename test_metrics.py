@@ -0,0 +1,74 @@
+# coding=utf-8
+
+import os
+import json
+from time import time
+from flask import g
+from app import metrics
+from app.metrics import Registry, Histogram, allowed, render
+
+def test_metrics_denied_by_default(app):
+    with app.test_request_context('/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+        assert not allowed()
+
+def test_metrics_token(app):
+    app.config['METRICS_TOKEN'] = 'secret'
+    with app.test_request_context('/metrics', headers={'Authorization': 'Bearer secret'}):
+        assert allowed()
+    with app.test_request_context('/metrics', headers={'Authorization': 'Bearer wrong'}):
+        assert not allowed()
+
+def test_metrics_ip_allowlist(app):
+    app.config['METRICS_ALLOWED_IPS'] = ['10.0.0.5']
+    with app.test_request_context('/metrics', environ_base={'REMOTE_ADDR': '10.0.0.5'}):
+        assert allowed()
+
+def test_only_authenticated_appkeys_labelled(app, monkeypatch):
+    registry = Registry()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    with app.test_request_context('/api/v1/search'):
+        metrics.before_request()
+        g.token_appkey = 'random-appkey'
+        metrics.after_request(None)
+    with app.test_request_context('/api/v1/search'):
+        metrics.before_request()
+        g.auth_appkey = 'partner'
+        metrics.after_request(None)
+    assert list(registry.appkeys) == ['partner']
+
+def test_render_histogram():
+    histogram = Histogram()
+    histogram.observe(0.003)
+    histogram.observe(20)
+    text = render({'search': histogram}, {}, {'partner': [2, 0.5]})
+    assert 'search_request_duration_seconds_bucket{endpoint="search",le="0.005"} 1' in text
+    assert 'search_request_duration_seconds_count{endpoint="search"} 2' in text
+    assert 'search_appkey_requests_total{appkey="partner"} 2' in text
+
+def test_history_counters_exported(tmpdir, monkeypatch):
+    from app.history import history
+    monkeypatch.setattr(history, 'dropped', 4)
+    Registry().dump(str(tmpdir))
+    text = render(*metrics.collect(str(tmpdir)))
+    assert 'search_history_records_total{state="dropped"} 4' in text
+    assert 'search_history_buffered 0' in text
+
+def test_stale_gauges_skipped(tmpdir, monkeypatch):
+    from app.history import history
+    monkeypatch.setattr(history, 'dropped', 4)
+    monkeypatch.setattr(history, '_buffer', [None] * 3)
+    Registry().dump(str(tmpdir))
+    current = tmpdir.join('worker-{0}.json'.format(os.getpid()))
+    data = json.loads(current.read())
+    # 已退出的worker留下的文件
+    stale = tmpdir.join('worker-999999999.json')
+    stale.write(json.dumps(dict(data, pid=999999999)))
+    text = render(*metrics.collect(str(tmpdir), max_age=60))
+    assert 'search_history_records_total{state="dropped"} 8' in text
+    assert 'search_history_buffered 3' in text
+    # 仍在运行但很久没有写文件的worker
+    old = time() - 600
+    os.utime(str(current), (old, old))
+    text = render(*metrics.collect(str(tmpdir), max_age=60))
+    assert 'search_history_records_total{state="dropped"} 8' in text
+    assert 'search_history_buffered' not in text
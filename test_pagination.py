@@ -0,0 +1,97 @@
+# coding=utf-8
+
+import pytest
+from itsdangerous import TimestampSigner
+from app.api_v1 import pagination
+from app.api_v1.pagination import fingerprint, encode_cursor, decode_cursor, cacheable, paginate, keepalive_seconds
+from app.exceptions import InvalidCursor
+
+PARAMS = {'keyword': '政协', 'page': 1, 'size': 2, 'cursor': '*', 'snapshot': False}
+
+class FakeES(object):
+    def __init__(self, pages):
+        self.pages = list(pages)
+        self.calls = []
+
+    def search(self, **kwargs):
+        self.calls.append(('search', kwargs))
+        return self.pages.pop(0)
+
+    def scroll(self, **kwargs):
+        self.calls.append(('scroll', kwargs))
+        return self.pages.pop(0)
+
+    def clear_scroll(self, **kwargs):
+        self.calls.append(('clear_scroll', kwargs))
+
+def page(*sorts, **extra):
+    response = {'hits': {'hits': [{'_id': str(s), 'sort': [s]} for s in sorts]}}
+    response.update(extra)
+    return response
+
+def test_fingerprint_ignores_paging(app):
+    other = dict(PARAMS, page=3, cursor='abc', snapshot=True)
+    assert fingerprint('example.com', PARAMS) == fingerprint('example.com', other)
+    assert fingerprint('example.com', PARAMS) != fingerprint('example.com', dict(PARAMS, keyword='文史'))
+    assert fingerprint('example.com', PARAMS) != fingerprint('other.com', PARAMS)
+
+def test_cursor_round_trip(app):
+    cursor = encode_cursor({'f': 'abc', 'after': [1, 'x']})
+    assert decode_cursor(cursor, 'abc') == {'f': 'abc', 'after': [1, 'x']}
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, 'other')
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor[:-2], 'abc')
+
+def test_cursor_expires_with_keepalive(app, monkeypatch):
+    app.config['SEARCH_SCROLL_KEEPALIVE'] = '2m'
+    now = TimestampSigner.get_timestamp
+    cursor = encode_cursor({'f': 'abc', 'after': [1]})
+    monkeypatch.setattr(TimestampSigner, 'get_timestamp', lambda self: now(self) + 100)
+    assert decode_cursor(cursor, 'abc') == {'f': 'abc', 'after': [1]}
+    monkeypatch.setattr(TimestampSigner, 'get_timestamp', lambda self: now(self) + 121)
+    with pytest.raises(InvalidCursor) as e:
+        decode_cursor(cursor, 'abc')
+    assert str(e.value) == 'cursor 已过期'
+    assert not cacheable(dict(PARAMS, cursor=cursor))
+
+def test_keepalive_seconds():
+    assert keepalive_seconds('2m') == 120
+    assert keepalive_seconds('30s') == 30
+    assert keepalive_seconds('1h') == 3600
+    assert keepalive_seconds('500ms') == 0.5
+    with pytest.raises(ValueError):
+        keepalive_seconds('soon')
+
+def test_cacheable(app):
+    assert cacheable(dict(PARAMS, cursor=None))
+    assert cacheable(PARAMS)
+    assert not cacheable(dict(PARAMS, snapshot=True))
+    assert not cacheable(dict(PARAMS, cursor=encode_cursor({'f': 'abc', 'after': [1]})))
+    # 不带snapshot参数的scroll游标同样不能缓存
+    assert not cacheable(dict(PARAMS, cursor=encode_cursor({'f': 'abc', 'scroll': 'id'})))
+    assert not cacheable(dict(PARAMS, cursor='garbage'))
+
+def test_paginate_search_after(app, monkeypatch):
+    fake = FakeES([page(1, 2), page(3)])
+    monkeypatch.setattr(pagination, 'es', fake)
+    body = {'query': {'match_all': {}}, 'sort': [{'date': 'desc'}], 'size': 2, 'from': 0}
+    response, cursor = paginate('common', 'search', body, 'abc', '*')
+    assert 'from' not in fake.calls[0][1]['body']
+    assert fake.calls[0][1]['body']['sort'][-1] == {'_uid': 'asc'}
+    assert decode_cursor(cursor, 'abc') == {'f': 'abc', 'after': [2]}
+    response, cursor = paginate('common', 'search', body, 'abc', cursor)
+    assert fake.calls[1][1]['body']['search_after'] == [2]
+    assert cursor is None
+
+def test_paginate_scroll(app, monkeypatch):
+    fake = FakeES([page(1, 2, _scroll_id='s1'), page(3, _scroll_id='s1')])
+    monkeypatch.setattr(pagination, 'es', fake)
+    body = {'query': {'match_all': {}}, 'sort': [{'date': 'desc'}], 'size': 2}
+    response, cursor = paginate('common', 'search', body, 'abc', '*', snapshot=True)
+    assert '_scroll_id' not in response
+    assert decode_cursor(cursor, 'abc')['scroll'] == 's1'
+    response, cursor = paginate('common', 'search', body, 'abc', cursor)
+    assert fake.calls[1][0] == 'scroll'
+    assert fake.calls[2] == ('clear_scroll', {'scroll_id': 's1'})
+    assert cursor is None
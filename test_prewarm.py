@@ -0,0 +1,46 @@
+# coding=utf-8
+
+import pytest
+from app import prewarm
+from app.sensitive import Automaton, sensitive_filter
+
+class FakeQuery(object):
+    def all(self):
+        return [FakeWebsite(1, 'a.gov.cn'), FakeWebsite(2, 'b.gov.cn')]
+
+class FakeWebsite(object):
+    query = FakeQuery()
+
+    def __init__(self, id, domain):
+        self.id = id
+        self.domain = domain
+
+@pytest.fixture
+def websites(app, monkeypatch):
+    app.config['PREWARM_PAGES'] = 1
+    monkeypatch.setattr(prewarm, 'Website', FakeWebsite)
+    monkeypatch.setattr(prewarm, 'hot_keywords', lambda website_id: ['台风', '高考'])
+    monkeypatch.setattr(sensitive_filter, '_automata', {2: Automaton(['高考'])})
+    return app
+
+def test_gdszx_jobs_deduped_by_cache_key(websites):
+    jobs = prewarm.prewarm_jobs()
+    assert len([job for job in jobs if job[0] == 'search']) == 4
+    gdszx = [(params['keyword'], [site.website_id for site in sites]) for kind, sites, params in jobs if kind == 'gdszx']
+    # 网站2的敏感词替换后是另一个查询
+    assert gdszx == [('台风', [1, 2]), ('高考', [1]), ('**', [2])]
+
+def test_gdszx_job_runs_once_per_query(websites, monkeypatch):
+    from app.api_v1 import views, cache
+    calls = []
+    stored = {}
+    def search(params):
+        calls.append(params['keyword'])
+        return {'success': 1, 'data': {'hits': {'hits': [{'highlight': {'title': ['<em>台风</em>高考']}}]}}}
+    monkeypatch.setattr(views, 'gdszx_search', search)
+    monkeypatch.setattr(cache.gdszx_cache, 'set', lambda website_id, params, value, ttl=None: stored.__setitem__(website_id, value))
+    job = [job for job in prewarm.prewarm_jobs() if job[0] == 'gdszx'][0]
+    assert prewarm.prewarm_one(websites, job) == 2
+    assert calls == ['台风']
+    assert stored[1]['data']['hits']['hits'][0]['highlight']['title'] == ['<em>台风</em>高考']
+    assert stored[2]['data']['hits']['hits'][0]['highlight']['title'] == ['<em>台风</em>**']
@@ -0,0 +1,28 @@
+# coding=utf-8
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from app.profiler import Profiler, normalize
+
+@pytest.fixture
+def engine():
+    profiler = Profiler()
+    profiler.enabled = True
+    profiler.threshold = 60
+    engine = create_engine('sqlite://')
+    event.listen(engine, 'before_cursor_execute', profiler.before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', profiler.after_cursor_execute)
+    event.listen(engine, 'handle_error', profiler.handle_error)
+    return engine
+
+def test_failed_statement_pops_start_time(engine):
+    with engine.connect() as conn:
+        conn.execute('select 1')
+        assert conn.info['profiler_started'] == []
+        with pytest.raises(OperationalError):
+            conn.execute('select * from missing')
+        assert conn.info['profiler_started'] == []
+
+def test_normalize():
+    assert normalize("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'a''b'") == 'SELECT * FROM t WHERE id IN (?) AND name = ?'
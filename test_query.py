@@ -0,0 +1,45 @@
+# coding=utf-8
+
+import os
+import sys
+import pytest
+from app.api_v1.query import compile_common, compile_gdszx, compile_gdszx_facets, compile_suggest
+from app.api_v1.views import common_params, gdszx_params
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+
+from bench_query import DOMAIN, COMMON_CASES, GDSZX_CASES, dsl_common, dsl_gdszx, canonical
+
+@pytest.mark.parametrize('args', COMMON_CASES)
+def test_compile_common_matches_dsl(args):
+    params = common_params(args)
+    assert canonical(compile_common(DOMAIN, params)) == canonical(dsl_common(DOMAIN, params))
+
+@pytest.mark.parametrize('args', GDSZX_CASES)
+def test_compile_gdszx_matches_dsl(args):
+    params = gdszx_params(args)
+    assert canonical(compile_gdszx(params)) == canonical(dsl_gdszx(params))
+
+@pytest.mark.parametrize('args', GDSZX_CASES)
+def test_gdszx_split_bodies(args):
+    # 结果列表和聚合分开查询时, 两部分合起来与原请求体一致
+    params = gdszx_params(args)
+    expected = dsl_gdszx(params)
+    aggs = expected.pop('aggs')
+    assert canonical(compile_gdszx(params, aggs=False)) == canonical(expected)
+    facets = compile_gdszx_facets(params)
+    assert canonical(facets) == canonical({'query': expected['query'], 'aggs': aggs, 'size': 0})
+
+def test_compile_does_not_share_clauses():
+    params = common_params(COMMON_CASES[2])
+    first = compile_common(DOMAIN, params)
+    first['query']['bool']['filter'].append({'term': {'x': 1}})
+    assert canonical(compile_common(DOMAIN, params)) == canonical(dsl_common(DOMAIN, params))
+
+def test_compile_suggest_prefix():
+    # es兜底与前缀索引一样按标题前缀匹配, 字段与索引结果一致
+    body = compile_suggest(DOMAIN, '广东省', 10)
+    assert body['query']['bool']['must'] == [{'match_phrase_prefix': {'title': {'query': '广东省', 'max_expansions': 50}}}]
+    assert body['query']['bool']['filter'] == [{'term': {'website': DOMAIN}}]
+    assert body['_source'] == ['title', 'website']
+    assert body['size'] == 10
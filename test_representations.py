@@ -0,0 +1,27 @@
+# coding=utf-8
+
+import json
+import pytest
+from app.api_v1 import representations
+
+pytest.importorskip('ujson')
+
+def body(response):
+    return json.loads(response.get_data(as_text=True))
+
+def test_output_json_uses_ujson(app):
+    data = {'success': True, 'data': {'title': '中文', 'total': 3, 'score': 1.5, 'pic': None}}
+    response = representations.output_json(data, 200, {'X-Test': '1'})
+    assert response.status_code == 200
+    assert response.headers['X-Test'] == '1'
+    assert '中文' in response.get_data(as_text=True)
+    assert body(response) == data
+
+def unsupported(*args, **kwargs):
+    raise TypeError('unsupported')
+
+def test_output_json_falls_back(app, monkeypatch):
+    # ujson不认识的类型交给flask_restful处理
+    monkeypatch.setattr(representations, 'ujson', type('ujson', (), {'dumps': staticmethod(unsupported)}))
+    response = representations.output_json({'total': 3}, 200)
+    assert body(response) == {'total': 3}
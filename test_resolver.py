@@ -0,0 +1,61 @@
+# coding=utf-8
+
+import pytest
+from app.api_v1 import resolver as resolver_module
+from app.api_v1.resolver import AppkeyResolver, Site
+from app.models import Website, Token
+
+@pytest.fixture
+def sites(database):
+    database.session.add_all([Website(id=1, name='一', domain='a.gov.cn'), Website(id=2, name='二', domain='b.gov.cn')])
+    database.session.add_all([
+        Token(id=1, info='a', appkey='key-a', appsecret='s', frequent=0, website_id=1),
+        Token(id=2, info='b', appkey='key-b', appsecret='s', frequent=1, website_id=2),
+    ])
+    database.session.commit()
+    return database
+
+def test_load(sites):
+    resolver = AppkeyResolver()
+    resolver.load()
+    assert resolver.loaded
+    assert resolver.lookup('key-a') == Site(1, 'a.gov.cn', 0)
+    assert resolver.lookup('key-b') == Site(2, 'b.gov.cn', 1)
+    assert resolver.lookup('key-c') is None
+
+def test_notify_refreshes_token(sites):
+    resolver = AppkeyResolver()
+    resolver.load()
+    token = Token.query.get(1)
+    token.appkey = 'key-a2'
+    token.frequent = 1
+    sites.session.commit()
+    resolver.on_notify({'kind': 'token', 'id': 1})
+    assert resolver.lookup('key-a') is None
+    assert resolver.lookup('key-a2') == Site(1, 'a.gov.cn', 1)
+    sites.session.delete(Token.query.get(2))
+    sites.session.commit()
+    resolver.on_notify({'kind': 'token', 'id': 2})
+    assert resolver.lookup('key-b') is None
+
+def test_notify_refreshes_website(sites):
+    resolver = AppkeyResolver()
+    resolver.load()
+    Website.query.get(2).domain = 'c.gov.cn'
+    sites.session.commit()
+    resolver.on_notify({'kind': 'website', 'id': 2})
+    assert resolver.lookup('key-b') == Site(2, 'c.gov.cn', 1)
+
+def test_snapshot_missing_falls_back_to_database(app, sites, monkeypatch):
+    app.config['SNAPSHOT_ENABLED'] = True
+    monkeypatch.setattr(resolver_module.snapshot, 'current', lambda: None)
+    resolver = AppkeyResolver()
+    # 没有退回之前忽略通知
+    resolver.on_notify({'kind': 'token', 'id': 1})
+    assert resolver._sites == {}
+    assert resolver.lookup('key-a') == Site(1, 'a.gov.cn', 0)
+    assert resolver.loaded
+    Token.query.get(1).frequent = 2
+    sites.session.commit()
+    resolver.on_notify({'kind': 'token', 'id': 1})
+    assert resolver.lookup('key-a') == Site(1, 'a.gov.cn', 2)
@@ -0,0 +1,49 @@
+# coding=utf-8
+
+import random
+from app.sensitive import Automaton
+
+def covered(words, text):
+    """
+    逐个位置暴力匹配, 返回被任一敏感词覆盖的位置
+    """
+    positions = set()
+    for word in words:
+        start = text.find(word)
+        while start != -1:
+            positions.update(range(start, start + len(word)))
+            start = text.find(word, start + 1)
+    return positions
+
+def mask(text, positions):
+    return ''.join('*' if i in positions else ch for i, ch in enumerate(text))
+
+def test_search_and_spans():
+    automaton = Automaton(['he', 'she', 'his', 'hers'])
+    assert automaton.search('ahishers') == (1, 4)
+    # 每个结束位置只报告最长的词
+    assert list(automaton.finditer('ushers')) == [(1, 4), (2, 6)]
+    assert automaton.search('abc') is None
+    assert Automaton([]).search('abc') is None
+
+def test_replace_modes():
+    automaton = Automaton(['法轮', '轮功'])
+    assert automaton.replace('练法轮功的人') == '练***的人'
+    assert automaton.replace('练法轮功的人', '') == '练的人'
+    assert automaton.replace('a法轮b轮功c', '[x]') == 'a[x]b[x]c'
+    assert automaton.replace('没有敏感词') == '没有敏感词'
+
+def test_suffix_words_found_through_fail_links():
+    automaton = Automaton(['abcd', 'bc'])
+    assert list(automaton.finditer('abce')) == [(1, 3)]
+    assert automaton.replace('xabcdx') == 'x****x'
+
+def test_replace_matches_brute_force():
+    rng = random.Random(20181018)
+    for _ in range(300):
+        words = [''.join(rng.choice('abc') for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 5))]
+        text = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 30)))
+        positions = covered(words, text)
+        automaton = Automaton(words)
+        assert automaton.replace(text) == mask(text, positions), (words, text)
+        assert (automaton.search(text) is None) == (not positions), (words, text)
@@ -0,0 +1,89 @@
+# coding=utf-8
+
+import threading
+import pytest
+from time import sleep
+from app.api_v1.singleflight import SingleFlight
+
+def run_concurrently(app, func, n):
+    results = []
+    errors = []
+
+    def worker():
+        with app.app_context():
+            try:
+                results.append(func())
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+def test_local_callers_share_one_execution(app, redis):
+    flight = SingleFlight('test')
+    calls = []
+
+    def query():
+        calls.append(1)
+        sleep(0.2)
+        return {'success': 1}
+
+    results, errors = run_concurrently(app, lambda: flight.do('key', query), 10)
+    assert len(calls) == 1
+    assert results == [{'success': 1}] * 10
+    assert flight.counters['leaders'] == 1
+    assert flight.counters['local_followers'] == 9
+    assert flight.stats()['in_flight'] == 0
+    # 执行者发布结果后释放锁
+    assert not redis.exists('search:flight:test:key')
+    assert redis.get('search:flight:test:key:result') == b'{"success":1}'
+
+def test_errors_reach_followers(app, redis):
+    flight = SingleFlight('test')
+
+    def query():
+        sleep(0.2)
+        raise ValueError('bad query')
+
+    results, errors = run_concurrently(app, lambda: flight.do('key', query), 5)
+    assert results == []
+    assert len(errors) == 5 and all(isinstance(e, ValueError) for e in errors)
+    assert not redis.exists('search:flight:test:key:result')
+
+def test_remote_follower_reads_published_result(app, redis):
+    flight = SingleFlight('test')
+    redis.set('search:flight:test:key', 'other-worker')
+
+    def publish():
+        sleep(0.1)
+        redis.setex('search:flight:test:key:result', 5, '{"success":1,"from":"leader"}')
+
+    threading.Thread(target=publish).start()
+    assert flight.do('key', lambda: pytest.fail('should not query es')) == {'success': 1, 'from': 'leader'}
+    assert flight.counters['remote_followers'] == 1
+
+def test_remote_follower_falls_back_when_leader_gives_up(app, redis):
+    flight = SingleFlight('test')
+    redis.set('search:flight:test:key', 'other-worker')
+
+    def give_up():
+        sleep(0.1)
+        redis.delete('search:flight:test:key')
+
+    threading.Thread(target=give_up).start()
+    assert flight.do('key', lambda: {'success': 1}) == {'success': 1}
+    assert flight.counters['fallbacks'] == 1
+
+def test_redis_errors_fail_open(app, broken_redis):
+    flight = SingleFlight('test')
+    assert flight.do('key', lambda: {'success': 1}) == {'success': 1}
+
+def test_disabled(app):
+    app.config['SINGLEFLIGHT_ENABLED'] = False
+    flight = SingleFlight('test')
+    assert flight.do('key', lambda: 42) == 42
+    assert flight.counters['leaders'] == 0
@@ -0,0 +1,107 @@
+# coding=utf-8
+
+import json
+import random
+from app import notify, snapshot as snapshot_module
+from app.snapshot import serialize, Snapshot, SnapshotStore, TOPIC
+from app.sensitive import Automaton, automaton_tables, sensitive_filter
+from app.suggest import PrefixIndex, suggest_tables, suggester, _key
+
+WEBSITES = (('id', 'i'), ('domain', 's'), ('name', 's'))
+WORDS = (('website_id', 'i'), ('keyword', 's'))
+TOKENS = (('appkey', 's'), ('id', 'i'), ('website_id', 'i'), ('frequent', 'i'))
+
+def write(tmpdir, tables):
+    path = tmpdir.join('lookup.snap')
+    path.write_binary(serialize(tables, 42))
+    return Snapshot(str(path))
+
+def test_snapshot_roundtrip(tmpdir):
+    snapshot = write(tmpdir, [
+        ('websites', WEBSITES, [(1, 'a.gov.cn', '网站一'), (2, 'b.gov.cn', None)]),
+        ('tokens', TOKENS, [('k1', 10, 1, 0), ('k2', 11, 2, 1)]),
+    ])
+    assert snapshot.generation == 42
+    assert snapshot.website(1) == {'id': 1, 'domain': 'a.gov.cn', 'name': '网站一'}
+    assert snapshot.website(2)['name'] == ''
+    assert snapshot.website(3) is None
+    assert snapshot.token('k2') == {'appkey': 'k2', 'id': 11, 'website_id': 2, 'frequent': 1}
+    assert snapshot.token('k0') is None
+    assert snapshot.token('k3') is None
+
+def test_snapshot_empty_tables(tmpdir):
+    snapshot = write(tmpdir, [('websites', WEBSITES, []), ('tokens', TOKENS, [])])
+    assert len(snapshot['tokens']) == 0
+    assert snapshot.token('k1') is None
+
+def test_snapshot_words(tmpdir):
+    snapshot = write(tmpdir, [('hotwords', WORDS, [(1, '台风'), (1, '高考'), (3, '地铁')])])
+    assert snapshot.words('hotwords', 1) == ['台风', '高考']
+    assert snapshot.words('hotwords', 2) == []
+    assert snapshot.words('hotwords', 3) == ['地铁']
+
+def test_mapped_automaton_matches_automaton(tmpdir):
+    rng = random.Random(20181018)
+    rows = sorted((website_id, ''.join(rng.choice('abc') for _ in range(rng.randint(1, 4))))
+        for website_id in (1, 2, 5) for _ in range(rng.randint(1, 6)))
+    snapshot = write(tmpdir, automaton_tables(rows))
+    assert snapshot.automaton(3) is None
+    for website_id in (1, 2, 5):
+        automaton = Automaton([keyword for id, keyword in rows if id == website_id])
+        mapped = snapshot.automaton(website_id)
+        for _ in range(100):
+            text = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 20)))
+            assert list(mapped.finditer(text)) == list(automaton.finditer(text)), (website_id, text)
+            assert mapped.replace(text, '') == automaton.replace(text, '')
+
+def test_mapped_automaton_unicode(tmpdir):
+    snapshot = write(tmpdir, automaton_tables([(1, '法轮'), (1, '轮功'), (2, '😀')]))
+    assert snapshot.automaton(1).replace('练法轮功的人') == '练***的人'
+    assert snapshot.automaton(2).replace('a😀b') == 'a*b'
+
+ITEMS = [['广州地铁', 50], ['广州 天气', 80], ['广州天河', 20], ['广东高考', 90], ['Guangzhou  Tower', 5], ['guangzhou tower', 7]]
+
+def test_mapped_prefix_index_matches_prefix_index(app, redis, tmpdir):
+    redis.set(_key(1), json.dumps(ITEMS))
+    redis.set(_key(2), json.dumps([['深圳', 3]]))
+    snapshot = write(tmpdir, suggest_tables([1, 2, 3]))
+    index = PrefixIndex(ITEMS, app.config['SUGGEST_SIZE'], app.config['SUGGEST_PRECOMPUTE'])
+    mapped = snapshot.suggester(1)
+    assert len(mapped) == len(index)
+    for prefix in ('广', '广州', '广州地', 'G', 'guangzhou t', '深', ''):
+        for size in (2, 10):
+            assert mapped.lookup(prefix, size) == index.lookup(prefix, size), (prefix, size)
+    assert snapshot.suggester(2).lookup('深') == [('深圳', 3)]
+    assert snapshot.suggester(3) is None
+
+def test_filters_read_snapshot(app, monkeypatch, tmpdir):
+    snapshot = write(tmpdir, automaton_tables([(1, '敏感')]) + [
+        ('suggest', (('website_id', 'i'), ('key', 's'), ('text', 's'), ('weight', 'i')), [(1, 'abc', 'abc', 3)]),
+        ('suggest_top', (('website_id', 'i'), ('prefix', 's'), ('items', 's')), [])])
+    app.config['SNAPSHOT_ENABLED'] = True
+    monkeypatch.setattr(snapshot_module.snapshot, 'current', lambda: snapshot)
+    monkeypatch.setattr(sensitive_filter, '_automata', {})
+    monkeypatch.setattr(suggester, '_indexes', {})
+    assert sensitive_filter.clean(1, '有敏感词') == '有**词'
+    assert sensitive_filter.contains(2, '有敏感词') is False
+    assert suggester.lookup(1, 'ab') == [('abc', 3)]
+    assert not sensitive_filter.loaded and not suggester.loaded
+
+def test_publish_notifies_after_rename(app, monkeypatch, tmpdir):
+    store = SnapshotStore()
+    store.path = str(tmpdir.join('lookup.snap'))
+    store.interval = 60
+    generations = iter([1, 2])
+    monkeypatch.setattr(store, 'build', lambda: serialize([('websites', WEBSITES, [])], next(generations)))
+    seen = []
+    def publish(topic, payload):
+        # 收到通知时文件已经是新版本
+        seen.append((topic, payload, Snapshot(store.path).generation))
+        store.on_notify(payload)
+    monkeypatch.setattr(notify, 'publish', publish)
+    store.publish()
+    assert store.current().generation == 1
+    store.publish()
+    assert seen == [(TOPIC, {'generation': 1}, 1), (TOPIC, {'generation': 2}, 2)]
+    # 检查间隔未到, 通知后也已切换
+    assert store.current().generation == 2
@@ -0,0 +1,40 @@
+# coding=utf-8
+
+from app.suggest import PrefixIndex, normalize
+
+ITEMS = [
+    ('广州地铁', 50), ('广州 天气', 80), ('广州天河', 20), ('广东高考', 90),
+    ('深圳地铁', 40), ('Guangzhou  Tower', 5), ('guangzhou tower', 7), ('广州😀', 1),
+]
+
+def brute(items, prefix, size):
+    merged = {}
+    for text, weight in items:
+        key = normalize(text)
+        if key.startswith(normalize(prefix)):
+            merged[key] = merged.get(key, 0) + weight
+    return sorted(merged.values(), reverse=True)[:size]
+
+def test_normalize():
+    assert normalize('  Guangzhou \t Tower ') == 'guangzhou tower'
+
+def test_lookup_orders_by_weight():
+    index = PrefixIndex(ITEMS, size=10, precompute=2)
+    assert index.lookup('广州') == [('广州 天气', 80), ('广州地铁', 50), ('广州天河', 20), ('广州😀', 1)]
+    assert index.lookup('广州', size=2) == [('广州 天气', 80), ('广州地铁', 50)]
+    assert index.lookup('北京') == []
+    assert index.lookup('  ') == []
+
+def test_normalized_duplicates_merged():
+    index = PrefixIndex(ITEMS)
+    # 合并权重, 展示权重最大的写法
+    assert index.lookup('GUANG') == [('guangzhou tower', 12)]
+    assert len(index) == 7
+
+def test_precomputed_matches_scan():
+    precomputed = PrefixIndex(ITEMS, size=10, precompute=2)
+    scanned = PrefixIndex(ITEMS, size=10, precompute=0)
+    assert scanned.top == {}
+    for prefix in ('广', '广州', '广州地', 'g', 'gu', 'guangzhou t', '深', 'x'):
+        assert precomputed.lookup(prefix) == scanned.lookup(prefix)
+        assert [weight for text, weight in precomputed.lookup(prefix)] == brute(ITEMS, prefix, 10)
@@ -0,0 +1,76 @@
+# coding=utf-8
+
+import pytest
+from app import notify
+from app.api_v1 import tokens
+from app.api_v1.tokens import issue, parse, verify, Revocations, REVOKED
+from app.api_v1.resolver import resolver, Site
+from app.api_v1.decorator import check_token
+
+@pytest.fixture
+def signed(app, monkeypatch):
+    app.config.update(API_TOKEN_FORMAT='signed', API_TOKEN_TTL=1800, API_TOKEN_KEYS={'1': 'old-key', '2': 'new-key'}, API_TOKEN_CURRENT_KID='2')
+    monkeypatch.setattr(tokens, 'revocations', Revocations())
+    return app
+
+def test_issue_and_parse(signed):
+    token, expires = issue('app.key', 3)
+    assert expires == 1800
+    appkey, website_id, expiry, kid, payload, signature = parse(token)
+    assert (appkey, website_id, kid) == ('app.key', 3, '2')
+    assert token == '{0}.{1}'.format(payload, signature)
+    assert parse('v1.garbage') is None
+    assert parse('v2.a.3.100.1.sig') is None
+    assert parse('v1.a.x.100.1.sig') is None
+    assert parse(None) is None
+
+def test_verify(signed):
+    token, expires = issue('partner', 3)
+    assert verify(token, 'partner', 3)
+    assert not verify(token, 'other', 3)
+    assert not verify(token, 'partner', 4)
+    assert not verify(token[:-1] + ('0' if token[-1] != '0' else '1'), 'partner', 3)
+    # 换成别的appkey后签名不再匹配
+    assert not verify(token.replace('v1.partner.', 'v1.other.', 1), 'other', 3)
+
+def test_expiry(signed, monkeypatch):
+    token, expires = issue('partner', 3, ttl=60)
+    now = tokens.time()
+    monkeypatch.setattr(tokens, 'time', lambda: now + 61)
+    assert not verify(token, 'partner', 3)
+
+def test_key_rotation(signed):
+    signed.config['API_TOKEN_CURRENT_KID'] = '1'
+    old, expires = issue('partner', 3)
+    signed.config['API_TOKEN_CURRENT_KID'] = '2'
+    assert verify(old, 'partner', 3)
+    signed.config['API_TOKEN_KEYS'] = {'2': 'new-key'}
+    assert not verify(old, 'partner', 3)
+
+def test_revocation(signed, redis, monkeypatch):
+    published = []
+    monkeypatch.setattr(notify, 'publish', lambda topic, payload=None: published.append((topic, payload)))
+    token, expires = issue('partner', 3)
+    until = tokens.revocations.revoke('partner')
+    assert not verify(token, 'partner', 3)
+    assert published == [('tokens', {'appkey': 'partner', 'until': until})]
+    # 其他worker从redis加载同一份名单
+    other = Revocations()
+    other.load()
+    assert other.is_revoked('partner', until)
+    assert not other.is_revoked('partner', until + 1)
+    assert redis.zscore(REVOKED, 'partner') == until
+
+def test_revocations_kept_when_redis_down(signed, broken_redis):
+    revocations = Revocations()
+    revocations.on_notify({'appkey': 'partner', 'until': 2 ** 40})
+    revocations.load()
+    assert revocations.is_revoked('partner', 100)
+
+def test_check_token_signed(signed, monkeypatch):
+    monkeypatch.setattr(resolver, 'lookup', lambda appkey: Site(3, 'example.com', 100) if appkey == 'partner' else None)
+    token, expires = issue('partner', 3)
+    assert check_token('partner', token)
+    assert not check_token('unknown', token)
+    assert not check_token('partner', None)
+    assert not check_token('bad:appkey', token)
@@ -1,8 +1,9 @@
 # coding=utf-8
 
+import os
 from app import create_app
 
-application = create_app('production')
+application = create_app(os.getenv('FLASK_CONFIG') or 'production')
 
 if __name__ == '__main__':
     application.run()
\ No newline at end of file